@@ -2,12 +2,12 @@ import tkinter as tk
 from tkinter import scrolledtext, filedialog
 from tkinter import ttk
 import re
-from tokenizer import tokenize
-from Parser import Parser, SyntaxError
-from semantic_analyzer import SemanticAnalyzer
-from code_generator import CodeGenerator
-from utils import create_enhanced_symbol_table, print_symbol_table
-from optimizer import Optimizer
+from Parser import SyntaxError
+from utils import print_symbol_table
+from pipeline import Pipeline
+
+# A program that never terminates must not freeze the window
+EXECUTION_LIMITS = {'timeout': 5.0, 'max_cells': 1 << 20}
 
 
 class CompilerGUI(tk.Tk):
@@ -168,8 +168,7 @@ class CompilerGUI(tk.Tk):
     def show_optimized_Code(self):
         assembly_code = self.generated_assembly_code
         if assembly_code:
-            optimizer = Optimizer()
-            optimized_code = optimizer.optimize(assembly_code)
+            optimized_code = Pipeline().optimize(assembly_code)
 
             # Clear the output text area and insert the optimized code
             self.output_text.config(state=tk.NORMAL)
@@ -211,51 +210,31 @@ class CompilerGUI(tk.Tk):
     def show_tokens(self):
         self.output_text.config(state=tk.NORMAL)
         self.output_text.delete(1.0, tk.END)
-        try:
-            tokens = tokenize(self.code_text.get(1.0, tk.END))
-            token_str = "\n".join([str(token) for token in tokens])
-            self.output_text.insert(tk.END, token_str)
-        except SyntaxError as e:
-            self.output_text.insert(tk.END, f"SyntaxError: {str(e)}\n")
-        self.output_text.config(state=tk.DISABLED)
-
-    def show_symbol_table(self):
-        self.output_text.config(state=tk.NORMAL)
-        self.output_text.delete(1.0, tk.END)
-        try:
-            tokens = tokenize(self.code_text.get(1.0, tk.END))
-            parser = Parser(tokens)
-            program = parser.parse()
-            semantic_analyzer = SemanticAnalyzer()
-            semantic_analyzer.visit(program)
-            symbol_table_str = print_symbol_table(
-                create_enhanced_symbol_table(program))
-            self.output_text.insert(tk.END, symbol_table_str)
-        except SyntaxError as e:
-            self.output_text.insert(tk.END, f"SyntaxError: {str(e)}\n")
+        tokens, errors = Pipeline().tokenize(self.code_text.get(1.0, tk.END))
+        token_str = "\n".join([str(token) for token in tokens])
+        self.output_text.insert(tk.END, token_str)
+        for error in errors:
+            self.output_text.insert(tk.END, f"\n{error}")
         self.output_text.config(state=tk.DISABLED)
 
     def run_code_generator(self):
         self.output_text.config(state=tk.NORMAL)
         self.output_text.delete(1.0, tk.END)
         source_code = self.code_text.get(1.0, tk.END)
-        tokens, errors = tokenize(source_code)
+        pipeline = Pipeline()
+        tokens, errors = pipeline.tokenize(source_code)
         if not errors:
-            parser = Parser(tokens, source_code)
             try:
-                parser.parse()
-                symbol_table = create_enhanced_symbol_table(tokens)
-                semantic_analyzer = SemanticAnalyzer()
-                semantic_analyzer.analyze_code(tokens)
-                code_generator = CodeGenerator()
-                code_generator.set_symbol_table(symbol_table)
-                assembly_code = code_generator.generate_code(tokens)
+                pipeline.parse(tokens, source_code)
+                symbol_table = pipeline.build_symbol_table(tokens)
+                pipeline.analyze(tokens)
+                assembly_code = pipeline.generate(tokens, symbol_table)
                 self.generated_assembly_code = assembly_code  # Store the generated code
                 self.output_text.insert(tk.END, "Generated Assembly Code:\n\n")
                 self.output_text.insert(tk.END, f"{assembly_code}\n")
 
                 # Execute the code to get the output
-                output = execute_assembly_code(assembly_code)
+                output = self.execute_code(pipeline, assembly_code)
                 self.output_text.insert(tk.END, "\nOutput:\n\n")
                 self.output_text.insert(tk.END, f"{output}\n")
 
@@ -274,9 +253,10 @@ class CompilerGUI(tk.Tk):
         self.output_text.config(state=tk.NORMAL)
         self.output_text.delete(1.0, tk.END)
         source_code = self.code_text.get(1.0, tk.END)
-        tokens, errors = tokenize(source_code)
+        pipeline = Pipeline()
+        tokens, errors = pipeline.tokenize(source_code)
         if not errors:
-            symbol_table = create_enhanced_symbol_table(tokens)
+            symbol_table = pipeline.build_symbol_table(tokens)
             output = print_symbol_table(symbol_table)
             self.output_text.insert(tk.END, output)  # Insert formatted output
         else:
@@ -290,7 +270,7 @@ class CompilerGUI(tk.Tk):
         self.output_text.config(state=tk.NORMAL)
         self.output_text.delete(1.0, tk.END)
         if self.generated_assembly_code:
-            output = execute_assembly_code(self.generated_assembly_code)
+            output = self.execute_code(Pipeline(), self.generated_assembly_code)
             self.output_text.insert(tk.END, "Output:\n\n")
             self.output_text.insert(tk.END, f"{output}\n")
         else:
@@ -298,13 +278,25 @@ class CompilerGUI(tk.Tk):
                 tk.END, "No generated assembly code to execute.\n")
         self.output_text.config(state=tk.DISABLED)
 
+    def execute_code(self, pipeline, assembly_code):
+        # Run under the window's limits; a run that stops early or faults
+        # says where and why after its output
+        vm = pipeline.execute(assembly_code, **EXECUTION_LIMITS)
+        output = vm.memory_dump()
+        if not vm.result().completed:
+            output = "\n".join(filter(None, [output, vm.result().describe()]))
+        return output
+
     def run_compiler(self):
         self.output_text.config(state=tk.NORMAL)
         self.output_text.delete(1.0, tk.END)
         source_code = self.code_text.get(1.0, tk.END)
 
+        # Every phase is timed; the table goes below the output
+        pipeline = Pipeline(verbose=True)
+
         # Tokenize source code
-        tokens, errors = tokenize(source_code)
+        tokens, errors = pipeline.tokenize(source_code)
 
         if errors:
             self.output_text.insert(tk.END, "Errors in source code:\n")
@@ -312,29 +304,24 @@ class CompilerGUI(tk.Tk):
                 self.output_text.insert(tk.END, f"{error}\n")
         else:
             # Parsing phase
-            parser = Parser(tokens, source_code)
             try:
-                parser.parse()
+                pipeline.parse(tokens, source_code)
                 self.output_text.insert(
                     tk.END, "Parsing completed successfully.\n")
 
                 # Semantic analysis phase
-                semantic_analyzer = SemanticAnalyzer()
                 try:
-                    semantic_analyzer.analyze_code(tokens)
+                    pipeline.analyze(tokens)
                     self.output_text.insert(
                         tk.END, "Semantic analysis completed successfully.\n")
 
                     # Code generation phase
-                    symbol_table = create_enhanced_symbol_table(tokens)
-                    code_generator = CodeGenerator()
-                    code_generator.set_symbol_table(symbol_table)
-                    assembly_code = code_generator.generate_code(tokens)
+                    symbol_table = pipeline.build_symbol_table(tokens)
+                    assembly_code = pipeline.generate(tokens, symbol_table)
                     self.generated_assembly_code = assembly_code
 
                     # Optimization phase
-                    optimizer = Optimizer()
-                    optimized_code = optimizer.optimize(assembly_code)
+                    optimized_code = pipeline.optimize(assembly_code)
 
                     # Store the optimized code
                     self.generated_assembly_code = optimized_code
@@ -346,9 +333,11 @@ class CompilerGUI(tk.Tk):
                     self.output_text.insert(tk.END, f"{optimized_code}\n")
 
                     # Execute the code to get the output
-                    output = execute_assembly_code(optimized_code)
+                    output = self.execute_code(pipeline, optimized_code)
                     self.output_text.insert(tk.END, "\nOutput:\n\n")
                     self.output_text.insert(tk.END, f"{output}\n")
+                    self.output_text.insert(tk.END, "\nPhase timings:\n\n")
+                    self.output_text.insert(tk.END, f"{pipeline.tracer.format_summary()}\n")
 
                 except ValueError as e:
                     # Handle semantic errors
@@ -424,39 +413,6 @@ class CompilerGUI(tk.Tk):
                     "identifier", f"1.0+{start}c", f"1.0+{end}c")
 
 
-def execute_assembly_code(assembly_code):
-    # Simulate executing the generated assembly code
-    # This function should interpret the generated assembly code
-    # For the purpose of this example, we will handle simple instructions like LOAD, STORE, ADD
-    memory = {}
-    registers = {'r1': 0, 'r2': 0}
-
-    lines = assembly_code.splitlines()
-
-    for line in lines:
-        parts = line.split()
-        instruction = parts[0]
-
-        if instruction == "LOAD":
-            value = int(parts[1].strip(','))
-            register = parts[2]
-            registers[register] = value
-        elif instruction == "STORE":
-            register = parts[1].strip(',')
-            address = int(parts[2])
-            memory[address] = registers[register]
-        elif instruction == "ADD":
-            value = int(parts[1].strip(','))
-            src_register = parts[2].strip(',')
-            dest_register = parts[3]
-            registers[dest_register] = registers[src_register] + value
-
-    # Generate output
-    output = "\n".join(
-        f"Memory[{address}] = {value}" for address, value in sorted(memory.items()))
-    return output
-
-
 if __name__ == "__main__":
     app = CompilerGUI()
     app.mainloop()
@@ -22,13 +22,22 @@ class SyntaxError(Exception):
 
 
 class Parser:
-    def __init__(self, tokens, source_code):
+    def __init__(self, tokens, source_code, verbose=True, imports=None):
         self.tokens = tokens
+        self.verbose = verbose  # Trace parsing progress on stdout
         self.source_code = source_code
         self.source_lines = source_code.split('\n')
         self.current_index = 0
         self.current_token = tokens[self.current_index] if tokens else None
         self.symbol_table = {}  # Initialize the symbol table
+        self.function_table = {}  # Function name -> number of parameters
+        self.in_function = False
+        # Module name -> interface of the modules an import may name; see linker.py
+        self.imports = imports or {}
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
 
     def advance(self):
         """Move to the next token in the list."""
@@ -48,6 +57,10 @@ class Parser:
         """Check if a variable has been declared."""
         return identifier in self.symbol_table
 
+    def function_declared(self, name):
+        """Check if a function has been defined."""
+        return name in self.function_table
+
     def eat(self, expected_type):
         """Consume the next token if it matches expected_type; otherwise, raise a syntax error."""
         if self.current_token is None:
@@ -55,7 +68,7 @@ class Parser:
                 f"Unexpected end of input while expecting {expected_type}"
             )
         if self.current_token['type'] == expected_type:
-            print(
+            self.log(
                 f"Eating token: Type: {expected_type}, Value: {self.current_token['value']}"
             )
             self.advance()
@@ -73,25 +86,28 @@ class Parser:
             )
 
     def parse(self):
-        print("Starting parsing...")
+        self.log("Starting parsing...")
         try:
             while self.current_token:
                 self.statement()
-        except SyntaxError as e:
-            raise e
+        except SyntaxError:
+            raise
         except Exception as e:
-            raise SyntaxError(f"Caught exception: {str(e)}")
-        finally:
-            if self.is_acceptable_end():
-                print("Parsing completed successfully.")
-            else:
-                raise SyntaxError("Unexpected end of input.")
+            if self.current_token is None:
+                # A statement ran off the last token
+                raise SyntaxError("Unexpected end of input.") from e
+            raise SyntaxError(f"Caught exception: {str(e)}") from e
+        if not self.is_acceptable_end():
+            raise SyntaxError("Unexpected end of input.")
+        self.log("Parsing completed successfully.")
 
     def statement(self):
         """Identify and process different types of statements based on the current token."""
         try:
             if self.current_token['type'] == 'DATATYPE':
                 self.declaration_statement()
+            elif self.current_token['type'] == 'IMPORT':
+                self.import_statement()
             elif self.current_token['type'] in ['IFF', 'MAYBE', 'ORELSE']:
                 self.conditional_statement()
             elif self.current_token['type'] in ['ITERATE', 'WHILST']:
@@ -100,11 +116,16 @@ class Parser:
                 self.function_definition()
             elif self.current_token['type'] == 'VARIABLE':
                 self.assignment_statement()  # Ensure this handles cases like `v-i = v-i + 1`
+            elif self.current_token['type'] == 'FUNCTION_CALL':
+                self.call_expression()
+                self.eat('STATEMENT_TERMINATOR')
+            elif self.current_token['type'] == 'RETURN':
+                self.return_statement()
             else:
                 raise SyntaxError("Unexpected statement type",
                                   self.current_token)
         except SyntaxError as e:
-            print(f"Syntax error: {e}")
+            self.log(f"Syntax error: {e}")
             raise
 
     def assignment_statement(self):
@@ -122,8 +143,23 @@ class Parser:
         self.expression()  # Handle the expression to the right of the '='
         self.eat('STATEMENT_TERMINATOR')
 
+    def import_statement(self):
+        """Parse `import name,` and declare everything the module exports."""
+        if self.in_function:
+            self.raise_syntax_error("'import' inside a function")
+        module = self.current_token['value'].split()[1]
+        if module not in self.imports:
+            self.raise_syntax_error(f"Module '{module}' not found")
+        self.eat('IMPORT')
+        self.eat('STATEMENT_TERMINATOR')
+        interface = self.imports[module]
+        for identifier in interface['globals']:
+            self.symbol_table[identifier] = True
+        for name, function in interface['functions'].items():
+            self.function_table[name] = len(function['params'])
+
     def declaration_statement(self):
-        print(
+        self.log(
             f"Processing token: {self.current_token['type']} with value '{self.current_token['value']}'")
         self.eat('DATATYPE')
         variable_name = self.current_token['value']
@@ -141,10 +177,10 @@ class Parser:
 
         # Debugging output
         if self.current_token:
-            print(
+            self.log(
                 f"Debug: Finished processing declaration, next token: {self.current_token}")
         else:
-            print("Debug: Finished processing declaration, no more tokens.")
+            self.log("Debug: Finished processing declaration, no more tokens.")
 
         self.eat('STATEMENT_TERMINATOR')
 
@@ -186,7 +222,7 @@ class Parser:
         # Continue parsing if the current token is an operator
         while self.current_token and self.current_token['type'] == 'OPERATOR':
             operator_token = self.current_token
-            print(f"Operator token: {operator_token}")
+            self.log(f"Operator token: {operator_token}")
             self.advance()  # Consume the operator
             self.term()  # Parse the next term
 
@@ -233,24 +269,68 @@ class Parser:
                 break
 
     def function_definition(self):
+        function_name = self.current_token['value'].split()[1]
         self.eat('FUNCTION_DEF')
+        # Parameters and locals are only visible inside the function body
+        outer_symbols = dict(self.symbol_table)
         self.eat('LPAREN')
+        parameters = []
         if self.current_token['type'] == 'DATATYPE':
-            self.parameter_list()
+            parameters = self.parameter_list()
         self.eat('RPAREN')
+        # Register before the body so recursive calls resolve
+        self.function_table[function_name] = len(parameters)
+        self.in_function = True
         self.eat('LCURLY')
         while self.current_token and self.current_token['type'] != 'RCURLY':
             self.statement()
         self.eat('RCURLY')
+        self.in_function = False
+        self.symbol_table = outer_symbols
 
     def parameter_list(self):
         """ Handle parameter lists in function definitions. """
+        parameters = []
         self.eat('DATATYPE')
+        parameters.append(self.current_token['value'])
+        self.symbol_table[self.current_token['value']] = True
         self.eat('VARIABLE')
-        while self.current_token and self.current_token['type'] == 'COMMA':
+        # ',' is always tokenized as STATEMENT_TERMINATOR, so accept both
+        while self.current_token and self.current_token['type'] in ['COMMA', 'STATEMENT_TERMINATOR']:
             self.advance()
             self.eat('DATATYPE')
+            parameters.append(self.current_token['value'])
+            self.symbol_table[self.current_token['value']] = True
             self.eat('VARIABLE')
+        return parameters
+
+    def call_expression(self):
+        """ Parse a call such as `add(v-a, 2)`. """
+        if not self.function_declared(self.current_token['value']):
+            raise SyntaxError(
+                f"Function '{self.current_token['value']}' called before definition",
+                token=self.current_token,
+                code_line=self.fetch_line_content(self.current_token['line']),
+                line_number=self.current_token['line'],
+                expected_tokens=['FUNCTION_DEF']
+            )
+        self.eat('FUNCTION_CALL')
+        self.eat('LPAREN')
+        if self.current_token and self.current_token['type'] != 'RPAREN':
+            self.expression()
+            while self.current_token and self.current_token['type'] in ['COMMA', 'STATEMENT_TERMINATOR']:
+                self.advance()
+                self.expression()
+        self.eat('RPAREN')
+
+    def return_statement(self):
+        """ Parse `ret <expression>,` or a bare `ret,` inside a function body. """
+        if not self.in_function:
+            self.raise_syntax_error("'ret' outside of a function")
+        self.eat('RETURN')
+        if self.current_token and self.current_token['type'] != 'STATEMENT_TERMINATOR':
+            self.expression()
+        self.eat('STATEMENT_TERMINATOR')
 
     def block(self):
         """ Parse a block of statements. """
@@ -296,12 +376,9 @@ class Parser:
                                   self.current_token['line']),
                               self.current_token['line'] if self.current_token is not None else 0)
 
-        # Check if more tokens are expected after the loop
-        if self.current_token and not self.is_acceptable_end():
-            raise SyntaxError(
-                "Unexpected tokens after loop block", self.current_token)
-        elif not self.current_token:
-            print("Reached the logical end of input.")
+        # A loop is an ordinary statement and may be followed by more code
+        if not self.current_token:
+            self.log("Reached the logical end of input.")
 
     def iterate_loop(self):
         self.eat('ITERATE')
@@ -312,6 +389,7 @@ class Parser:
 
         # Process the condition part
         self.condition_expression()  # Parse the condition expression
+        self.eat('STATEMENT_TERMINATOR')
 
         # Process the increment/decrement part
         self.increment_decrement_statement()  # Parse the increment/decrement
@@ -376,9 +454,11 @@ class Parser:
                     line_number=self.current_token['line'],
                     expected_tokens=['VARIABLE']
                 )
-            print(
+            self.log(
                 f"Consuming primary expression token: Type: {self.current_token['type']}, Value: {self.current_token['value']}")
             self.advance()  # Directly consume the primary token
+        elif self.current_token['type'] == 'FUNCTION_CALL':
+            self.call_expression()
         elif self.current_token['type'] == 'LPAREN':
             self.advance()  # Consume '(' for sub-expressions
             self.expression()
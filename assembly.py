@@ -0,0 +1,138 @@
+import re
+
+# Operands are separated by commas; string literals may contain commas
+OPERAND_REGEX = re.compile(r'"[^"]*"|[^,\s]+')
+REGISTER_REGEX = re.compile(r'^(f?r\d+|rv)$')
+
+# Opcodes that read a source operand and write a register
+LOAD_OPCODES = {'LOAD', 'FLOAD', 'MOV', 'LDC'}
+STORE_OPCODES = {'STORE', 'FSTORE'}
+# Three-operand ALU instructions: OP src, ra, rd computes rd = ra OP src
+ALU_OPCODES = {'ADD', 'SUB', 'MUL', 'DIV', 'LT', 'LE', 'GT', 'GE', 'EQ', 'NE'}
+# How each ALU opcode combines ra (left) with src (right)
+ALU_OPERATIONS = {
+    'ADD': lambda a, b: a + b,
+    'SUB': lambda a, b: a - b,
+    'MUL': lambda a, b: a * b,
+    'DIV': lambda a, b: a // b if isinstance(a, int) and isinstance(b, int) else a / b,
+    'LT': lambda a, b: int(a < b),
+    'LE': lambda a, b: int(a <= b),
+    'GT': lambda a, b: int(a > b),
+    'GE': lambda a, b: int(a >= b),
+    'EQ': lambda a, b: int(a == b),
+    'NE': lambda a, b: int(a != b),
+}
+# Conditional branches: JZ reg, label jumps when reg is zero, JNZ when it is not
+BRANCH_OPCODES = {'JZ', 'JNZ'}
+# Instructions after which control never falls through
+TERMINATOR_OPCODES = {'JMP', 'RET', 'HALT'}
+# Instructions that must never be deleted even when their result looks unused
+SIDE_EFFECT_OPCODES = {'STORE', 'FSTORE', 'STR', 'PUSH', 'CALL', 'ENTER',
+                       'RET', 'HALT', 'JMP', 'JZ', 'JNZ', 'IF'}
+
+
+def split_operands(operand_text):
+    """Split an operand list on commas, keeping string literals whole."""
+    return OPERAND_REGEX.findall(operand_text)
+
+
+def parse_literal(text):
+    if text.startswith('"'):
+        return text.strip('"')
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def is_register(operand):
+    return REGISTER_REGEX.match(operand) is not None
+
+
+def is_memory(operand):
+    return operand.startswith('[')
+
+
+class Instruction:
+    """One line of generated assembly, split into opcode and operands."""
+
+    __slots__ = ('text', 'opcode', 'operands')
+
+    def __init__(self, text):
+        text = text.strip()
+        self.text = text
+        if not text or text.startswith(';'):
+            self.opcode = ';'
+            self.operands = []
+        elif text.endswith(':'):
+            self.opcode = 'LABEL'
+            self.operands = [text[:-1]]
+        else:
+            opcode, _, operand_text = text.partition(' ')
+            self.opcode = opcode
+            self.operands = split_operands(operand_text.strip())
+
+    def __repr__(self):
+        return f"Instruction({self.text!r})"
+
+    @classmethod
+    def build(cls, opcode, *operands):
+        return cls(f"{opcode} {', '.join(str(operand) for operand in operands)}"
+                   if operands else opcode)
+
+    @property
+    def is_comment(self):
+        return self.opcode == ';'
+
+    @property
+    def is_label(self):
+        return self.opcode == 'LABEL'
+
+    @property
+    def has_side_effects(self):
+        return self.opcode in SIDE_EFFECT_OPCODES
+
+    def branch_target(self):
+        """The label this instruction may transfer control to, if any."""
+        if self.opcode == 'JMP':
+            return self.operands[0]
+        if self.opcode in BRANCH_OPCODES:
+            return self.operands[1]
+        return None
+
+    def call_target(self):
+        return self.operands[0] if self.opcode == 'CALL' else None
+
+    def register_written(self):
+        if self.opcode in LOAD_OPCODES:
+            return self.operands[1]
+        if self.opcode in ALU_OPCODES:
+            return self.operands[2]
+        if self.opcode == 'CALL':
+            return 'rv'
+        return None
+
+    def registers_read(self):
+        if self.opcode in LOAD_OPCODES or self.opcode == 'PUSH':
+            candidates = self.operands[:1]
+        elif self.opcode in STORE_OPCODES or self.opcode in BRANCH_OPCODES:
+            candidates = self.operands[:1]
+        elif self.opcode in ALU_OPCODES:
+            candidates = self.operands[:2]
+        elif self.opcode == 'RET':
+            candidates = ['rv']
+        else:
+            candidates = []
+        return [operand for operand in candidates if is_register(operand)]
+
+    def memory_read(self):
+        """The address read by this instruction, as written in the operand."""
+        if self.opcode in LOAD_OPCODES or self.opcode == 'PUSH' or self.opcode in ALU_OPCODES:
+            if self.operands and is_memory(self.operands[0]):
+                return self.operands[0].strip('[]')
+        return None
+
+    def memory_written(self):
+        if self.opcode in STORE_OPCODES or self.opcode == 'STR':
+            return self.operands[1]
+        return None
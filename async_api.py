@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from build import compile_source as compile_program
+from cache import ArtifactCache
+from vm import VirtualMachine, decode
+
+# Compiles and runs in flight at once per AsyncCompiler, whatever the pool size
+DEFAULT_CONCURRENCY = 8
+
+
+def _run_assembly(assembly_code, limits):
+    # Module level so a process pool can pickle it
+    vm = VirtualMachine(assembly_code, **limits).run()
+    return vm.result(), vm.memory_dump()
+
+
+class AsyncCompiler:
+    """Compiles and runs Enigma programs off the event loop.
+
+    The pipeline is plain blocking Python, so every call is handed to an
+    executor: 'thread' (the default) suits services that mostly wait on
+    I/O, 'process' gives real parallelism for CPU-heavy batches, and any
+    concurrent.futures.Executor can be passed in instead. At most
+    max_concurrency calls are in flight at once; the rest wait on a
+    semaphore without occupying a worker.
+
+    Cancelling a run on the thread executor stops the VirtualMachine at
+    its next instruction. Work already handed to a process, and any
+    compile, runs to completion in the background, so give runs on a
+    process pool a timeout or an instruction limit.
+    """
+
+    def __init__(self, executor='thread', max_workers=None, max_concurrency=DEFAULT_CONCURRENCY):
+        if executor == 'thread':
+            executor = ThreadPoolExecutor(max_workers=max_workers,
+                                          thread_name_prefix='enigma-compiler')
+            self.owns_executor = True
+        elif executor == 'process':
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+            self.owns_executor = True
+        elif isinstance(executor, Executor):
+            self.owns_executor = False
+        else:
+            raise ValueError(f"Unknown executor {executor!r}; use 'thread', 'process' "
+                             f"or a concurrent.futures.Executor")
+        self.executor = executor
+        self.in_process = isinstance(executor, ProcessPoolExecutor)
+        self.max_concurrency = max_concurrency
+        self.semaphore = None  # Created on first use, inside the running loop
+        self.cache = ArtifactCache()
+        self.pending = {}  # Cache key -> the compile already under way for it
+
+    async def _submit(self, function, *arguments):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor,
+                                              functools.partial(function, *arguments))
+
+    async def compile_source(self, source_code, level=2):
+        """(generated assembly, optimized assembly) for source_code.
+
+        Raises what build.compile_source raises; identical sources at the
+        same level are only compiled once, even when requested together.
+        """
+        key = self.cache.key(source_code, level)
+        artifacts = self.cache.get(key)
+        if artifacts is not None:
+            return artifacts
+        compiling = self.pending.get(key)
+        if compiling is None:
+            compiling = asyncio.ensure_future(self._submit(compile_program, source_code, level))
+            compiling.add_done_callback(functools.partial(self._compiled, key))
+            self.pending[key] = compiling
+        # Shielded: one caller giving up must not cancel the others' compile
+        return await asyncio.shield(compiling)
+
+    def _compiled(self, key, compiling):
+        del self.pending[key]
+        if not compiling.cancelled() and compiling.exception() is None:
+            self.cache.put(key, compiling.result())
+
+    async def run_assembly(self, assembly_code, **limits):
+        """Run assembly on a VirtualMachine; returns (ExecutionResult, memory dump).
+
+        limits are VirtualMachine's max_instructions, timeout and max_cells.
+        """
+        if self.in_process:
+            return await self._submit(_run_assembly, assembly_code, limits)
+        vm = VirtualMachine(await self._submit(decode, assembly_code), **limits)
+        try:
+            await self._submit(vm.run)
+        except asyncio.CancelledError:
+            # The awaiting task is gone but the worker thread is still
+            # running the program; stop it there too
+            vm.cancel()
+            raise
+        return vm.result(), vm.memory_dump()
+
+    async def run_program(self, source_code, level=2, **limits):
+        """Compile source_code and run the optimized assembly."""
+        _, optimized_code = await self.compile_source(source_code, level)
+        return await self.run_assembly(optimized_code, **limits)
+
+    def close(self, wait=True):
+        if self.owns_executor:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+_default_compiler = None
+
+
+def default_compiler():
+    """The AsyncCompiler behind the module-level functions, a thread pool."""
+    global _default_compiler
+    if _default_compiler is None:
+        _default_compiler = AsyncCompiler()
+    return _default_compiler
+
+
+async def compile_source(source_code, level=2):
+    return await default_compiler().compile_source(source_code, level)
+
+
+async def run_program(source_code, level=2, **limits):
+    return await default_compiler().run_program(source_code, level, **limits)
+
+
+async def _main(paths, level, executor, concurrency, limits):
+    async with AsyncCompiler(executor, max_concurrency=concurrency) as compiler:
+        async def run_file(path):
+            with open(path) as file:
+                return await compiler.run_program(file.read(), level, **limits)
+        outcomes = await asyncio.gather(*(run_file(path) for path in paths),
+                                        return_exceptions=True)
+    for path, outcome in zip(paths, outcomes):
+        print(f"== {path}")
+        if isinstance(outcome, Exception):
+            print(f"{type(outcome).__name__}: {outcome}")
+            continue
+        result, output = outcome
+        print(output)
+        if not result.completed:
+            print(result.describe())
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(
+        description="Compile and run Enigma programs concurrently on an event loop.")
+    argument_parser.add_argument('sources', nargs='+', help="Enigma source files")
+    argument_parser.add_argument('-O', dest='level', default='2',
+                                 help="optimization level 0-3 (default 2)")
+    argument_parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    argument_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                                 help=f"programs in flight at once (default {DEFAULT_CONCURRENCY})")
+    argument_parser.add_argument('--timeout', type=float, default=5.0,
+                                 help="seconds before stopping each program (default 5)")
+    arguments = argument_parser.parse_args()
+
+    from pass_manager import parse_level
+    asyncio.run(_main(arguments.sources,
+                      parse_level(arguments.level), arguments.executor,
+                      arguments.concurrency, {'timeout': arguments.timeout}))
@@ -0,0 +1,346 @@
+import argparse
+import json
+
+try:
+    import numpy as np
+except ImportError:  # Batch execution is optional; the scalar VM needs no numpy
+    np = None
+
+from assembly import ALU_OPERATIONS
+from vm import ADDRESS_STEP, GLOBAL_BASE, decode
+
+# Lane-wise versions of ALU_OPERATIONS. Comparisons give 0/1 enums like the
+# scalar VM rather than numpy booleans.
+BATCH_OPERATIONS = {
+    'ADD': lambda a, b: a + b,
+    'SUB': lambda a, b: a - b,
+    'MUL': lambda a, b: a * b,
+    'LT': lambda a, b: _as_enum(a < b),
+    'LE': lambda a, b: _as_enum(a <= b),
+    'GT': lambda a, b: _as_enum(a > b),
+    'GE': lambda a, b: _as_enum(a >= b),
+    'EQ': lambda a, b: _as_enum(a == b),
+    'NE': lambda a, b: _as_enum(a != b),
+}
+OPCODE_OF_OPERATION = {operation: opcode for opcode, operation in ALU_OPERATIONS.items()}
+
+
+def _as_enum(condition):
+    return condition.astype(np.int64) if isinstance(condition, np.ndarray) else int(condition)
+
+
+def _is_integer(value):
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in 'iu'
+    return isinstance(value, (int, np.integer))
+
+
+def _is_text(value):
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in 'USO'
+    return isinstance(value, str)
+
+
+class BatchVirtualMachine:
+    """Runs one decoded Program over N independent lanes at once.
+
+    Registers and memory cells hold either a plain value shared by every
+    lane or a NumPy array with one value per lane, so arithmetic on a cell
+    or register costs one vectorised operation however many lanes there
+    are. Lanes are the records of a batch: inputs seed global cells per
+    lane before the run, and results are read back per lane afterwards.
+    Inputs are globals the program declares without a value (enum v-x,),
+    keyed by address or, given the code generator's symbol table, by name.
+
+    While every live lane is at the same instruction the machine runs it
+    once for all of them. A branch that goes different ways in different
+    lanes splits them: each lane then keeps its own pc, the machine always
+    runs the lowest pc any lane waits at, for just the lanes there, and
+    merges writes with the lanes that are not. Lanes rejoin as soon as they
+    reach the same instruction again, at the latest where the branches
+    meet.
+
+    A CALL runs the function for just the lanes making it, while every
+    other lane stays parked on the call stack with the caller's pcs, and
+    a RET waits until no calling lane is still inside the function. Lanes
+    may therefore recurse to different depths. Integers are 64-bit
+    throughout, so intermediate results wrap where the scalar VM only
+    wraps on store.
+    """
+
+    def __init__(self, program, inputs=None, size=None, symbol_table=None):
+        if np is None:
+            raise ImportError("Batch execution needs numpy")
+        if isinstance(program, str):
+            program = decode(program)
+        self.program = program
+        inputs = {self._input_cell(key, symbol_table): np.asarray(values)
+                  for key, values in (inputs or {}).items()}
+        sizes = {len(values) for values in inputs.values()} | ({size} if size else set())
+        if len(sizes) != 1:
+            raise ValueError(f"Batch needs one size for every input, got {sorted(sizes)}")
+        self.size = sizes.pop()
+        self.instructions = [
+            (getattr(BatchVirtualMachine, handler.__name__), arguments)
+            for handler, arguments in program.instructions]
+        self.cells = [0] * program.stack_cell
+        self.written = [False] * program.stack_cell  # Per cell: False, True or a lane mask
+        for cell, values in inputs.items():
+            self.cells[cell] = values
+            self.written[cell] = True
+        self.registers = [0] * len(program.registers)
+        self.call_stack = []
+        self.fp = self.sp = program.stack_cell
+        self.pc = 0
+        self.lane_pcs = None  # Per-lane pcs while lanes are split, else None
+        self.live = None  # Lanes that have not halted, or None for all of them
+
+    def _input_cell(self, key, symbol_table):
+        if isinstance(key, str):
+            if symbol_table is None or key not in symbol_table:
+                raise ValueError(f"Unknown input variable '{key}'")
+            key = symbol_table[key]['memory_location']
+        cell = (key - GLOBAL_BASE) // ADDRESS_STEP
+        if not 0 <= cell < self.program.stack_cell:
+            raise ValueError(f"Input address {key} is not a global of this program")
+        return cell
+
+    def run(self):
+        instructions = self.instructions
+        end = len(instructions)
+        while True:
+            if self.lane_pcs is None:
+                if self.pc >= end:
+                    break
+                handler, arguments = instructions[self.pc]
+                self.pc += 1
+                handler(self, self.live, *arguments)
+                continue
+            pc = self._next_pc(end)
+            if pc >= end:
+                break
+            if self.lane_pcs is None:
+                continue
+            mask = self.lane_pcs == pc
+            if self.live is None and mask.all() or self.live is not None and (mask == self.live).all():
+                # Every live lane is here again, so carry on as one
+                self.lane_pcs = None
+                self.pc = pc
+                continue
+            handler, arguments = instructions[pc]
+            self.lane_pcs[mask] = pc + 1
+            self.pc = pc + 1
+            handler(self, mask, *arguments)
+        return self
+
+    def _next_pc(self, end):
+        pc = int(self.lane_pcs.min())
+        if pc < end and self.instructions[pc][0] is BatchVirtualMachine._return:
+            # Lanes at a RET must wait for the ones still in the function
+            waiting = np.zeros(self.size, dtype=bool)
+            for index in np.unique(self.lane_pcs):
+                if index < end and self.instructions[index][0] is BatchVirtualMachine._return:
+                    waiting |= self.lane_pcs == index
+            busy = (self.lane_pcs < end) & ~waiting
+            if busy.any():
+                return int(self.lane_pcs[busy].min())
+            # Every live lane is at a RET; they all return to the same caller
+            self.lane_pcs = None
+            self.pc = pc
+        return pc
+
+    def lane(self, index):
+        """The globals one lane left behind: address -> value, like VirtualMachine.globals()."""
+        result = {}
+        for cell in range(self.program.stack_cell):
+            value, written = self.cells[cell], self.written[cell]
+            if written is False or written is not True and not written[index]:
+                continue
+            if isinstance(value, np.ndarray):
+                value = value[index]
+            if isinstance(value, np.generic):
+                value = value.item()
+            result[GLOBAL_BASE + cell * ADDRESS_STEP] = value
+        return result
+
+    def globals(self):
+        """Every written global as an array with one value per lane."""
+        return {GLOBAL_BASE + cell * ADDRESS_STEP: np.broadcast_to(self.cells[cell], self.size)
+                for cell in range(self.program.stack_cell) if self.written[cell] is not False}
+
+    def _merge(self, mask, value, old):
+        if mask is None:
+            return value
+        if _is_text(value) or _is_text(old):
+            # numpy would turn the numbers into text; an object array keeps both
+            return np.where(mask, np.asarray(value, dtype=object), np.asarray(old, dtype=object))
+        return np.where(mask, value, old)
+
+    def _read(self, cell):
+        return self.cells[cell] if cell < len(self.cells) else 0
+
+    def _write(self, mask, cell, value):
+        if cell >= len(self.cells):
+            self.cells.extend([0] * (cell + 1 - len(self.cells)))
+            self.written.extend([False] * (cell + 1 - len(self.written)))
+        if type(value) is int and not -(1 << 63) <= value < (1 << 63):
+            value = (value + (1 << 63)) % (1 << 64) - (1 << 63)
+        self.cells[cell] = self._merge(mask, value, self.cells[cell])
+        written = self.written[cell]
+        if mask is None or written is True:
+            self.written[cell] = True if mask is None else written
+        else:
+            self.written[cell] = mask.copy() if written is False else written | mask
+
+    def _set_register(self, mask, destination, value):
+        self.registers[destination] = self._merge(mask, value, self.registers[destination])
+
+    def _load_immediate(self, mask, value, destination):
+        self._set_register(mask, destination, value)
+
+    def _load_register(self, mask, source, destination):
+        self._set_register(mask, destination, self.registers[source])
+
+    def _load_memory(self, mask, cell, destination):
+        self._set_register(mask, destination, self._read(cell))
+
+    def _load_frame(self, mask, offset, destination):
+        self._set_register(mask, destination, self._read(self.fp + offset))
+
+    def _store_memory(self, mask, source, cell):
+        self._write(mask, cell, self.registers[source])
+
+    def _store_frame(self, mask, source, offset):
+        self._write(mask, self.fp + offset, self.registers[source])
+
+    def _store_literal_memory(self, mask, value, cell):
+        self._write(mask, cell, value)
+
+    def _store_literal_frame(self, mask, value, offset):
+        self._write(mask, self.fp + offset, value)
+
+    def _operate(self, mask, operation, left, right, destination):
+        opcode = OPCODE_OF_OPERATION[operation]
+        if opcode == 'DIV':
+            if mask is not None and isinstance(right, np.ndarray):
+                right = np.where(mask, right, 1)  # Idle lanes must not divide by zero
+            live_right = right[mask] if mask is not None and isinstance(right, np.ndarray) else right
+            if np.any(np.asarray(live_right) == 0):
+                raise ZeroDivisionError("division by zero in at least one lane")
+            if _is_integer(left) and _is_integer(right):
+                value = left // right
+            else:
+                value = left / right
+        else:
+            value = BATCH_OPERATIONS[opcode](left, right)
+        self._set_register(mask, destination, value)
+
+    def _alu_immediate(self, mask, operation, value, left, destination):
+        self._operate(mask, operation, self.registers[left], value, destination)
+
+    def _alu_register(self, mask, operation, source, left, destination):
+        self._operate(mask, operation, self.registers[left], self.registers[source], destination)
+
+    def _alu_memory(self, mask, operation, cell, left, destination):
+        self._operate(mask, operation, self.registers[left], self._read(cell), destination)
+
+    def _alu_frame(self, mask, operation, offset, left, destination):
+        self._operate(mask, operation, self.registers[left], self._read(self.fp + offset),
+                      destination)
+
+    def _push_immediate(self, mask, value):
+        self._write(mask, self.sp, value)
+        self.sp += 1
+
+    def _push_register(self, mask, source):
+        self._push_immediate(mask, self.registers[source])
+
+    def _push_memory(self, mask, cell):
+        self._push_immediate(mask, self._read(cell))
+
+    def _push_frame(self, mask, offset):
+        self._push_immediate(mask, self._read(self.fp + offset))
+
+    def _call(self, mask, target, argument_count):
+        # Only the calling lanes run the function; the rest stay parked
+        # with the caller's state until it returns
+        self.call_stack.append((self.pc, self.fp, self.sp - argument_count,
+                                list(self.registers), self.lane_pcs, self.live, mask))
+        self.lane_pcs = None
+        self.live = mask
+        self.pc = target
+
+    def _enter(self, mask, size):
+        self.fp = self.sp
+        self.sp += size // ADDRESS_STEP
+
+    def _return(self, mask):
+        if not self.call_stack:
+            self._halt(mask)
+            return
+        result = self.registers[0]
+        (self.pc, self.fp, self.sp, self.registers,
+         self.lane_pcs, self.live, callers) = self.call_stack.pop()
+        self.registers[0] = self._merge(callers, result, self.registers[0])
+
+    def _jump(self, mask, target):
+        if self.lane_pcs is None:
+            self.pc = target
+        else:
+            self.lane_pcs[mask] = target
+
+    def _branch(self, mask, taken, target):
+        if not isinstance(taken, np.ndarray):
+            if taken:
+                self._jump(mask, target)
+            return
+        if self.lane_pcs is not None:
+            self.lane_pcs[mask & taken] = target
+            return
+        live_taken = taken if mask is None else taken[mask]
+        if live_taken.all():
+            self.pc = target
+        elif live_taken.any():
+            # The lanes part ways here
+            end = len(self.instructions)
+            self.lane_pcs = np.where(taken, target, self.pc)
+            if mask is not None:
+                self.lane_pcs[~mask] = end
+
+    def _jump_if_zero(self, mask, register, target):
+        value = self.registers[register]
+        self._branch(mask, value == 0 if isinstance(value, np.ndarray) else not value, target)
+
+    def _jump_if_not_zero(self, mask, register, target):
+        value = self.registers[register]
+        self._branch(mask, value != 0 if isinstance(value, np.ndarray) else bool(value), target)
+
+    def _halt(self, mask):
+        end = len(self.instructions)
+        if self.lane_pcs is None:
+            self.pc = end
+            return
+        self.lane_pcs[mask] = end
+        self.live = self.lane_pcs < end
+
+
+def execute_batch(assembly_code, inputs, symbol_table=None):
+    """Run generated assembly once per input record; returns each lane's globals."""
+    vm = BatchVirtualMachine(assembly_code, inputs, symbol_table=symbol_table).run()
+    return [vm.lane(index) for index in range(vm.size)]
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(
+        description="Run generated Enigma assembly over a batch of inputs.")
+    argument_parser.add_argument('assembly_file')
+    argument_parser.add_argument('inputs_file',
+                                 help="JSON object mapping global addresses to lists of lane values")
+    arguments = argument_parser.parse_args()
+
+    with open(arguments.assembly_file) as file:
+        assembly_code = file.read()
+    with open(arguments.inputs_file) as file:
+        inputs = {int(address): values for address, values in json.load(file).items()}
+    for index, lane in enumerate(execute_batch(assembly_code, inputs)):
+        print(json.dumps({'lane': index, 'globals': lane}))
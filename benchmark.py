@@ -0,0 +1,273 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+from pass_manager import parse_level
+from pipeline import Pipeline, Tracer
+from program_generator import ProgramGenerator, parse_size
+
+DEFAULT_SIZES = ['1K', '10K', '100K', '1M', '10M', '100M']
+# Once a size takes longer than this end to end, larger ones are skipped
+DEFAULT_BUDGET = 60.0
+# A phase is a regression when it is this much slower than its baseline...
+DEFAULT_TOLERANCE = 0.10
+# ...and slower by more than this many seconds, so timer noise on tiny
+# phases is never flagged
+NOISE_FLOOR = 0.001
+END_TO_END = 'end to end'
+
+
+def size_label(size):
+    for unit, scale in (('G', 1 << 30), ('M', 1 << 20), ('K', 1 << 10)):
+        if size >= scale and size % scale == 0:
+            return f"{size // scale}{unit}"
+    return str(size)
+
+
+def run_case(size, seed=0, level=2, shape=None, repeat=3, execute=True, timeout=60.0,
+             memory=False):
+    """Time every phase on a generated program of about size bytes.
+
+    The program is generated once and compiled (and run) repeat times;
+    each phase keeps its fastest time. Returns a dict with the source
+    size, the seconds of every phase (optimizer passes included) and
+    their throughput in source bytes per second. With memory=True, one
+    more run under tracemalloc adds the peak and retained bytes of every
+    outermost phase; it is kept apart because tracemalloc skews timings.
+    """
+    source_code = ProgramGenerator(seed, **(shape or {})).generate(size)
+    best = {}
+    executed = None
+    for _ in range(repeat):
+        pipeline = Pipeline(level, Tracer())
+        started = time.perf_counter()
+        if execute:
+            vm = pipeline.run(source_code, timeout=timeout)
+            executed = vm.executed
+        else:
+            pipeline.compile(source_code)
+        seconds = {name: entry['seconds'] for name, entry in pipeline.tracer.summary().items()}
+        seconds[END_TO_END] = time.perf_counter() - started
+        for name, value in seconds.items():
+            best[name] = min(best.get(name, value), value)
+    case = {'size': len(source_code), 'executed_instructions': executed, 'seconds': best,
+            'throughput': {name: len(source_code) / value if value else None
+                           for name, value in best.items()}}
+    if memory:
+        case['memory'] = measure_memory(source_code, level, execute, timeout)
+    return case
+
+
+def measure_memory(source_code, level=2, execute=True, timeout=60.0):
+    """{'peak_bytes': ..., 'phases': {phase: {'peak_bytes', 'retained_bytes'}}}
+    of one traced run; peaks count everything allocated since it began."""
+    tracer = Tracer(memory=True)
+    pipeline = Pipeline(level, tracer)
+    try:
+        if execute:
+            pipeline.run(source_code, timeout=timeout)
+        else:
+            pipeline.compile(source_code)
+    finally:
+        tracer.stop()
+    phases = {name: {'peak_bytes': entry['peak_bytes'], 'retained_bytes': entry['allocated_bytes']}
+              for name, entry in tracer.summary().items() if entry['depth'] == 0}
+    return {'peak_bytes': tracer.peak_bytes(), 'phases': phases}
+
+
+def run_suite(sizes, seed=0, level=2, shape=None, repeat=3, execute=True, timeout=60.0,
+              budget=DEFAULT_BUDGET, memory=False, progress=None):
+    """run_case for every size, smallest first, skipping the sizes past
+    the first one to exceed budget seconds end to end."""
+    cases = {}
+    for size in sorted(sizes):
+        label = size_label(size)
+        if cases and max(case['seconds'][END_TO_END] for case in cases.values()) > budget:
+            if progress:
+                progress(f"{label}: skipped, a smaller size took over {budget:g}s")
+            continue
+        cases[label] = run_case(size, seed, level, shape, repeat, execute, timeout, memory)
+        if progress:
+            progress(f"{label}: {cases[label]['seconds'][END_TO_END]:.3f}s end to end")
+    return {'seed': seed, 'level': level, 'shape': shape or {}, 'repeat': repeat,
+            'execute': execute, 'python': platform.python_version(),
+            'machine': platform.machine(), 'cases': cases}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """(case, phase, baseline seconds, seconds, ratio, regressed) for every
+    phase both runs measured."""
+    rows = []
+    for label, case in results['cases'].items():
+        previous = baseline['cases'].get(label)
+        if previous is None:
+            continue
+        for phase, seconds in case['seconds'].items():
+            before = previous['seconds'].get(phase)
+            if before is None:
+                continue
+            ratio = seconds / before if before else float('inf')
+            regressed = ratio > 1 + tolerance and seconds - before > NOISE_FLOOR
+            rows.append((label, phase, before, seconds, ratio, regressed))
+    return rows
+
+
+def check_memory(results, budgets):
+    """(case, phase, budget, peak bytes, over) for every budgeted phase.
+
+    budgets maps a size label to {phase: bytes}, where the phase 'peak'
+    stands for the whole run; sizes may be strings such as '64M'.
+    """
+    rows = []
+    for label, limits in budgets.items():
+        case = results['cases'].get(label)
+        if case is None or 'memory' not in case:
+            continue
+        for phase, limit in limits.items():
+            limit = parse_size(limit) if isinstance(limit, str) else limit
+            if phase == 'peak':
+                peak = case['memory']['peak_bytes']
+            elif phase in case['memory']['phases']:
+                peak = case['memory']['phases'][phase]['peak_bytes']
+            else:
+                continue
+            rows.append((label, phase, limit, peak, peak > limit))
+    return rows
+
+
+def parse_memory_budgets(text):
+    """The budgets check_memory takes, from --memory-budget's JSON."""
+    try:
+        budgets = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise argparse.ArgumentTypeError(f"not valid JSON: {e}")
+    if not isinstance(budgets, dict) or not all(isinstance(limits, dict)
+                                                for limits in budgets.values()):
+        raise argparse.ArgumentTypeError(
+            'expected {"<size>": {"<phase>": <bytes>, ...}, ...}')
+    return budgets
+
+
+def comparable(results, baseline):
+    """Why results and baseline measure different things, or None."""
+    for key in ('seed', 'level', 'shape', 'execute'):
+        if results[key] != baseline.get(key):
+            return f"{key} differs ({baseline.get(key)!r} in the baseline, {results[key]!r} now)"
+    return None
+
+
+def format_results(results):
+    lines = [f"{'Size':>6} {'Bytes':>11} {'Phase':<36} {'ms':>11} {'MB/s':>9}",
+             '-' * 77]
+    for label, case in results['cases'].items():
+        for phase, seconds in case['seconds'].items():
+            throughput = case['throughput'][phase]
+            rate = f"{throughput / (1 << 20):.2f}" if throughput else ''
+            lines.append(f"{label:>6} {case['size']:>11} {phase:<36} "
+                         f"{seconds * 1000:>11.3f} {rate:>9}")
+    return "\n".join(lines)
+
+
+def format_memory(results):
+    lines = [f"{'Size':>6} {'Phase':<36} {'Peak KiB':>11} {'Retained KiB':>13}",
+             '-' * 69]
+    for label, case in results['cases'].items():
+        if 'memory' not in case:
+            continue
+        for phase, entry in case['memory']['phases'].items():
+            lines.append(f"{label:>6} {phase:<36} {entry['peak_bytes'] / 1024:>11.1f} "
+                         f"{entry['retained_bytes'] / 1024:>13.1f}")
+        lines.append(f"{label:>6} {'peak':<36} {case['memory']['peak_bytes'] / 1024:>11.1f}")
+    return "\n".join(lines)
+
+
+def format_budget_check(rows):
+    lines = [f"{'Size':>6} {'Phase':<36} {'Budget KiB':>11} {'Peak KiB':>11}",
+             '-' * 67]
+    for label, phase, limit, peak, over in rows:
+        lines.append(f"{label:>6} {phase:<36} {limit / 1024:>11.1f} {peak / 1024:>11.1f}"
+                     f"{'  OVER BUDGET' if over else ''}")
+    return "\n".join(lines)
+
+
+def format_comparison(rows):
+    lines = [f"{'Size':>6} {'Phase':<36} {'Base ms':>11} {'Now ms':>11} {'Change':>8}",
+             '-' * 76]
+    for label, phase, before, seconds, ratio, regressed in rows:
+        lines.append(f"{label:>6} {phase:<36} {before * 1000:>11.3f} {seconds * 1000:>11.3f} "
+                     f"{(ratio - 1) * 100:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(
+        description="Benchmark every compiler phase on generated Enigma programs.")
+    argument_parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                                 help="comma-separated program sizes (default %(default)s)")
+    argument_parser.add_argument('--seed', type=int, default=0)
+    argument_parser.add_argument('-O', dest='level', default='2',
+                                 help="optimization level 0-3 (default 2)")
+    argument_parser.add_argument('--repeat', type=int, default=3,
+                                 help="runs per size; each phase keeps its best (default 3)")
+    argument_parser.add_argument('--compile-only', action='store_true',
+                                 help="do not execute the programs")
+    argument_parser.add_argument('--timeout', type=float, default=60.0,
+                                 help="seconds before stopping a program's run (default 60)")
+    argument_parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                                 help="skip larger sizes once one takes longer than this "
+                                      "(default %(default)gs)")
+    argument_parser.add_argument('--declarations', type=int, default=8)
+    argument_parser.add_argument('--depth', type=int, default=2)
+    argument_parser.add_argument('--expression-size', type=int, default=4)
+    argument_parser.add_argument('--loops', type=int, default=2)
+    argument_parser.add_argument('--functions', type=int, default=2)
+    argument_parser.add_argument('--output', help="write the results as JSON to this file")
+    argument_parser.add_argument('--baseline', help="compare against results saved with --output")
+    argument_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                                 help="slowdown flagged as a regression (default %(default)g)")
+    argument_parser.add_argument('--memory', action='store_true',
+                                 help="also measure peak and retained memory with tracemalloc")
+    argument_parser.add_argument('--memory-budget', type=parse_memory_budgets,
+                                 help="JSON of peak byte budgets by size and phase, "
+                                      "e.g. {\"10K\": {\"peak\": \"16M\", \"optimize\": \"8M\"}}")
+    arguments = argument_parser.parse_args()
+
+    shape = {'declarations': arguments.declarations, 'depth': arguments.depth,
+             'expression_size': arguments.expression_size, 'loops': arguments.loops,
+             'functions': arguments.functions}
+    results = run_suite([parse_size(size) for size in arguments.sizes.split(',')],
+                        arguments.seed, parse_level(arguments.level), shape, arguments.repeat,
+                        not arguments.compile_only, arguments.timeout, arguments.budget,
+                        arguments.memory or arguments.memory_budget is not None,
+                        progress=lambda message: print(message, file=sys.stderr))
+    print(format_results(results))
+    if arguments.memory or arguments.memory_budget:
+        print()
+        print(format_memory(results))
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    failed = False
+    if arguments.memory_budget:
+        rows = check_memory(results, arguments.memory_budget)
+        print()
+        print(format_budget_check(rows))
+        over = sum(1 for row in rows if row[-1])
+        print(f"\n{over} phase(s) over their memory budget")
+        failed = over > 0
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+        reason = comparable(results, baseline)
+        if reason:
+            print(f"\nNot comparable with {arguments.baseline}: {reason}")
+            sys.exit(2)
+        rows = compare(results, baseline, arguments.tolerance)
+        print()
+        print(format_comparison(rows))
+        regressions = sum(1 for row in rows if row[-1])
+        print(f"\n{regressions} regression(s) beyond {arguments.tolerance:.0%}")
+        failed = failed or regressions > 0
+    sys.exit(1 if failed else 0)
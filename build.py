@@ -0,0 +1,166 @@
+import glob
+import os
+import sys
+import time
+
+from Parser import SyntaxError
+from code_generator import CodeGenerationError
+from pass_manager import count_instructions_in, parse_level
+from pipeline import LexicalError, Pipeline
+
+# Extensions picked up when a directory is given instead of a file
+SOURCE_EXTENSIONS = ('.enigma', '.txt')
+# How a file's compilation ended
+OK = 'ok'
+LEXICAL_ERROR = 'lexical error'
+SYNTAX_ERROR = 'syntax error'
+SEMANTIC_ERROR = 'semantic error'
+CODE_GENERATION_ERROR = 'code generation error'
+INTERNAL_ERROR = 'internal error'
+# ... or, for tools that also run it, how the run failed
+RUNTIME_ERROR = 'runtime error'
+
+
+def compile_source(source_code, level=2, tracer=None):
+    """Run the whole pipeline on one program.
+
+    Returns (generated assembly, optimized assembly). Lexical errors raise
+    LexicalError, syntax errors Parser.SyntaxError, semantic errors
+    ValueError and code the generator cannot translate CodeGenerationError.
+    tracer, a pipeline.Tracer, records every phase.
+    """
+    return Pipeline(level, tracer).compile(source_code)
+
+
+def error_status(error):
+    """(status, message) describing an exception compile_source raised."""
+    if isinstance(error, LexicalError):
+        return LEXICAL_ERROR, str(error)
+    if isinstance(error, SyntaxError):
+        return SYNTAX_ERROR, str(error).strip()
+    if isinstance(error, CodeGenerationError):
+        return CODE_GENERATION_ERROR, str(error)
+    if isinstance(error, ValueError):
+        return SEMANTIC_ERROR, str(error)
+    return INTERNAL_ERROR, f"{type(error).__name__}: {error}"
+
+
+def compile_file(path, output_path, level=2):
+    """Compile one file and write its artifacts; returns a summary dict.
+
+    Runs in worker processes, so every failure is reported rather than
+    raised and one bad file never stops the batch.
+    """
+    started = time.perf_counter()
+    summary = {'path': path, 'status': OK, 'message': None, 'artifacts': [],
+               'instructions': None, 'optimized_instructions': None}
+    try:
+        with open(path) as file:
+            source_code = file.read()
+        assembly_code, optimized_code = compile_source(source_code, level)
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        for suffix, code in (('.asm', assembly_code), ('.opt.asm', optimized_code)):
+            with open(output_path + suffix, 'w') as file:
+                file.write(code + "\n")
+            summary['artifacts'].append(output_path + suffix)
+        summary['instructions'] = count_instructions_in(assembly_code.splitlines())
+        summary['optimized_instructions'] = count_instructions_in(optimized_code.splitlines())
+    except Exception as e:
+        summary['status'], summary['message'] = error_status(e)
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+
+def _compile_job(job):
+    return compile_file(*job)
+
+
+def expand_sources(patterns):
+    """Files named by patterns: plain paths, globs (** included) or directories."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                for directory, _, names in sorted(os.walk(match)):
+                    paths += [os.path.join(directory, name) for name in sorted(names)
+                              if name.endswith(SOURCE_EXTENSIONS)]
+            else:
+                paths.append(match)
+    return list(dict.fromkeys(os.path.normpath(path) for path in paths))
+
+
+def output_paths(paths, output_directory):
+    """Artifact path prefix of every source: its path below the sources'
+    common directory, without the extension, inside output_directory."""
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    return [os.path.join(output_directory,
+                         os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0])
+            for path in paths]
+
+
+def build(paths, output_directory, level=2, workers=None):
+    """Compile every path, spreading files over a process pool; returns the summaries in order."""
+    jobs = [(path, output, level)
+            for path, output in zip(paths, output_paths(paths, output_directory))]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        return [_compile_job(job) for job in jobs]
+    # Several files per task keeps the pipes quiet for large batches of small files
+    chunk_size = max(1, len(jobs) // (workers * 4))
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_compile_job, jobs, chunksize=chunk_size))
+
+
+def format_summary(summaries, seconds, workers):
+    by_status = {}
+    for summary in summaries:
+        by_status[summary['status']] = by_status.get(summary['status'], 0) + 1
+    compiled = [summary for summary in summaries if summary['status'] == OK]
+    before = sum(summary['instructions'] for summary in compiled)
+    after = sum(summary['optimized_instructions'] for summary in compiled)
+    cpu_seconds = sum(summary['seconds'] for summary in summaries)
+    lines = [f"{len(summaries)} file(s) in {seconds:.2f}s with {workers} worker(s) "
+             f"({len(summaries) / seconds if seconds else 0:.1f} files/s, "
+             f"{cpu_seconds:.2f}s of compile time)",
+             ', '.join(f"{count} {status}" for status, count in sorted(by_status.items())),
+             f"{before} -> {after} instructions over {len(compiled)} compiled file(s)"]
+    failures = [summary for summary in summaries if summary['status'] != OK]
+    if failures:
+        lines += ['', f"{'Status':<16} File"]
+        for summary in failures:
+            message = summary['message'].splitlines()[0] if summary['message'] else ''
+            lines.append(f"{summary['status']:<16} {summary['path']}: {message}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    argument_parser = argparse.ArgumentParser(
+        description="Compile Enigma source files to assembly in parallel.")
+    argument_parser.add_argument('sources', nargs='+',
+                                 help="files, directories or glob patterns ('src/**/*.enigma')")
+    argument_parser.add_argument('-o', '--output', default='build',
+                                 help="directory for the .asm and .opt.asm artifacts")
+    argument_parser.add_argument('-O', dest='level', default='2',
+                                 help="optimization level 0-3 (default 2)")
+    argument_parser.add_argument('-j', '--jobs', type=int, default=None,
+                                 help="worker processes (default: one per core)")
+    argument_parser.add_argument('--summary', help="also write the per-file summaries as JSON")
+    arguments = argument_parser.parse_args()
+
+    paths = expand_sources(arguments.sources)
+    workers = arguments.jobs or os.cpu_count() or 1
+    started = time.perf_counter()
+    summaries = build(paths, arguments.output, parse_level(arguments.level), workers)
+    print(format_summary(summaries, time.perf_counter() - started, workers))
+    if arguments.summary:
+        with open(arguments.summary, 'w') as file:
+            json.dump(summaries, file, indent=2)
+    sys.exit(0 if all(summary['status'] == OK for summary in summaries) else 1)
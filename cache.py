@@ -0,0 +1,45 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_ENTRIES = 512
+
+
+class ArtifactCache:
+    """Compiled programs by source and -O level, least recently used first out.
+
+    One cache may be shared by many threads (the compile server's request
+    threads, an AsyncCompiler's callers), so it locks around each access;
+    compiling itself happens outside the lock.
+    """
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(source_code, level):
+        return hashlib.sha256(source_code.encode()).hexdigest(), level
+
+    def get(self, key):
+        with self.lock:
+            artifacts = self.entries.get(key)
+            if artifacts is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return artifacts
+
+    def put(self, key, artifacts):
+        with self.lock:
+            self.entries[key] = artifacts
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def statistics(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
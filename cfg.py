@@ -0,0 +1,342 @@
+from assembly import Instruction, TERMINATOR_OPCODES
+
+
+class BasicBlock:
+    def __init__(self, index, label=None):
+        self.index = index
+        self.label = label
+        self.instructions = []
+        self.successors = []
+        self.predecessors = []
+
+    def __repr__(self):
+        return f"BasicBlock({self.index}, label={self.label!r}, size={len(self.instructions)})"
+
+    def last_instruction(self):
+        """The last instruction that is not a comment, or None."""
+        for instruction in reversed(self.instructions):
+            if not instruction.is_comment:
+                return instruction
+        return None
+
+
+class Loop:
+    """A natural loop: its header and every block that can reach a back edge to it."""
+
+    def __init__(self, header):
+        self.header = header
+        self.blocks = {header}
+        self.latches = []  # Blocks whose edge back to the header closes the loop
+        self.parent = None  # The innermost loop around this one
+
+    def __repr__(self):
+        return f"Loop(header={self.header.index}, size={len(self.blocks)})"
+
+    def __contains__(self, block):
+        return block in self.blocks
+
+
+class DominatorTree:
+    """The immediate dominators of a ControlFlowGraph's reachable blocks.
+
+    Blocks are numbered in a preorder and a postorder walk of the tree, so
+    whether one block dominates another takes two comparisons instead of a
+    walk up the tree. Numbers are pairs, which lets insert_above put a new
+    block into the tree without renumbering the others.
+    """
+
+    def __init__(self, cfg):
+        blocks = {block.index: block for block in cfg.blocks}
+        self.idom = {}  # Block -> immediate dominator, None for entries
+        self.children = {}  # Block (None for the entries) -> the blocks it immediately dominates
+        for index, dominator in sorted(cfg.dominators().items()):
+            parent = None if dominator is None else blocks[dominator]
+            self.idom[blocks[index]] = parent
+            self.children.setdefault(parent, []).append(blocks[index])
+        self.pre = {}
+        self.post = {}
+        clock = 0
+        stack = [(block, False) for block in reversed(self.children.get(None, []))]
+        while stack:
+            block, finished = stack.pop()
+            if finished:
+                self.post[block] = (clock, 0)
+            else:
+                self.pre[block] = (clock, 0)
+                stack.append((block, True))
+                stack.extend((child, False) for child in reversed(self.children.get(block, [])))
+            clock += 1
+
+    def __contains__(self, block):
+        return block in self.idom
+
+    def dominates(self, dominator, block):
+        return (dominator in self.pre and block in self.pre
+                and self.pre[dominator] <= self.pre[block]
+                and self.post[block] <= self.post[dominator])
+
+    def insert_above(self, block, new_block):
+        """Make new_block the immediate dominator of block, in place of its old one."""
+        parent = self.idom[block]
+        siblings = self.children[parent]
+        siblings[siblings.index(block)] = new_block
+        self.idom[new_block] = parent
+        self.idom[block] = new_block
+        self.children[new_block] = [block]
+        # new_block numbers just outside block's, and inside those of a
+        # parent inserted the same way
+        pre, post = self.pre[block], self.post[block]
+        if parent is not None and self.pre[parent][0] == pre[0]:
+            self.pre[new_block] = (pre[0], (self.pre[parent][1] + pre[1]) / 2)
+            self.post[new_block] = (post[0], (self.post[parent][1] + post[1]) / 2)
+        else:
+            self.pre[new_block] = (pre[0], pre[1] - 1)
+            self.post[new_block] = (post[0], post[1] + 1)
+
+
+class ControlFlowGraph:
+    """Basic blocks of a generated program in layout order.
+
+    Blocks start at labels and after jumps, branches, RET and HALT. Block 0
+    is the program entry and every CALL target is a function entry, as is
+    every label in entry_points: functions a module exports without
+    calling them itself.
+    """
+
+    def __init__(self, header, blocks, entry_points=()):
+        self.header = header  # CONST lines, kept verbatim ahead of the code
+        self.blocks = blocks
+        self.entry_points = set(entry_points)
+        self.rebuild_edges()
+
+    def rebuild_edges(self):
+        """Recompute labels, successors, predecessors and entries after an edit."""
+        self.label_to_block = {
+            block.label: block for block in self.blocks if block.label is not None}
+        for block in self.blocks:
+            block.successors = []
+            block.predecessors = []
+        called = {label for label in self.entry_points if label in self.label_to_block}
+        for position, block in enumerate(self.blocks):
+            following = self.blocks[position + 1] if position + 1 < len(self.blocks) else None
+            last = block.last_instruction()
+            for instruction in block.instructions:
+                if instruction.call_target() in self.label_to_block:
+                    called.add(instruction.call_target())
+            targets = []
+            if last is not None and last.branch_target() in self.label_to_block:
+                targets.append(self.label_to_block[last.branch_target()])
+            if following is not None and (last is None or last.opcode not in TERMINATOR_OPCODES):
+                targets.append(following)
+            for target in targets:
+                if target not in block.successors:
+                    block.successors.append(target)
+                    target.predecessors.append(block)
+        self.entries = self.blocks[:1] + [
+            self.label_to_block[label] for label in sorted(called)
+            if self.label_to_block[label] is not self.blocks[0]]
+
+    def reachable(self):
+        """Blocks reachable from the program entry or any function entry."""
+        seen = set()
+        stack = list(self.entries)
+        while stack:
+            block = stack.pop()
+            if block.index in seen:
+                continue
+            seen.add(block.index)
+            stack.extend(block.successors)
+        return seen
+
+    def postorder(self):
+        """Blocks in depth-first postorder from every entry."""
+        order = []
+        seen = set()
+        for entry in self.entries:
+            if entry.index in seen:
+                continue
+            seen.add(entry.index)
+            stack = [(entry, iter(entry.successors))]
+            while stack:
+                block, successors = stack[-1]
+                for successor in successors:
+                    if successor.index not in seen:
+                        seen.add(successor.index)
+                        stack.append((successor, iter(successor.successors)))
+                        break
+                else:
+                    stack.pop()
+                    order.append(block)
+        return order
+
+    def dominators(self):
+        """Immediate dominator index of every reachable block.
+
+        Entries map to None. Uses the iterative algorithm of Cooper, Harvey
+        and Kennedy over reverse postorder, with a virtual root above all
+        entries so functions get their own dominator trees.
+        """
+        root = -1
+        order = list(reversed(self.postorder()))
+        position = {block.index: number for number, block in enumerate(order)}
+        position[root] = -1
+        entry_indices = {entry.index for entry in self.entries}
+        idom = {index: root for index in entry_indices}
+
+        def intersect(first, second):
+            while first != second:
+                while position[first] > position[second]:
+                    first = idom[first]
+                while position[second] > position[first]:
+                    second = idom[second]
+            return first
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order:
+                if block.index in entry_indices:
+                    continue
+                processed = [predecessor.index for predecessor in block.predecessors
+                             if predecessor.index in idom]
+                if not processed:
+                    continue
+                new_idom = processed[0]
+                for predecessor in processed[1:]:
+                    new_idom = intersect(predecessor, new_idom)
+                if idom.get(block.index) != new_idom:
+                    idom[block.index] = new_idom
+                    changed = True
+        return {index: (None if dominator == root else dominator)
+                for index, dominator in idom.items()}
+
+    def natural_loops(self, dominator_tree=None):
+        """Loops found from back edges, innermost (smallest) first.
+
+        An edge is a back edge when its target dominates its source. Back
+        edges sharing a header are merged into one loop. Every loop's
+        parent is the innermost loop around it.
+        """
+        tree = dominator_tree or DominatorTree(self)
+        loops = {}
+        for block in self.blocks:
+            if block not in tree:
+                continue
+            for successor in block.successors:
+                if not tree.dominates(successor, block):
+                    continue
+                loop = loops.setdefault(successor, Loop(successor))
+                loop.latches.append(block)
+                stack = [block]
+                while stack:
+                    current = stack.pop()
+                    if current not in loop.blocks and current in tree:
+                        loop.blocks.add(current)
+                        stack.extend(current.predecessors)
+        ordered = sorted(loops.values(), key=lambda loop: len(loop.blocks))
+        # Loops are nested or disjoint, so the first loop after an inner one
+        # that holds its header is the one right around it
+        for loop in ordered:
+            for block in loop.blocks:
+                inner = loops.get(block)
+                if inner is not None and inner is not loop and inner.parent is None:
+                    inner.parent = loop
+        return ordered
+
+    def preheader(self, loop, dominator_tree=None):
+        """The block control passes through just before entering loop.
+
+        A lone outside predecessor that only leads to the header is used as
+        it is; otherwise a new block is laid out right before the header
+        and every entering branch is redirected to it. Returns None when
+        that is impossible: the header is a function entry, or a block of
+        the loop falls through into it.
+
+        A new block is added to every loop around loop and, when given, to
+        dominator_tree. Edges are patched around it rather than rebuilt, and
+        it takes index len(blocks) without renumbering the others, so a
+        pass can insert many preheaders in linear time; call renumber()
+        once it is done.
+        """
+        header = loop.header
+        outside = [predecessor for predecessor in header.predecessors if predecessor not in loop]
+        if len(outside) == 1 and outside[0].successors == [header]:
+            return outside[0]
+        position = self.blocks.index(header)
+        previous = self.blocks[position - 1] if position > 0 else None
+        if header in self.entries and position > 0:
+            return None
+        if previous is not None and previous in loop and header in previous.successors:
+            return None
+        preheader = BasicBlock(len(self.blocks))
+        if header.label is not None:
+            preheader.label = f"{header.label}_pre"
+            self.label_to_block[preheader.label] = preheader
+            for predecessor in outside:
+                last = predecessor.last_instruction()
+                if last is not None and last.branch_target() == header.label:
+                    operands = [preheader.label if operand == header.label else operand
+                                for operand in last.operands]
+                    predecessor.instructions[predecessor.instructions.index(last)] = \
+                        Instruction.build(last.opcode, *operands)
+        self.blocks.insert(position, preheader)
+        # Every way in from outside the loop, by branch or fall-through, now
+        # goes through the preheader
+        for predecessor in outside:
+            successors = []
+            for successor in predecessor.successors:
+                successor = preheader if successor is header else successor
+                if successor not in successors:
+                    successors.append(successor)
+            predecessor.successors = successors
+        preheader.predecessors = outside
+        preheader.successors = [header]
+        header.predecessors = [preheader] + [
+            predecessor for predecessor in header.predecessors if predecessor in loop]
+        if self.entries and self.entries[0] is header:
+            self.entries[0] = preheader
+        outer = loop.parent
+        while outer is not None:
+            outer.blocks.add(preheader)
+            outer = outer.parent
+        if dominator_tree is not None and header in dominator_tree:
+            dominator_tree.insert_above(header, preheader)
+        return preheader
+
+    def renumber(self):
+        for index, block in enumerate(self.blocks):
+            block.index = index
+
+    def to_lines(self):
+        lines = list(self.header)
+        for block in self.blocks:
+            if block.label is not None:
+                lines.append(f"{block.label}:")
+            lines.extend(instruction.text for instruction in block.instructions)
+        return lines
+
+
+def build_cfg(lines, entry_points=()):
+    """Split generated assembly lines into basic blocks."""
+    header = []
+    blocks = [BasicBlock(0)]
+    for line in lines:
+        if not line.strip():
+            continue
+        if line.startswith('CONST'):
+            header.append(line)
+            continue
+        instruction = Instruction(line)
+        current = blocks[-1]
+        if instruction.is_label:
+            if current.instructions or current.label is not None:
+                current = BasicBlock(len(blocks))
+                blocks.append(current)
+            current.label = instruction.operands[0]
+            continue
+        last = current.last_instruction()
+        if last is not None and (last.opcode in TERMINATOR_OPCODES or last.branch_target() is not None):
+            current = BasicBlock(len(blocks))
+            blocks.append(current)
+        current.instructions.append(instruction)
+    return ControlFlowGraph(header, blocks, entry_points)
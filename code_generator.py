@@ -1,10 +1,46 @@
+# Operators that can appear between two terms of an expression
+BINARY_OPCODES = {
+    '+': 'ADD', '-': 'SUB', '*': 'MUL', '/': 'DIV',
+    '<': 'LT', '<=': 'LE', '>': 'GT', '>=': 'GE', '==': 'EQ', '!=': 'NE',
+}
+# How tightly each binary operator binds; higher binds first
+BINARY_PRECEDENCE = {
+    '<': 1, '<=': 1, '>': 1, '>=': 1, '==': 1, '!=': 1,
+    '+': 2, '-': 2,
+    '*': 3, '/': 3,
+}
+
+# Activation record layout. Every call gets a frame carved out of the stack,
+# which starts right after the globals:
+#
+#   fp-4*n ... fp-4    arguments, pushed left to right by the caller
+#   fp+0 ... fp+size   locals declared in the body, reserved by ENTER size
+#
+# CALL name, n records the return address, fp, sp (minus the n arguments) and
+# the register file on the VM call stack; RET restores them and leaves the
+# function result in rv, so callers never spill their own registers.
+
+
+class CodeGenerationError(ValueError):
+    """Code the generator cannot translate, though it passed the earlier phases."""
+
+
 class CodeGenerator:
-    def __init__(self):
+    def __init__(self, imports=None):
+        self.imports = imports or {}  # Module name -> interface, with global addresses
         self.instructions = []
         self.symbol_table = {}
         self.memory_location_counter = 1000
         self.output = None
         self.inputs = {}  # Dictionary to store input values
+        self.functions = []  # Compiled function bodies, emitted after the main code
+        self.constants = []  # Read-only pool of estr and efl literals
+        self.constant_indices = {}  # Literal text -> index in self.constants
+        self.current_function = None
+        self.block_stack = []
+        self.label_counter = 0
+        self.conditional_end = None  # End label of an iff chain awaiting maybe/orelse
+        self.source_line = None  # Enigma line the last '; line N' marker named
 
     def set_symbol_table(self, symbol_table):
         self.symbol_table = symbol_table
@@ -13,15 +49,44 @@ class CodeGenerator:
         i = 0
         while i < len(tokens):
             token = tokens[i]
-            if token['type'] == 'DATATYPE':
+            self._mark_source_line(token)
+            if token['type'] == 'FUNCTION_DEF':
+                i = self._generate_function_code(tokens, i)
+                continue
+            elif token['type'] == 'IMPORT':
+                # Imported globals are read and written at the addresses given
+                self.symbol_table.update(self.imports[token['value'].split()[1]]['globals'])
+            elif token['type'] == 'LCURLY':
+                self.block_stack.append(None)
+            elif token['type'] == 'RCURLY':
+                block = self.block_stack.pop() if self.block_stack else None
+                if block is not None and block['kind'] == 'function':
+                    self._generate_function_epilogue()
+                elif block is not None and block['kind'] == 'conditional':
+                    self._close_conditional_branch(block, tokens, i)
+                elif block is not None and block['kind'] == 'loop':
+                    self._close_loop(block)
+            elif token['type'] == 'RETURN':
+                i = self._generate_return_code(tokens, i)
+                continue
+            elif token['type'] == 'FUNCTION_CALL':
+                # A call used as a statement; its result is discarded
+                i = self._generate_expression_code(tokens, i, 'r1')
+                continue
+            elif token['type'] == 'DATATYPE':
                 data_type = token['value']
                 if i + 1 < len(tokens) and tokens[i + 1]['type'] == 'VARIABLE':
                     identifier = tokens[i + 1]['value']
                     value = None
                     if i + 2 < len(tokens) and tokens[i + 2]['type'] == 'ASSIGN':
-                        if i + 3 < len(tokens) and tokens[i + 3]['type'] in ['NUMBER', 'STRING', 'BOOLEAN_VAL', 'VARIABLE']:
+                        if self._is_simple_value(tokens, i + 3):
                             value = tokens[i + 3]['value']
                             i += 3
+                        elif i + 3 < len(tokens) and tokens[i + 3]['type'] in ['NUMBER', 'BOOLEAN_VAL', 'VARIABLE', 'FUNCTION_CALL', 'LPAREN']:
+                            self._allocate_variable(identifier, data_type)
+                            i = self._generate_expression_assignment_code(
+                                identifier, tokens, i + 3)
+                            continue
                         else:
                             i += 2
                     else:
@@ -30,27 +95,90 @@ class CodeGenerator:
             elif token['type'] == 'VARIABLE':
                 identifier = token['value']
                 if i + 1 < len(tokens) and tokens[i + 1]['type'] == 'ASSIGN':
-                    if i + 2 < len(tokens) and tokens[i + 2]['type'] in ['NUMBER', 'STRING', 'BOOLEAN_VAL', 'VARIABLE']:
+                    if self._is_simple_value(tokens, i + 2):
                         value = tokens[i + 2]['value']
                         self._generate_assignment_code(identifier, value)
                         i += 2
+                    elif i + 2 < len(tokens) and tokens[i + 2]['type'] in ['NUMBER', 'BOOLEAN_VAL', 'VARIABLE', 'FUNCTION_CALL', 'LPAREN']:
+                        i = self._generate_expression_assignment_code(
+                            identifier, tokens, i + 2)
+                        continue
             elif token['type'] in ['IFF', 'MAYBE', 'ORELSE']:
-                self._generate_conditional_code(tokens, i)
+                i = self._generate_conditional_code(tokens, i)
+                continue
             elif token['type'] == 'WHILST':
-                self._generate_whilst_code(tokens, i)
-            elif token['type'] == 'OPERATOR':
-                if token['value'] == '+':
-                    self._generate_addition_code(tokens, i)
-                    i += 1
-                # Add more operators as needed
+                i = self._generate_whilst_code(tokens, i)
+                continue
+            elif token['type'] == 'ITERATE':
+                i = self._generate_iterate_code(tokens, i)
+                continue
             i += 1
-        return "\n".join(self.instructions)
+        if self.functions:
+            # Function bodies live after the main program, which must not
+            # fall through into them
+            self.instructions.append("HALT")
+            self.instructions.extend(self.functions)
+        pool = [f"CONST {index}, {literal}"
+                for index, literal in enumerate(self.constants)]
+        return "\n".join(pool + self.instructions)
 
-    def _generate_variable_code(self, identifier, data_type, value):
+    def _mark_source_line(self, token):
+        """Note the Enigma line the following instructions come from.
+
+        The VM maps instructions back to source lines through these
+        comments, which survive optimization.
+        """
+        if token.get('line') is not None and token['line'] != self.source_line:
+            self.source_line = token['line']
+            self.instructions.append(f"; line {token['line']}")
+
+    def _constant(self, literal):
+        """Intern a literal in the constant pool and return its index."""
+        if literal not in self.constant_indices:
+            self.constant_indices[literal] = len(self.constants)
+            self.constants.append(literal)
+        return self.constant_indices[literal]
+
+    def _float_constant(self, value):
+        return self._constant(repr(float(value)))
+
+    def _is_simple_value(self, tokens, i):
+        """Check whether tokens[i] is a lone literal or variable ending its statement."""
+        return (i < len(tokens)
+                and tokens[i]['type'] in ['NUMBER', 'STRING', 'BOOLEAN_VAL', 'VARIABLE']
+                and (i + 1 >= len(tokens) or tokens[i + 1]['type'] == 'STATEMENT_TERMINATOR'))
+
+    def _allocate_variable(self, identifier, data_type):
+        """Reserve storage for a variable: a frame slot inside a function, a global otherwise."""
+        if self.current_function is not None:
+            memory_location = f"fp+{self.current_function['frame_size']}"
+            self.current_function['frame_size'] += 4
+            self.current_function['locals'][identifier] = {
+                'data_type': data_type, 'memory_location': memory_location}
+            return memory_location
         memory_location = self.memory_location_counter
         self.memory_location_counter += 4
         self.symbol_table[identifier] = {
             'data_type': data_type, 'memory_location': memory_location}
+        return memory_location
+
+    def _lookup(self, identifier):
+        """Resolve a variable in the current function first, then globally."""
+        if self.current_function is not None and identifier in self.current_function['locals']:
+            return self.current_function['locals'][identifier]
+        return self.symbol_table[identifier]
+
+    def _is_declared(self, identifier):
+        if self.current_function is not None and identifier in self.current_function['locals']:
+            return True
+        return identifier in self.symbol_table
+
+    def _generate_variable_code(self, identifier, data_type, value):
+        memory_location = self._allocate_variable(identifier, data_type)
+        if value is not None and value.startswith('v-'):
+            # Initialised from another variable, which lives in memory
+            self._generate_assignment_code(identifier, value)
+            return
 
         if data_type == 'enum':
             if value is not None:
@@ -61,13 +189,16 @@ class CodeGenerator:
         elif data_type == 'efl':
             if value is not None:
                 self.instructions.append(
-                    f"FLOAD {value}, fr1")
+                    f"LDC {self._float_constant(value)}, fr1")
                 self.instructions.append(
                     f"FSTORE fr1, {memory_location}")
         elif data_type == 'estr':
             if value is not None:
+                # The string itself stays in the pool; the variable holds a reference
+                self.instructions.append(
+                    f"LDC {self._constant(value)}, r1")
                 self.instructions.append(
-                    f'STR "{value}", {memory_location}')
+                    f"STORE r1, {memory_location}")
         elif data_type == 'ebool':
             boolean_value = 1 if value == 'yup' else 0
             self.instructions.append(
@@ -76,32 +207,40 @@ class CodeGenerator:
                 f"STORE r1, {memory_location}")
 
     def _generate_assignment_code(self, identifier, value):
-        if identifier in self.symbol_table:
-            memory_location = self.symbol_table[identifier]['memory_location']
-            data_type = self.symbol_table[identifier]['data_type']
+        if self._is_declared(identifier):
+            memory_location = self._lookup(identifier)['memory_location']
+            data_type = self._lookup(identifier)['data_type']
             if data_type == 'enum':
                 if value.isdigit():
                     self.instructions.append(
                         f"LOAD {value}, r1")
                 else:
-                    mem_loc = self.symbol_table[value]['memory_location']
+                    mem_loc = self._lookup(value)['memory_location']
                     self.instructions.append(
-                        f"LOAD {mem_loc}, r1")
+                        f"LOAD [{mem_loc}], r1")
                 self.instructions.append(
                     f"STORE r1, {memory_location}")
             elif data_type == 'efl':
                 if self._is_float(value):
                     self.instructions.append(
-                        f"FLOAD {value}, fr1")
+                        f"LDC {self._float_constant(value)}, fr1")
                 else:
-                    mem_loc = self.symbol_table[value]['memory_location']
+                    mem_loc = self._lookup(value)['memory_location']
                     self.instructions.append(
-                        f"FLOAD {mem_loc}, fr1")
+                        f"FLOAD [{mem_loc}], fr1")
                 self.instructions.append(
                     f"FSTORE fr1, {memory_location}")
             elif data_type == 'estr':
+                if value.startswith('"'):
+                    self.instructions.append(
+                        f"LDC {self._constant(value)}, r1")
+                else:
+                    # Copying a string variable only copies the reference
+                    mem_loc = self._lookup(value)['memory_location']
+                    self.instructions.append(
+                        f"LOAD [{mem_loc}], r1")
                 self.instructions.append(
-                    f'STR "{value}", {memory_location}')
+                    f"STORE r1, {memory_location}")
             elif data_type == 'ebool':
                 boolean_value = 1 if value == 'yup' else 0
                 self.instructions.append(
@@ -109,6 +248,142 @@ class CodeGenerator:
                 self.instructions.append(
                     f"STORE r1, {memory_location}")
 
+    def _generate_expression_assignment_code(self, identifier, tokens, i):
+        """Evaluate the expression at tokens[i] and store it into identifier."""
+        entry = self._lookup(identifier)
+        register = 'fr1' if entry['data_type'] == 'efl' else 'r1'
+        i = self._generate_expression_code(tokens, i, register)
+        store = 'FSTORE' if entry['data_type'] == 'efl' else 'STORE'
+        self.instructions.append(
+            f"{store} {register}, {entry['memory_location']}")
+        return i
+
+    def _generate_expression_code(self, tokens, i, register, min_precedence=1):
+        """Compile the expression at tokens[i] into register; return the index after it.
+
+        Precedence climbing: '*' and '/' bind tighter than '+' and '-',
+        which bind tighter than the comparisons; operators of equal
+        precedence group left to right. The right operand of each operator
+        is evaluated into the next register up.
+        """
+        i = self._generate_term_code(tokens, i, register)
+        while True:
+            precedence = self._binary_precedence(tokens, i)
+            if precedence is None or precedence < min_precedence:
+                return i
+            opcode = BINARY_OPCODES[tokens[i]['value']]
+            operand = tokens[i + 1]
+            following = self._binary_precedence(tokens, i + 2)
+            if (operand['type'] == 'NUMBER' and operand['value'].isdigit()
+                    and (following is None or following <= precedence)):
+                self.instructions.append(
+                    f"{opcode} {operand['value']}, {register}, {register}")
+                i += 2
+            else:
+                scratch = self._next_register(register)
+                i = self._generate_expression_code(tokens, i + 1, scratch, precedence + 1)
+                self.instructions.append(
+                    f"{opcode} {scratch}, {register}, {register}")
+
+    def _binary_precedence(self, tokens, i):
+        """Precedence of the binary operator at tokens[i], or None if there is none."""
+        if i < len(tokens) and tokens[i]['type'] == 'OPERATOR':
+            return BINARY_PRECEDENCE.get(tokens[i]['value'])
+        return None
+
+    def _generate_term_code(self, tokens, i, register):
+        load = 'FLOAD' if register.startswith('fr') else 'LOAD'
+        token = tokens[i]
+        if token['type'] == 'NUMBER' and token['value'].isdigit() and load == 'LOAD':
+            self.instructions.append(f"LOAD {token['value']}, {register}")
+        elif token['type'] == 'NUMBER':
+            self.instructions.append(
+                f"LDC {self._float_constant(token['value'])}, {register}")
+        elif token['type'] == 'STRING':
+            self.instructions.append(
+                f"LDC {self._constant(token['value'])}, {register}")
+        elif token['type'] == 'BOOLEAN_VAL':
+            boolean_value = 1 if token['value'] == 'yup' else 0
+            self.instructions.append(f"LOAD {boolean_value}, {register}")
+        elif token['type'] == 'VARIABLE':
+            memory_location = self._lookup(token['value'])['memory_location']
+            self.instructions.append(
+                f"{load} [{memory_location}], {register}")
+        elif token['type'] == 'FUNCTION_CALL':
+            return self._generate_call_code(tokens, i, register)
+        elif token['type'] == 'LPAREN':
+            i = self._generate_expression_code(tokens, i + 1, register)
+        else:
+            raise CodeGenerationError(
+                f"Unexpected token '{token['value']}' in expression at line {token['line']}")
+        return i + 1
+
+    def _next_register(self, register):
+        prefix = register.rstrip('0123456789')
+        return f"{prefix}{int(register[len(prefix):]) + 1}"
+
+    def _generate_call_code(self, tokens, i, register):
+        """Push the arguments left to right, call, and copy rv into register."""
+        name = tokens[i]['value']
+        i += 2  # Skip the name and '('
+        argument_count = 0
+        while tokens[i]['type'] != 'RPAREN':
+            if tokens[i]['type'] in ['COMMA', 'STATEMENT_TERMINATOR']:
+                i += 1
+                continue
+            i = self._generate_expression_code(tokens, i, register)
+            self.instructions.append(f"PUSH {register}")
+            argument_count += 1
+        self.instructions.append(f"CALL {name}, {argument_count}")
+        self.instructions.append(f"MOV rv, {register}")
+        return i + 1
+
+    def _generate_function_code(self, tokens, i):
+        """Emit the prologue of a function and compile its body out of line."""
+        return_type, name = tokens[i]['value'].split()
+        i += 2  # Skip the definition and '('
+        parameters = []
+        while tokens[i]['type'] != 'RPAREN':
+            if tokens[i]['type'] == 'DATATYPE':
+                parameters.append((tokens[i + 1]['value'], tokens[i]['value']))
+                i += 1
+            i += 1
+        local_symbols = {}
+        for index, (identifier, data_type) in enumerate(parameters):
+            local_symbols[identifier] = {
+                'data_type': data_type,
+                'memory_location': f"fp-{4 * (len(parameters) - index)}"}
+        self.current_function = {
+            'name': name,
+            'return_type': return_type[2:],
+            'locals': local_symbols,
+            'frame_size': 0,
+            'outer_instructions': self.instructions,
+        }
+        # Body instructions are collected separately until the closing brace
+        self.instructions = [f"{name}:", "ENTER 0"]
+        self.source_line = None
+        self.block_stack.append({'kind': 'function'})
+        return i + 2  # Skip ')' and '{'
+
+    def _generate_function_epilogue(self):
+        function = self.current_function
+        self.instructions[1] = f"ENTER {function['frame_size']}"
+        self.instructions.append("RET")
+        self.functions.extend(self.instructions)
+        self.instructions = function['outer_instructions']
+        self.source_line = None
+        self.current_function = None
+
+    def _generate_return_code(self, tokens, i):
+        i += 1  # Skip 'ret'
+        if tokens[i]['type'] != 'STATEMENT_TERMINATOR':
+            register = 'fr1' if self.current_function['return_type'] == 'efl' else 'r1'
+            i = self._generate_expression_code(tokens, i, register)
+            self.instructions.append(f"MOV {register}, rv")
+        self.instructions.append("RET")
+        return i
+
     def _is_float(self, value):
         try:
             float(value)
@@ -116,76 +391,101 @@ class CodeGenerator:
         except ValueError:
             return False
 
+    def _new_label(self):
+        self.label_counter += 1
+        return f".L{self.label_counter}"
+
     def _generate_conditional_code(self, tokens, i):
+        """Evaluate a branch condition and jump past the body when it is zero.
+
+        All branches of one iff/maybe/orelse chain share an end label that
+        every taken branch jumps to once its body is done.
+        """
         condition_start = tokens[i]['value']
-        condition_code = []
+        if tokens[i]['type'] == 'IFF' or self.conditional_end is None:
+            end_label = self._new_label()
+        else:
+            end_label = self.conditional_end
+        self.conditional_end = None
+        next_label = None
         i += 1  # Skip 'IFF', 'MAYBE', 'ORELSE'
         if tokens[i]['type'] == 'LPAREN':
-            i += 1  # Skip '('
-            while tokens[i]['type'] != 'RPAREN':
-                condition_code.append(tokens[i])
-                i += 1
+            self.instructions.append(f"; Begin {condition_start} condition")
+            i = self._generate_expression_code(tokens, i + 1, 'r1')
+            next_label = self._new_label()
+            self.instructions.append(f"JZ r1, {next_label}")
+            self.instructions.append(f"; End {condition_start} condition")
             i += 1  # Skip ')'
-        self.instructions.append(f"; Begin {condition_start} condition")
-        self._generate_condition(condition_code)
-        self.instructions.append(f"; End {condition_start} condition")
+        self.block_stack.append(
+            {'kind': 'conditional', 'next': next_label, 'end': end_label})
+        return i + 1  # Skip '{'
 
-    def _generate_condition(self, condition_code):
-        condition = " ".join([token['value'] for token in condition_code])
-        self.instructions.append(f"IF {condition} THEN")
+    def _close_conditional_branch(self, block, tokens, i):
+        continues = (block['next'] is not None and i + 1 < len(tokens)
+                     and tokens[i + 1]['type'] in ['MAYBE', 'ORELSE'])
+        if continues:
+            self.instructions.append(f"JMP {block['end']}")
+            self.instructions.append(f"{block['next']}:")
+            self.conditional_end = block['end']
+        else:
+            if block['next'] is not None:
+                self.instructions.append(f"{block['next']}:")
+            self.instructions.append(f"{block['end']}:")
 
     def _generate_whilst_code(self, tokens, i):
-        self.instructions.append("; Begin WHILST loop")
-        i += 1  # Skip 'WHILST'
-        if tokens[i]['type'] == 'LPAREN':
-            i += 1  # Skip '('
-            condition_code = []
-            while tokens[i]['type'] != 'RPAREN':
-                condition_code.append(tokens[i])
-                i += 1
-            i += 1  # Skip ')'
-            self._generate_condition(condition_code)
-            self.instructions.append("; WHILST body")
-            if tokens[i]['type'] == 'LCURLY':
-                i += 1  # Skip '{'
-                while tokens[i]['type'] != 'RCURLY':
-                    if tokens[i]['type'] == 'VARIABLE' and tokens[i + 1]['type'] == 'ASSIGN':
-                        self._generate_assignment_code(
-                            tokens[i]['value'], tokens[i + 2]['value'])
-                        i += 2
-                    i += 1
-                self.instructions.append("; End WHILST body")
-        self.instructions.append("; End WHILST loop")
-
-    def _generate_addition_code(self, tokens, i):
-        operand1 = tokens[i - 1]['value']
-        operand2 = tokens[i + 1]['value']
-        if operand1.isdigit() and operand2.isdigit():
-            result = int(operand1) + int(operand2)
-            self.output = result
-            self.instructions.append(f"LOAD {operand1}, r1")
-            self.instructions.append(f"ADD {operand2}, r1, r2")
-            self.instructions.append(
-                f"STORE r2, {self.memory_location_counter}")
-            self.memory_location_counter += 4
+        """Test the condition at the top of the loop and leave when it is zero.
+
+        The body is compiled by the main loop; its closing brace jumps back
+        to the test.
+        """
+        head_label = self._new_label()
+        end_label = self._new_label()
+        self.instructions.append(f"{head_label}:")
+        self.instructions.append("; Begin whilst condition")
+        i = self._generate_expression_code(tokens, i + 2, 'r1')  # Skip 'whilst' and '('
+        self.instructions.append(f"JZ r1, {end_label}")
+        self.instructions.append("; End whilst condition")
+        self.block_stack.append(
+            {'kind': 'loop', 'head': head_label, 'end': end_label, 'step': None})
+        return i + 2  # Skip ')' and '{'
+
+    def _generate_iterate_code(self, tokens, i):
+        """Lower iterate (init, condition, step,) like a whilst loop.
+
+        The initialisation runs once ahead of the test and the step is
+        emitted at the closing brace, just before the jump back.
+        """
+        i += 2  # Skip 'iterate' and '('
+        data_type = tokens[i]['value']
+        identifier = tokens[i + 1]['value']
+        self._allocate_variable(identifier, data_type)
+        if tokens[i + 2]['type'] == 'ASSIGN':
+            i = self._generate_expression_assignment_code(identifier, tokens, i + 3)
         else:
-            if operand1 in self.symbol_table:
-                self.instructions.append(
-                    f"LOAD {self.symbol_table[operand1]['memory_location']}, r1")
-            else:
-                self.instructions.append(f"LOAD {operand1}, r1")
-            if operand2 in self.symbol_table:
-                self.instructions.append(
-                    f"LOAD {self.symbol_table[operand2]['memory_location']}, r2")
-            else:
-                self.instructions.append(f"LOAD {operand2}, r2")
-            self.instructions.append(f"ADD r2, r1, r3")
-            self.instructions.append(
-                f"STORE r3, {self.memory_location_counter}")
-            self.memory_location_counter += 4
+            i += 2
+        i += 1  # Skip ','
+        head_label = self._new_label()
+        end_label = self._new_label()
+        self.instructions.append(f"{head_label}:")
+        self.instructions.append("; Begin iterate condition")
+        i = self._generate_expression_code(tokens, i, 'r1')
+        self.instructions.append(f"JZ r1, {end_label}")
+        self.instructions.append("; End iterate condition")
+        i += 1  # Skip ','
+        step = (tokens[i]['value'], 'ADD' if tokens[i + 1]['value'] == '++' else 'SUB')
+        self.block_stack.append(
+            {'kind': 'loop', 'head': head_label, 'end': end_label, 'step': step})
+        return i + 5  # Skip the step, ',', ')' and '{'
 
-        # Set the output to the result of the addition
-        self.output = result
+    def _close_loop(self, block):
+        if block['step'] is not None:
+            identifier, opcode = block['step']
+            memory_location = self._lookup(identifier)['memory_location']
+            self.instructions.append(f"LOAD [{memory_location}], r1")
+            self.instructions.append(f"{opcode} 1, r1, r1")
+            self.instructions.append(f"STORE r1, {memory_location}")
+        self.instructions.append(f"JMP {block['head']}")
+        self.instructions.append(f"{block['end']}:")
 
     def execute_code(self):
         if self.output is not None:
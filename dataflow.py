@@ -0,0 +1,172 @@
+import heapq
+
+
+class Universe:
+    """Numbers the facts of an analysis so sets of them fit in one int.
+
+    Bit i of a set is on when the i-th registered fact is in the set, which
+    makes union, intersection and difference single integer operations.
+    """
+
+    def __init__(self, items=()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+        return 1 << self.positions[item]
+
+    def bit(self, item):
+        position = self.positions.get(item)
+        return 0 if position is None else 1 << position
+
+    def to_bits(self, items):
+        bits = 0
+        for item in items:
+            bits |= self.bit(item)
+        return bits
+
+    def to_items(self, bits):
+        items = []
+        position = 0
+        while bits:
+            if bits & 1:
+                items.append(self.items[position])
+            bits >>= 1
+            position += 1
+        return items
+
+    @property
+    def full(self):
+        return (1 << len(self.items)) - 1
+
+
+class DataflowAnalysis:
+    """A monotone dataflow problem.
+
+    Subclasses pick the direction, the meet operator and the per-block
+    transfer function. Values are normally bitsets (ints interpreted through
+    a Universe); analyses over other lattices override meet and initial.
+    """
+
+    direction = 'forward'
+    meet_operator = 'union'
+
+    def boundary(self, cfg, block):
+        """Value at the entry (forward) or exit (backward) of a boundary block."""
+        return 0
+
+    def initial(self):
+        """Starting value for every block before the first visit."""
+        return 0
+
+    def meet(self, values):
+        result = None
+        for value in values:
+            if result is None:
+                result = value
+            elif self.meet_operator == 'union':
+                result |= value
+            else:
+                result &= value
+        return self.initial() if result is None else result
+
+    def transfer(self, block, value):
+        raise NotImplementedError
+
+    def feasible_successors(self, block, value):
+        """Successors control can reach from block, given its outgoing value.
+
+        Forward analyses may narrow this, e.g. when a branch condition is
+        known; blocks never reached along a feasible edge are not visited.
+        """
+        return block.successors
+
+
+class GenKillAnalysis(DataflowAnalysis):
+    """A dataflow problem whose transfer is out = gen | (in & ~kill)."""
+
+    def __init__(self):
+        self.gen_kill = {}
+
+    def block_gen_kill(self, block):
+        raise NotImplementedError
+
+    def transfer(self, block, value):
+        if block.index not in self.gen_kill:
+            self.gen_kill[block.index] = self.block_gen_kill(block)
+        gen, kill = self.gen_kill[block.index]
+        return gen | (value & ~kill)
+
+
+def solve(cfg, analysis):
+    """Run the worklist algorithm to a fixed point.
+
+    Returns (before, after): the value at the top and bottom of every
+    block, keyed by block index, in program order regardless of direction.
+    Forward analyses also leave the feasible edges they followed in
+    analysis.executable_edges and the blocks they reached in
+    analysis.visited.
+    """
+    forward = analysis.direction == 'forward'
+    order = cfg.postorder()
+    if forward:
+        order.reverse()
+    # Blocks are always taken in (reverse) postorder, so most values are
+    # final the first time a block is visited
+    priority = {block.index: position for position, block in enumerate(order)}
+    incoming = {}
+    outgoing = {}
+    for block in cfg.blocks:
+        incoming[block.index] = analysis.initial()
+        outgoing[block.index] = analysis.initial()
+    entry_indices = {entry.index for entry in cfg.entries}
+    executable_edges = set()
+    visited = set()
+
+    start = [block for block in order if block.index in entry_indices] if forward else order
+    worklist = [(priority[block.index], block.index, block) for block in start]
+    heapq.heapify(worklist)
+    queued = {block.index for block in start}
+    while worklist:
+        _, _, block = heapq.heappop(worklist)
+        queued.discard(block.index)
+        if forward:
+            values = [outgoing[predecessor.index] for predecessor in block.predecessors
+                      if (predecessor.index, block.index) in executable_edges]
+            is_boundary = block.index in entry_indices
+        else:
+            values = [outgoing[successor.index] for successor in block.successors]
+            is_boundary = not block.successors
+        if is_boundary:
+            values.append(analysis.boundary(cfg, block))
+        incoming[block.index] = analysis.meet(values)
+        result = analysis.transfer(block, incoming[block.index])
+        changed = result != outgoing[block.index] or block.index not in visited
+        visited.add(block.index)
+        outgoing[block.index] = result
+        if forward:
+            dependants = []
+            for successor in analysis.feasible_successors(block, result):
+                edge = (block.index, successor.index)
+                if edge not in executable_edges:
+                    executable_edges.add(edge)
+                    dependants.append(successor)
+                elif changed:
+                    dependants.append(successor)
+        else:
+            dependants = block.predecessors if changed else []
+        for dependant in dependants:
+            if dependant.index not in queued and dependant.index in priority:
+                queued.add(dependant.index)
+                heapq.heappush(
+                    worklist, (priority[dependant.index], dependant.index, dependant))
+    analysis.executable_edges = executable_edges
+    analysis.visited = visited
+    if forward:
+        return incoming, outgoing
+    return outgoing, incoming
@@ -0,0 +1,56 @@
+"""The Enigma compiler as a library.
+
+    import enigma
+    assembly_code, optimized_code = enigma.compile_source(source_code)
+    result = enigma.run_assembly_code(optimized_code, timeout=5.0)
+
+Importing this module loads nothing else: every name below is imported
+from its module the first time it is used, so a script that only
+compiles never pays for the JIT, the batch VM, the compile server or
+tkinter. The GUI is only imported by launch_gui(); running this file
+starts it.
+"""
+import importlib
+
+# Public name -> the module that defines it
+EXPORTS = {
+    'compile_source': 'build', 'error_status': 'build', 'build': 'build',
+    'LexicalError': 'pipeline', 'Pipeline': 'pipeline', 'Tracer': 'pipeline',
+    'SyntaxError': 'Parser',
+    'Optimizer': 'optimizer', 'PassManager': 'pass_manager', 'parse_level': 'pass_manager',
+    'VirtualMachine': 'vm', 'ExecutionResult': 'vm', 'VMState': 'vm', 'decode': 'vm',
+    'execute_assembly_code': 'vm', 'run_assembly_code': 'vm',
+    'CompilingVirtualMachine': 'jit',
+    'BatchVirtualMachine': 'batch', 'execute_batch': 'batch',
+    'Profiler': 'profiler',
+    'AsyncCompiler': 'async_api',
+    'CompileClient': 'server', 'CompileServer': 'server',
+    'ProgramGenerator': 'program_generator', 'generate_program': 'program_generator',
+    'compile_module': 'linker', 'link': 'linker', 'LinkError': 'linker',
+    'build_modules': 'modules',
+}
+
+__all__ = sorted(EXPORTS) + ['launch_gui']
+
+
+def __getattr__(name):
+    module = EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value  # Later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return __all__
+
+
+def launch_gui():
+    from GUI import CompilerGUI
+
+    CompilerGUI().mainloop()
+
+
+if __name__ == '__main__':
+    launch_gui()
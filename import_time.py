@@ -0,0 +1,97 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# What a headless tool does before compiling: import the library and reach
+# the compiler
+HEADLESS_STATEMENT = 'import enigma; enigma.compile_source'
+# Cumulative import time allowed for it; about 11 ms on a warm cache today
+DEFAULT_BUDGET_MS = 25.0
+# Modules the headless path must never import
+FORBIDDEN_MODULES = ('tkinter',)
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(statement, runs=5):
+    """{module: (self microseconds, cumulative microseconds, depth)} of
+    everything statement imports beyond interpreter startup, from the
+    fastest of runs fresh interpreters reporting with -X importtime.
+
+    A first run fills the bytecode cache, so compiling sources is never
+    counted, even where PYTHONDONTWRITEBYTECODE is set.
+    """
+    environment = dict(os.environ)
+    environment.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    def run(code):
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                   cwd=HERE, env=environment, capture_output=True,
+                                   text=True, check=True)
+        return parse_import_times(completed.stderr)
+
+    startup = set(run('pass'))
+    run(statement)
+    best = None
+    for _ in range(runs):
+        modules = {name: entry for name, entry in run(statement).items() if name not in startup}
+        if best is None or total_microseconds(modules) < total_microseconds(best):
+            best = modules
+    return best
+
+
+def parse_import_times(report):
+    modules = {}
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(own), int(cumulative),
+                                 (len(name) - len(name.lstrip()) - 1) // 2)
+    return modules
+
+
+def total_microseconds(modules):
+    # Outermost imports already include everything they imported in turn
+    return sum(cumulative for _, cumulative, depth in modules.values() if depth == 0)
+
+
+def format_import_times(modules, budget_ms, top=15):
+    total = total_microseconds(modules) / 1000
+    lines = [f"{total:.2f} ms of imports over {len(modules)} module(s), budget {budget_ms:g} ms",
+             f"{'Self ms':>8} {'Total ms':>9}  Module", '-' * 40]
+    for name, (own, cumulative, _) in sorted(modules.items(),
+                                             key=lambda item: item[1][0], reverse=True)[:top]:
+        lines.append(f"{own / 1000:>8.2f} {cumulative / 1000:>9.2f}  {name}")
+    return "\n".join(lines)
+
+
+def check_imports(modules, budget_ms, forbidden=FORBIDDEN_MODULES):
+    """What is wrong with modules: forbidden packages imported, time over budget."""
+    problems = []
+    imported = [name for name in modules if name.split('.')[0] in forbidden]
+    if imported:
+        problems.append(f"Imports forbidden modules: {', '.join(imported)}")
+    if total_microseconds(modules) / 1000 > budget_ms:
+        problems.append(f"Over the {budget_ms:g} ms budget")
+    return problems
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(
+        description="Check the import time of the headless compile path against a budget.")
+    argument_parser.add_argument('--statement', default=HEADLESS_STATEMENT,
+                                 help="code whose imports are measured (default %(default)r)")
+    argument_parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS,
+                                 help="allowed milliseconds (default %(default)g)")
+    argument_parser.add_argument('--runs', type=int, default=5,
+                                 help="interpreters to start; the fastest counts (default 5)")
+    argument_parser.add_argument('--top', type=int, default=15, help="slowest modules shown")
+    arguments = argument_parser.parse_args()
+
+    modules = import_times(arguments.statement, arguments.runs)
+    print(format_import_times(modules, arguments.budget, arguments.top))
+    problems = check_imports(modules, arguments.budget)
+    for problem in problems:
+        print(f"\n{problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,345 @@
+import argparse
+import time
+
+from assembly import ALU_OPERATIONS, Instruction
+from vm import COMPLETED, EMPTY, FLOAT, INT, RUNTIME_ERRORS, STRING, VirtualMachine
+
+# Backward jumps to one offset before the loop there is compiled
+HOT_LOOP_THRESHOLD = 50
+# Guard failures a compiled region may cause before it is thrown away
+MAX_SIDE_EXITS = 16
+# enum values that fit a memory cell without wrapping
+INT_MIN, INT_MAX = -(1 << 63), (1 << 63) - 1
+
+# Python expressions for ALU opcodes that need no helper; DIV goes through
+# ALU_OPERATIONS since it depends on the operand types
+INLINE_OPERATIONS = {
+    'ADD': '{0} + {1}', 'SUB': '{0} - {1}', 'MUL': '{0} * {1}',
+    'LT': '1 if {0} < {1} else 0', 'LE': '1 if {0} <= {1} else 0',
+    'GT': '1 if {0} > {1} else 0', 'GE': '1 if {0} >= {1} else 0',
+    'EQ': '1 if {0} == {1} else 0', 'NE': '1 if {0} != {1} else 0',
+}
+# Instructions a region can contain; anything else ends it
+COMPILABLE_OPCODES = {'LOAD', 'FLOAD', 'MOV', 'LDC', 'STORE', 'FSTORE', 'STR',
+                      'JMP', 'JZ', 'JNZ'} | set(ALU_OPERATIONS)
+
+
+class CompilingVirtualMachine(VirtualMachine):
+    """A VirtualMachine that compiles hot loops into Python functions.
+
+    Backward jumps are counted per target. Once a target gets hot, the
+    blocks that both start there and lead back there are translated into
+    one generated function: operands are bound in as constants, the
+    per-instruction dispatch disappears and control stays inside while the
+    loop runs. The region is patched into the instruction table at its
+    entry, so the interpreter enters it like any other instruction.
+
+    Loads are specialised for the kind of value the cell held when the
+    region was compiled. A guard checks that before each load and, when it
+    fails, returns to the interpreter at that instruction. A region that
+    keeps failing is removed and never compiled again.
+
+    Regions check vm.running at their own backward jumps, so cancel()
+    stops them too. Under limits they also count the instructions they run
+    and check the instruction budget and deadline there. An instruction
+    failing inside a region faults the run at that instruction, as it
+    would in the interpreter.
+    """
+
+    def __init__(self, program, threshold=HOT_LOOP_THRESHOLD, **limits):
+        super().__init__(program, **limits)
+        self.threshold = threshold
+        self.unpatched = super()._instruction_table()
+        self.instructions = list(self.unpatched)  # Patched per machine
+        self.leaders = self.program.block_leaders()
+        self.opcodes = [Instruction(text).opcode for text in self.program.texts]
+        self.back_edges = {}
+        self.regions = {}  # Entry offset -> generated source, for inspection
+        self.region_lines = {}  # Entry offset -> instruction of each generated line
+        self.side_exits = {}
+        self.blacklist = set()
+
+    def _instruction_table(self):
+        return self.instructions
+
+    def _run(self, instructions):
+        end = len(instructions)
+        while self.running and self.pc < end:
+            pc = self.pc
+            handler, arguments = instructions[pc]
+            self.pc = pc + 1
+            handler(self, *arguments)
+            if self.pc <= pc:
+                self._count_back_edge(self.pc)
+        self.running = False
+
+    def _count_back_edge(self, target):
+        if target in self.regions or target in self.blacklist:
+            return
+        count = self.back_edges.get(target, 0) + 1
+        self.back_edges[target] = count
+        if count >= self.threshold:
+            self._compile_region(target)
+
+    def _run_region(self, region, entry):
+        try:
+            self.pc, guard_failed, executed = region(self)
+        except RUNTIME_ERRORS as e:
+            # Leave pc where the interpreter would: just past the failed instruction
+            self.pc = self._failed_instruction(e, entry) + 1
+            raise
+        if self.limited:
+            self.executed += entry - self.segment_start + executed
+            self.segment_start = self.pc
+            if self._limit_reached():
+                self.running = False
+                return
+        if guard_failed:
+            self.side_exits[entry] = self.side_exits.get(entry, 0) + 1
+            if self.side_exits[entry] > MAX_SIDE_EXITS:
+                self.instructions[entry] = self.unpatched[entry]
+                del self.regions[entry]
+                self.blacklist.add(entry)
+            if self.pc == entry:
+                # The slot at entry is the region itself, so interpret the
+                # instruction it replaced here or the exit would re-enter it
+                handler, arguments = self.unpatched[entry]
+                self.pc = entry + 1
+                handler(self, *arguments)
+
+    def _failed_instruction(self, error, entry):
+        """The instruction of region entry that raised error, found through
+        the line of generated code the traceback stopped at."""
+        filename = f"<region {entry}>"
+        line_number = None
+        traceback = error.__traceback__
+        while traceback is not None:
+            if traceback.tb_frame.f_code.co_filename == filename:
+                line_number = traceback.tb_lineno
+            traceback = traceback.tb_next
+        return self.region_lines[entry][line_number - 1]
+
+    def _block_end(self, start):
+        for leader in self.leaders:
+            if leader > start:
+                return leader
+        return len(self.instructions)
+
+    def _successors(self, start):
+        """Offsets control can go to from the block at start, or None if the
+        block holds an instruction a region cannot contain."""
+        if start >= len(self.instructions):
+            return None
+        end = self._block_end(start)
+        if any(self.opcodes[index] not in COMPILABLE_OPCODES for index in range(start, end)):
+            return None
+        last = end - 1
+        targets = self._targets(last)
+        if self.opcodes[last] == 'JMP':
+            return [targets[0]]
+        successors = list(targets)
+        if end < len(self.instructions):
+            successors.append(end)
+        return successors
+
+    def _targets(self, index):
+        arguments = self.program.instructions[index][1]
+        if self.opcodes[index] == 'JMP':
+            return [arguments[0]]
+        if self.opcodes[index] in ('JZ', 'JNZ'):
+            return [arguments[1]]
+        return []
+
+    def _region_blocks(self, entry):
+        """Blocks reachable from entry that can also get back to it."""
+        successors = {}
+        stack = [entry]
+        while stack:
+            start = stack.pop()
+            if start in successors:
+                continue
+            successors[start] = self._successors(start) or []
+            stack.extend(successors[start])
+        region = {entry}
+        changed = True
+        while changed:
+            changed = False
+            for start, targets in successors.items():
+                if start not in region and any(target in region for target in targets):
+                    region.add(start)
+                    changed = True
+        return sorted(region)
+
+    def _compile_region(self, entry):
+        if self._successors(entry) is None:
+            self.blacklist.add(entry)
+            return
+        source, constants, lines = self._generate_region(entry, self._region_blocks(entry))
+        namespace = {'K': constants, 'OPERATIONS': ALU_OPERATIONS,
+                     'INT': INT, 'FLOAT': FLOAT, 'STRING': STRING,
+                     'INT_MIN': INT_MIN, 'INT_MAX': INT_MAX,
+                     'INFINITY': float('inf'), 'clock': time.monotonic}
+        exec(compile(source, f"<region {entry}>", 'exec'), namespace)
+        self.regions[entry] = source
+        self.region_lines[entry] = lines
+        self.instructions[entry] = (CompilingVirtualMachine._run_region,
+                                    (namespace[f"region_{entry}"], entry))
+
+    def _generate_region(self, entry, blocks):
+        constants = []
+        lines = [f"def region_{entry}(vm):",
+                 "    R = vm.registers",
+                 "    I = vm.ints",
+                 "    F = vm.floats",
+                 "    T = vm.tags",
+                 "    S = vm.strings",
+                 "    fp = vm.fp",
+                 f"    pc = {entry}"]
+        if self.limited:
+            # n counts the instructions run in here, at the end of each block
+            lines += ["    n = 0",
+                      "    budget = (INFINITY if vm.max_instructions is None",
+                      "              else vm.max_instructions - vm.executed)",
+                      "    deadline = INFINITY if vm.deadline is None else vm.deadline"]
+        lines.append("    while True:")
+        # The instruction each line of lines was generated for, or None
+        instructions = []
+        region = set(blocks)
+        for start in blocks:
+            lines.append(f"        if pc == {start}:")
+            end = self._block_end(start)
+            for index in range(start, end):
+                if self.opcodes[index] not in COMPILABLE_OPCODES:
+                    lines.append("            " + self._exit(index, False, index - start))
+                    break
+                generated = self._generate_instruction(index, start, region, constants)
+                instructions.extend([None] * (len(lines) - len(instructions)))
+                lines.extend("            " + line for line in generated)
+                instructions.extend([index] * (len(lines) - len(instructions)))
+            else:
+                if self.opcodes[end - 1] != 'JMP':
+                    lines.extend("            " + line
+                                 for line in self._goto(end, start, end - start, region))
+        lines.append("        " + self._exit('pc', False, 0))
+        instructions.extend([None] * (len(lines) - len(instructions)))
+        return "\n".join(lines) + "\n", constants, instructions
+
+    def _exit(self, target, guard_failed, executed):
+        """Leave the region for the interpreter at target, reporting how many
+        instructions ran (executed of them in the current block)."""
+        return f"return {target}, {guard_failed}, {f'n + {executed}' if self.limited else 0}"
+
+    def _goto(self, target, start, executed, region):
+        if target not in region:
+            return [self._exit(target, False, executed)]
+        lines = []
+        if self.limited:
+            lines.append(f"n += {executed}")
+        if target <= start:
+            # Every loop inside the region passes a jump like this one, so
+            # checking here also sees a cancel() from another thread
+            stop = "not vm.running"
+            if self.limited:
+                stop = f"n >= budget or clock() >= deadline or {stop}"
+            lines += [f"if {stop}:", "    " + self._exit(target, False, 0)]
+        return lines + [f"pc = {target}", "continue"]
+
+    def _constant(self, value, constants):
+        if type(value) is int:
+            return repr(value)
+        constants.append(value)
+        return f"K[{len(constants) - 1}]"
+
+    def _cell(self, handler_name, argument):
+        if handler_name.endswith('_frame'):
+            return f"fp + {argument}" if argument >= 0 else f"fp - {-argument}"
+        return str(argument)
+
+    def _guarded_read(self, index, start, cell, absolute):
+        """The guard for reading cell and the expression that then reads it,
+        specialised for the kind of value the cell holds."""
+        if absolute and self.tags[int(cell)] != EMPTY:
+            kind = self.tags[int(cell)]
+        else:
+            kind = FLOAT if self.opcodes[index] == 'FLOAD' else INT
+        if kind == FLOAT:
+            test, value = f"T[{cell}] != FLOAT", f"F[{cell}]"
+        elif kind == STRING:
+            test, value = f"T[{cell}] != STRING", f"S[I[{cell}]]"
+        else:
+            # Empty cells read as 0 through the int view as well
+            test, value = f"T[{cell}] > INT", f"I[{cell}]"
+        return [f"if {test}:", "    " + self._exit(index, True, index - start)], value
+
+    def _generate_instruction(self, index, start, region, constants):
+        handler, arguments = self.program.instructions[index]
+        name = handler.__name__
+        opcode = self.opcodes[index]
+        if name == '_load_immediate':
+            return [f"R[{arguments[1]}] = {self._constant(arguments[0], constants)}"]
+        if name == '_load_register':
+            return [f"R[{arguments[1]}] = R[{arguments[0]}]"]
+        if name in ('_load_memory', '_load_frame'):
+            cell = self._cell(name, arguments[0])
+            guard, value = self._guarded_read(index, start, cell, name == '_load_memory')
+            return guard + [f"R[{arguments[1]}] = {value}"]
+        if name in ('_store_memory', '_store_frame'):
+            cell = self._cell(name, arguments[1])
+            if opcode == 'FSTORE':
+                fast = [f"if type(v) is float:", f"    F[{cell}] = v", f"    T[{cell}] = FLOAT"]
+            else:
+                fast = [f"if type(v) is int and INT_MIN <= v <= INT_MAX:",
+                        f"    I[{cell}] = v", f"    T[{cell}] = INT"]
+            # Anything else takes the interpreter's general path
+            return [f"v = R[{arguments[0]}]"] + fast + ["else:", f"    vm._write({cell}, v)"]
+        if name in ('_store_literal_memory', '_store_literal_frame'):
+            cell = self._cell(name, arguments[1])
+            return [f"vm._write({cell}, {self._constant(arguments[0], constants)})"]
+        if name.startswith('_alu_'):
+            operation, source, left, destination = arguments
+            guard = []
+            if name == '_alu_immediate':
+                right = self._constant(source, constants)
+            elif name == '_alu_register':
+                right = f"R[{source}]"
+            else:
+                guard, right = self._guarded_read(index, start, self._cell(name, source),
+                                                  name == '_alu_memory')
+            if opcode in INLINE_OPERATIONS:
+                expression = INLINE_OPERATIONS[opcode].format(f"R[{left}]", right)
+            else:
+                expression = f"OPERATIONS[{opcode!r}](R[{left}], {right})"
+            return guard + [f"R[{destination}] = {expression}"]
+        executed = index - start + 1
+        if opcode == 'JMP':
+            return self._goto(arguments[0], start, executed, region)
+        if opcode in ('JZ', 'JNZ'):
+            register, target = arguments
+            test = f"not R[{register}]" if opcode == 'JZ' else f"R[{register}]"
+            return [f"if {test}:"] + ["    " + line
+                                      for line in self._goto(target, start, executed, region)]
+        raise ValueError(f"Cannot compile '{self.program.texts[index]}'")
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(
+        description="Run generated Enigma assembly, compiling hot loops.")
+    argument_parser.add_argument('assembly_file')
+    argument_parser.add_argument('--threshold', type=int, default=HOT_LOOP_THRESHOLD)
+    argument_parser.add_argument('--max-instructions', type=int)
+    argument_parser.add_argument('--timeout', type=float, help="seconds")
+    argument_parser.add_argument('--show-regions', action='store_true',
+                                 help="print the code generated for each region")
+    arguments = argument_parser.parse_args()
+
+    with open(arguments.assembly_file) as file:
+        vm = CompilingVirtualMachine(file.read(), arguments.threshold,
+                                     max_instructions=arguments.max_instructions,
+                                     timeout=arguments.timeout).run()
+    print(vm.memory_dump())
+    if vm.status != COMPLETED:
+        print(vm.result().describe())
+    if arguments.show_regions:
+        for entry, source in vm.regions.items():
+            print(f"\n# region at {entry}, {vm.side_exits.get(entry, 0)} side exit(s)")
+            print(source)
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import re
+import sys
+
+from assembly import Instruction
+from pipeline import LexicalError, Pipeline
+from vm import ADDRESS_STEP, GLOBAL_BASE
+
+# Bumped whenever the layout of object files changes, so old ones are rebuilt
+OBJECT_FORMAT = 1
+OBJECT_EXTENSION = '.eo'
+# Imported globals are compiled against placeholder addresses from here on,
+# far above any module's own globals, and get their real ones at link time
+EXTERNAL_BASE = 1 << 30
+MODULE_NAME_REGEX = re.compile(r'^[a-zA-Z][_a-zA-Z0-9]*$')
+
+
+class LinkError(Exception):
+    pass
+
+
+def module_name(path):
+    """The module a source file defines: its file name without extension."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if not MODULE_NAME_REGEX.match(name):
+        raise ValueError(f"'{path}' is not a valid module name; use letters, digits and '_'")
+    return name
+
+
+def source_digest(source_code):
+    return hashlib.sha256(source_code.encode()).hexdigest()
+
+
+def interface_of(object_file):
+    """What importers of a module compile against: its globals with their
+    types and its functions with their signatures, but no addresses."""
+    symbols = object_file['symbols']
+    return {'globals': {identifier: {'data_type': entry['data_type']}
+                        for identifier, entry in symbols['globals'].items()},
+            'functions': symbols['functions']}
+
+
+def interface_digest(interface):
+    return hashlib.sha256(json.dumps(interface, sort_keys=True).encode()).hexdigest()
+
+
+def compile_module(name, source_code, imports=None, level=2, tracer=None):
+    """Compile one module to a relocatable object file, returned as a dict.
+
+    imports maps the name of every module the source may import to its
+    interface_of(). Raises what Pipeline.compile() raises.
+
+    The object holds the optimized code with its globals at addresses
+    counted from GLOBAL_BASE, its constant pool, the symbols it defines
+    (every global and function; functions are kept even if the module
+    never calls them) and the relocations link() applies: for each
+    operand to patch, [line, operand, kind, target] where kind is 'data'
+    (target is an offset into the module's globals), 'global' or
+    'function' ([module, name] of an imported symbol), 'constant' (index
+    into the pool) or 'label' (a local label, renamed per module).
+    """
+    imports = imports or {}
+    available = {}
+    externals = {}  # Placeholder address -> [module, identifier]
+    address = EXTERNAL_BASE
+    for module in sorted(imports):
+        interface = imports[module]
+        global_entries = {}
+        for identifier in sorted(interface['globals']):
+            global_entries[identifier] = {
+                'data_type': interface['globals'][identifier]['data_type'],
+                'memory_location': address}
+            externals[address] = [module, identifier]
+            address += ADDRESS_STEP
+        available[module] = {'globals': global_entries, 'functions': interface['functions']}
+
+    pipeline = Pipeline(level, tracer)
+    tokens, errors = pipeline.tokenize(source_code)
+    if errors:
+        raise LexicalError("; ".join(str(error) for error in errors))
+    pipeline.parse(tokens, source_code, available)
+    semantic_analyzer = pipeline.analyze(tokens, available)
+    assembly_code = pipeline.generate(tokens, pipeline.build_symbol_table(tokens), available)
+    functions = {}
+    for function_name, function in semantic_analyzer.function_table.items():
+        if function_name not in semantic_analyzer.imported_functions:
+            functions[function_name] = {
+                'return_type': function['return_type'],
+                'params': [function['locals'][parameter]['data_type']
+                           for parameter in function['params']]}
+    optimized_code = pipeline.optimize(assembly_code, entry_points=functions)
+
+    code_generator = pipeline.code_generator
+    global_symbols = {
+        identifier: {'data_type': entry['data_type'],
+                     'offset': entry['memory_location'] - GLOBAL_BASE}
+        for identifier, entry in code_generator.symbol_table.items()
+        if isinstance(entry.get('memory_location'), int) and entry['memory_location'] < EXTERNAL_BASE}
+    imported = [token['value'].split()[1] for token in tokens if token['type'] == 'IMPORT']
+    function_modules = {function_name: module for module in imported
+                        for function_name in imports[module]['functions']}
+
+    constants = []
+    pool_positions = {}  # Index in the optimized code's pool -> index in constants
+    code = []
+    for line in optimized_code.splitlines():
+        if line.startswith('CONST'):
+            entry = Instruction(line)
+            pool_positions[int(entry.operands[0])] = len(constants)
+            constants.append(entry.operands[1])
+        elif line.strip():
+            code.append(line)
+    relocations = []
+    for number, line in enumerate(code):
+        instruction = Instruction(line)
+        if instruction.is_label:
+            if instruction.operands[0] not in functions:
+                relocations.append([number, 0, 'label', instruction.operands[0]])
+            continue
+        if instruction.branch_target() is not None:
+            position = 0 if instruction.opcode == 'JMP' else 1
+            relocations.append([number, position, 'label', instruction.branch_target()])
+        target = instruction.call_target()
+        if target is not None and target not in functions:
+            relocations.append([number, 0, 'function', [function_modules[target], target]])
+        if instruction.opcode == 'LDC':
+            relocations.append([number, 0, 'constant', pool_positions[int(instruction.operands[0])]])
+        for position, location in ((0, instruction.memory_read()),
+                                   (1, instruction.memory_written())):
+            if location is None or not location.isdigit():
+                continue  # Frame slots need no relocation
+            if int(location) >= EXTERNAL_BASE:
+                relocations.append([number, position, 'global', externals[int(location)]])
+            else:
+                relocations.append([number, position, 'data', int(location) - GLOBAL_BASE])
+
+    return {
+        'format': OBJECT_FORMAT,
+        'module': name,
+        'level': level,
+        'source_digest': source_digest(source_code),
+        'imports': imported,
+        # The interfaces this object was compiled against; while they are
+        # unchanged, edits to the imported modules never require a rebuild
+        'import_digests': {module: interface_digest(imports[module]) for module in imported},
+        'symbols': {'globals': global_symbols, 'functions': functions},
+        'globals_size': code_generator.memory_location_counter - GLOBAL_BASE,
+        'constants': constants,
+        'code': code,
+        'relocations': relocations,
+    }
+
+
+def write_object(path, object_file):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Written aside and renamed, so an interrupted build never leaves half an object
+    with open(path + '.tmp', 'w') as file:
+        json.dump(object_file, file)
+    os.replace(path + '.tmp', path)
+
+
+def read_object(path):
+    """The object file at path, or None when it is missing, unreadable or
+    written by another version of the compiler."""
+    try:
+        with open(path) as file:
+            object_file = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(object_file, dict) or object_file.get('format') != OBJECT_FORMAT:
+        return None
+    return object_file
+
+
+def link_order(objects, entry=None):
+    """Module names reachable from entry (every module when None), each
+    after all the modules it imports."""
+    order = []
+    state = {}  # Module -> 'visiting' or 'done'
+
+    def visit(module, importer, path):
+        if state.get(module) == 'done':
+            return
+        if state.get(module) == 'visiting':
+            cycle = path[path.index(module):] + [module]
+            raise LinkError(f"Import cycle: {' -> '.join(cycle)}")
+        if module not in objects:
+            raise LinkError(f"Module '{module}' imported by '{importer}' is missing")
+        state[module] = 'visiting'
+        for imported in objects[module]['imports']:
+            visit(imported, module, path + [module])
+        state[module] = 'done'
+        order.append(module)
+
+    if entry is not None and entry not in objects:
+        raise LinkError(f"Entry module '{entry}' is missing")
+    for module in [entry] if entry is not None else sorted(objects):
+        visit(module, None, [])
+    return order
+
+
+def link(objects, entry=None):
+    """Resolve objects ({module: object file}) into one program.
+
+    The image is assembly the VM runs as it is: one constant pool, every
+    module's globals laid out one after another from GLOBAL_BASE, the
+    top-level code of each module in import order (so a module's globals
+    are set before its importers run) and then every function. Raises
+    LinkError on missing modules, import cycles, undefined symbols and
+    functions defined twice.
+    """
+    order = link_order(objects, entry)
+    defined = {}
+    for module in order:
+        for function_name in objects[module]['symbols']['functions']:
+            if function_name in defined:
+                raise LinkError(f"Function '{function_name}' is defined in both "
+                                f"'{defined[function_name]}' and '{module}'")
+            defined[function_name] = module
+    bases = {}
+    base = GLOBAL_BASE
+    for module in order:
+        bases[module] = base
+        base += objects[module]['globals_size']
+
+    pool = {}  # Literal -> index in the image's pool; equal literals are shared
+    main_code = []
+    function_code = []
+    for module in order:
+        object_file = objects[module]
+
+        def resolve(kind, target):
+            if kind == 'data':
+                return str(bases[module] + target)
+            if kind == 'constant':
+                return str(pool.setdefault(object_file['constants'][target], len(pool)))
+            if kind == 'label':
+                return f".{module}.{target.lstrip('.')}"
+            imported, identifier = target
+            symbols = objects[imported]['symbols'] if imported in bases else None
+            if kind == 'global':
+                if symbols is None or identifier not in symbols['globals']:
+                    raise LinkError(f"Undefined global '{identifier}' of module '{imported}', "
+                                    f"used by '{module}'")
+                return str(bases[imported] + symbols['globals'][identifier]['offset'])
+            if symbols is None or identifier not in symbols['functions']:
+                raise LinkError(f"Undefined function '{identifier}' of module '{imported}', "
+                                f"called by '{module}'")
+            return identifier
+
+        code = list(object_file['code'])
+        by_line = {}
+        for number, position, kind, target in object_file['relocations']:
+            by_line.setdefault(number, []).append((position, kind, target))
+        for number, patches in by_line.items():
+            instruction = Instruction(code[number])
+            operands = list(instruction.operands)
+            for position, kind, target in patches:
+                value = resolve(kind, target)
+                if kind == 'function':
+                    expected = len(objects[target[0]]['symbols']['functions'][value]['params'])
+                    if int(operands[1]) != expected:
+                        raise LinkError(f"'{module}' calls {value} with {operands[1]} argument(s) "
+                                        f"but '{target[0]}' defines it with {expected}")
+                operands[position] = f"[{value}]" if operands[position].startswith('[') else value
+            code[number] = (f"{operands[0]}:" if instruction.is_label
+                            else Instruction.build(instruction.opcode, *operands).text)
+
+        functions = object_file['symbols']['functions']
+        start = next((number for number, line in enumerate(code)
+                      if line.endswith(':') and line[:-1] in functions), len(code))
+        main_code.append(f"; module {module}")
+        main_code += _chain(code[:start], f".{module}.end")
+        function_code += code[start:]
+    constants = [f"CONST {index}, {literal}" for literal, index in pool.items()]
+    if function_code:
+        main_code.append("HALT")
+    return "\n".join(constants + main_code + function_code)
+
+
+def _chain(code, end_label):
+    """A module's top-level code, with its HALTs turned into jumps to its
+    end so the next module's code runs after it."""
+    last = max((number for number, line in enumerate(code)
+                if not line.startswith(';')), default=None)
+    chained = []
+    jumps = False
+    for number, line in enumerate(code):
+        if line.strip() == 'HALT':
+            if number == last:
+                continue
+            line = f"JMP {end_label}"
+            jumps = True
+        chained.append(line)
+    if jumps:
+        chained.append(f"{end_label}:")
+    return chained
+
+
+if __name__ == '__main__':
+    import argparse
+
+    argument_parser = argparse.ArgumentParser(
+        description="Link Enigma object files into one program.")
+    argument_parser.add_argument('objects', nargs='+', help=f"{OBJECT_EXTENSION} files")
+    argument_parser.add_argument('-e', '--entry',
+                                 help="module whose imports are linked (default: all modules)")
+    argument_parser.add_argument('-o', '--output', help="write the program here instead of stdout")
+    arguments = argument_parser.parse_args()
+
+    objects = {}
+    for path in arguments.objects:
+        object_file = read_object(path)
+        if object_file is None:
+            sys.exit(f"{path}: not an object file of this compiler")
+        objects[object_file['module']] = object_file
+    try:
+        image = link(objects, arguments.entry)
+    except LinkError as e:
+        sys.exit(f"Link error: {e}")
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(image + "\n")
+    else:
+        print(image)
@@ -1,8 +1,6 @@
-from tokenizer import tokenize
-from Parser import Parser, SyntaxError
-from semantic_analyzer import SemanticAnalyzer
-from code_generator import CodeGenerator
-from utils import create_enhanced_symbol_table, print_symbol_table
+from Parser import SyntaxError
+from pipeline import Pipeline
+from utils import print_symbol_table
 
 if __name__ == '__main__':
     source_code = '''
@@ -30,7 +28,8 @@ if __name__ == '__main__':
     }
     '''
 
-    tokens, errors = tokenize(source_code)  # Tokenization
+    pipeline = Pipeline(verbose=True)  # Times every phase below
+    tokens, errors = pipeline.tokenize(source_code)  # Tokenization
     for token in tokens:
         print(token)
     if errors:  # Check if there are any errors
@@ -39,9 +38,8 @@ if __name__ == '__main__':
             print(error)
 
     if not errors:
-        parser = Parser(tokens, source_code)
         try:
-            parser.parse()
+            pipeline.parse(tokens, source_code)
             print("Parsing completed successfully.")
         except SyntaxError as e:
             print(f"Syntax error: {e}")
@@ -51,7 +49,7 @@ if __name__ == '__main__':
             print(error)
 
     if not errors:
-        symbol_table = create_enhanced_symbol_table(tokens)
+        symbol_table = pipeline.build_symbol_table(tokens)
         print_symbol_table(symbol_table)
     else:
         print("Errors in source code, cannot create a valid symbol table:")
@@ -59,22 +57,33 @@ if __name__ == '__main__':
             print(error)
 
     if not errors:
-        semantic_analyzer = SemanticAnalyzer()
         try:
-            semantic_analyzer.analyze_code(tokens)
+            semantic_analyzer = pipeline.analyze(tokens)
             print("Semantic analysis successful!")
             print("Symbol Table:")
             for var_name, var_info in semantic_analyzer.symbol_table.items():
                 print(f"{var_name}: {var_info}")
 
             # Generate assembly code
-            code_generator = CodeGenerator()
-            code_generator.set_symbol_table(symbol_table)
-            assembly_code = code_generator.generate_code(tokens)
+            assembly_code = pipeline.generate(tokens, symbol_table)
             print("\nGenerated Assembly Code:")
             print(assembly_code)
 
+            # Optimize it and run the result headless on the VM
+            optimized_code = pipeline.optimize(assembly_code)
+            print("\nOptimized Assembly Code:")
+            print(optimized_code)
+
+            print("\nProgram Output:")
+            vm = pipeline.execute(optimized_code, timeout=5.0)
+            print(vm.memory_dump())
+            if not vm.result().completed:
+                print(vm.result().describe())
+
         except ValueError as e:
             print(f"Semantic error: {e}")
     else:
         print("Errors in source code, cannot perform semantic analysis.")
+
+    print("\nPhase Timings:")
+    print(pipeline.tracer.format_summary())
@@ -0,0 +1,222 @@
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from build import OK, SEMANTIC_ERROR, error_status, expand_sources
+from linker import (OBJECT_EXTENSION, LinkError, compile_module, interface_digest, interface_of,
+                    link, module_name, read_object, source_digest, write_object)
+from pass_manager import parse_level
+from tokenizer import tokenize
+
+# A module is not compiled when a module it imports failed to
+DEPENDENCY_FAILED = 'dependency failed'
+# What a build did with each module
+COMPILED = 'compiled'
+UP_TO_DATE = 'up to date'
+SKIPPED = 'skipped'
+
+
+def scan_imports(source_code):
+    """Names of the modules source_code imports, in order."""
+    tokens, _ = tokenize(source_code)
+    return [token['value'].split()[1] for token in tokens if token['type'] == 'IMPORT']
+
+
+def object_path(object_directory, module):
+    return os.path.join(object_directory, module + OBJECT_EXTENSION)
+
+
+def _compile_job(job):
+    module, source_code, imports, level = job
+    started = time.perf_counter()
+    try:
+        object_file = compile_module(module, source_code, imports, level)
+        status, message = OK, None
+    except Exception as e:
+        object_file = None
+        status, message = error_status(e)
+    return object_file, status, message, time.perf_counter() - started
+
+
+def build_modules(paths, object_directory, level=2, workers=None):
+    """Bring the object file of every module in paths up to date.
+
+    A module is compiled again when its source, the -O level or the
+    interface of a module it imports changed since its object was
+    written; edits that leave an interface alone never rebuild the
+    importers. A module is compiled as soon as everything it imports is
+    ready, so independent modules compile in parallel on a process pool.
+    Returns (summaries in path order, {module: object file} of every
+    module that built).
+    """
+    sources = {}
+    for path in paths:
+        module = module_name(path)
+        if module in sources:
+            raise ValueError(f"Module '{module}' is defined by both {sources[module][0]} and {path}")
+        with open(path) as file:
+            sources[module] = (path, file.read())
+
+    objects = {}
+    summaries = {}
+    imports = {}
+    for module, (path, source_code) in sources.items():
+        summaries[module] = {'module': module, 'path': path, 'status': OK, 'message': None,
+                             'action': SKIPPED, 'seconds': 0.0}
+        previous = read_object(object_path(object_directory, module))
+        if previous is not None and previous['source_digest'] == source_digest(source_code):
+            objects[module] = previous
+            imports[module] = previous['imports']
+        else:
+            imports[module] = scan_imports(source_code)
+
+    interfaces = {}  # Module -> interface, once its object is up to date
+    failed = set()
+
+    def fail(module, status, message):
+        summaries[module]['status'], summaries[module]['message'] = status, message
+        failed.add(module)
+
+    def finish(module, result):
+        object_file, status, message, seconds = result
+        summaries[module]['action'] = COMPILED
+        summaries[module]['seconds'] = seconds
+        if status != OK:
+            fail(module, status, message)
+            return
+        write_object(object_path(object_directory, module), object_file)
+        objects[module] = object_file
+        interfaces[module] = interface_of(object_file)
+
+    def is_current(module):
+        previous = objects.get(module)
+        return (previous is not None and previous['level'] == level
+                and previous['import_digests'] == {
+                    imported: interface_digest(interfaces[imported])
+                    for imported in imports[module]})
+
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    running = {}  # Future -> module
+    waiting = set(sources)
+    try:
+        while waiting or running:
+            ready = sorted(module for module in waiting
+                           if all(imported in interfaces or imported in failed
+                                  or imported not in sources for imported in imports[module]))
+            for module in ready:
+                waiting.discard(module)
+                missing = [imported for imported in imports[module] if imported not in sources]
+                broken = [imported for imported in imports[module] if imported in failed]
+                if missing:
+                    fail(module, SEMANTIC_ERROR, f"Module '{missing[0]}' not found")
+                elif broken:
+                    fail(module, DEPENDENCY_FAILED, f"Module '{broken[0]}' did not build")
+                elif is_current(module):
+                    summaries[module]['action'] = UP_TO_DATE
+                    interfaces[module] = interface_of(objects[module])
+                else:
+                    job = (module, sources[module][1],
+                           {imported: interfaces[imported] for imported in imports[module]}, level)
+                    if executor is None:
+                        future = Future()
+                        future.set_result(_compile_job(job))
+                    else:
+                        future = executor.submit(_compile_job, job)
+                    running[future] = module
+            if not running:
+                if not ready:
+                    # Whatever is left imports itself through a cycle
+                    for module in sorted(waiting):
+                        fail(module, SEMANTIC_ERROR,
+                             f"Import cycle among {', '.join(sorted(waiting))}")
+                    waiting.clear()
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(running.pop(future), future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    built = {module: objects[module] for module in sources if module not in failed}
+    return [summaries[module] for module in sources], built
+
+
+def entry_module(objects):
+    """The one module no other module imports."""
+    imported = {name for object_file in objects.values() for name in object_file['imports']}
+    entries = sorted(set(objects) - imported)
+    if len(entries) != 1:
+        raise LinkError(f"Cannot tell the entry module among {', '.join(entries) or 'none'}; "
+                        f"name it with --entry")
+    return entries[0]
+
+
+def format_summary(summaries, seconds, workers):
+    by_action = {}
+    for summary in summaries:
+        by_action[summary['action']] = by_action.get(summary['action'], 0) + 1
+    lines = [f"{len(summaries)} module(s) in {seconds:.2f}s with {workers} worker(s): "
+             + ', '.join(f"{count} {action}" for action, count in sorted(by_action.items())),
+             '', f"{'Module':<20} {'Action':<11} {'ms':>9}  Status", '-' * 56]
+    for summary in summaries:
+        status = summary['status']
+        if summary['message']:
+            status += f": {summary['message'].splitlines()[0]}"
+        lines.append(f"{summary['module']:<20} {summary['action']:<11} "
+                     f"{summary['seconds'] * 1000:>9.1f}  {status}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    argument_parser = argparse.ArgumentParser(
+        description="Compile Enigma modules to object files, rebuilding only what changed, "
+                    "and link them into one program.")
+    argument_parser.add_argument('sources', nargs='+',
+                                 help="files, directories or glob patterns; one module per file")
+    argument_parser.add_argument('-o', '--objects', default='build',
+                                 help=f"directory for the {OBJECT_EXTENSION} object files")
+    argument_parser.add_argument('-e', '--entry',
+                                 help="module the program starts from (default: the one "
+                                      "no other module imports)")
+    argument_parser.add_argument('--image', help="where to write the linked program "
+                                                 "(default: <entry>.asm among the objects)")
+    argument_parser.add_argument('-O', dest='level', default='2',
+                                 help="optimization level 0-3 (default 2)")
+    argument_parser.add_argument('-j', '--jobs', type=int, default=None,
+                                 help="worker processes (default: one per core)")
+    argument_parser.add_argument('--run', action='store_true', help="run the linked program")
+    argument_parser.add_argument('--timeout', type=float, default=5.0,
+                                 help="seconds before stopping the run (default 5)")
+    arguments = argument_parser.parse_args()
+
+    workers = arguments.jobs or os.cpu_count() or 1
+    started = time.perf_counter()
+    try:
+        summaries, objects = build_modules(expand_sources(arguments.sources), arguments.objects,
+                                           parse_level(arguments.level), workers)
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+    print(format_summary(summaries, time.perf_counter() - started, workers))
+    if any(summary['status'] != OK for summary in summaries):
+        sys.exit(1)
+    try:
+        entry = arguments.entry or entry_module(objects)
+        image = link(objects, entry)
+    except LinkError as e:
+        sys.exit(f"Link error: {e}")
+    image_path = arguments.image or os.path.join(arguments.objects, entry + '.asm')
+    with open(image_path, 'w') as file:
+        file.write(image + "\n")
+    print(f"\nLinked {entry} into {image_path}")
+    if arguments.run:
+        from pipeline import Pipeline
+
+        vm = Pipeline().execute(image, timeout=arguments.timeout)
+        print(vm.memory_dump())
+        if not vm.result().completed:
+            print(vm.result().describe())
+            sys.exit(1)
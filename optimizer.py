@@ -1,99 +1,725 @@
+from assembly import (ALU_OPCODES, ALU_OPERATIONS, BRANCH_OPCODES, LOAD_OPCODES,
+                      STORE_OPCODES, Instruction, is_memory, is_register, parse_literal)
+from cfg import DominatorTree, build_cfg
+from dataflow import DataflowAnalysis, GenKillAnalysis, Universe, solve
+from pass_manager import PassManager
+from peephole import PeepholeEngine
+
+# ALU opcodes whose operands can be swapped without changing the result
+COMMUTATIVE_OPCODES = {'ADD', 'MUL', 'EQ', 'NE'}
+
+
+class ValueTable:
+    """Value numbers of the registers, addresses and expressions at one point.
+
+    Two locations share a value number exactly when they are known to hold
+    the same value, so a recomputation can be replaced by a copy or dropped.
+
+    The table is scoped: every change is logged, and undo(mark) takes it
+    back to how it was at mark(). A walk of the dominator tree marks on
+    entering a block and undoes on leaving it, so each block sees what its
+    dominators left without copying the table.
+    """
+
+    def __init__(self):
+        self.counter = 0
+        self.location_numbers = {}
+        self.expression_numbers = {}
+        self.holders = {}
+        self.globals_held = {}  # Globals and rv with a number; a dict for its order
+        self.undo_log = []  # (kind, key, number) of every change, oldest first
+
+    def mark(self):
+        return len(self.undo_log)
+
+    def undo(self, mark):
+        while len(self.undo_log) > mark:
+            kind, key, number = self.undo_log.pop()
+            if kind == 'expression':
+                del self.expression_numbers[key]
+            elif kind == 'assign':
+                self._unset(key, number)
+            else:
+                self._set(key, number)
+
+    def fresh_number(self):
+        self.counter += 1
+        return self.counter
+
+    def number_of_location(self, location):
+        if location not in self.location_numbers:
+            self.assign(location, self.fresh_number())
+        return self.location_numbers[location]
+
+    def number_of_expression(self, key):
+        if key not in self.expression_numbers:
+            self.expression_numbers[key] = self.fresh_number()
+            self.undo_log.append(('expression', key, None))
+        return self.expression_numbers[key]
+
+    def number_of_operand(self, operand):
+        if is_register(operand):
+            return self.number_of_location(operand)
+        if is_memory(operand):
+            return self.number_of_location(operand.strip('[]'))
+        literal = parse_literal(operand)
+        return self.number_of_expression(('literal', type(literal).__name__, literal))
+
+    def assign(self, location, number):
+        self.kill(location)
+        self._set(location, number)
+        self.undo_log.append(('assign', location, number))
+
+    def kill(self, location):
+        number = self.location_numbers.get(location)
+        if number is not None:
+            self._unset(location, number)
+            self.undo_log.append(('kill', location, number))
+
+    def kill_globals(self):
+        """Forget everything a call may change: globals and rv."""
+        for location in list(self.globals_held):
+            self.kill(location)
+
+    def _set(self, location, number):
+        self.location_numbers[location] = number
+        self.holders.setdefault(number, set()).add(location)
+        if location.isdigit() or location == 'rv':
+            self.globals_held[location] = None
+
+    def _unset(self, location, number):
+        del self.location_numbers[location]
+        self.holders[number].discard(location)
+        self.globals_held.pop(location, None)
+
+    def register_holding(self, number):
+        registers = sorted(location for location in self.holders.get(number, ())
+                           if is_register(location))
+        return registers[0] if registers else None
+
+
+class LiveLocations(GenKillAnalysis):
+    """Backward liveness of registers and memory cells.
+
+    A location is live when its current value may still be read. Globals
+    are the program's output, so they are live wherever execution can stop
+    and before every CALL; a function's frame is discarded by RET. Blocks
+    that cannot reach HALT, RET or the end of the code only end when the
+    run is stopped from outside, at any instruction, and the globals stored
+    so far are its result, so globals are live throughout those blocks.
+    """
+
+    direction = 'backward'
+    meet_operator = 'union'
+
+    def __init__(self, cfg):
+        super().__init__()
+        self.universe = Universe()
+        self.globals = 0
+        for block in cfg.blocks:
+            for instruction in block.instructions:
+                for location in self.reads(instruction) + self.writes(instruction):
+                    bit = self.universe.add(location)
+                    if location.isdigit():
+                        self.globals |= bit
+        self.universe.add('rv')
+        self.trapped = self.trapped_blocks(cfg)
+
+    def trapped_blocks(self, cfg):
+        """Indices of the blocks from which no path leads to an exit."""
+        exits = [block for block in cfg.blocks if not block.successors]
+        reaches_exit = {block.index for block in exits}
+        while exits:
+            block = exits.pop()
+            for predecessor in block.predecessors:
+                if predecessor.index not in reaches_exit:
+                    reaches_exit.add(predecessor.index)
+                    exits.append(predecessor)
+        return {block.index for block in cfg.blocks} - reaches_exit
+
+    def reads(self, instruction):
+        locations = instruction.registers_read()
+        if instruction.memory_read() is not None:
+            locations = locations + [instruction.memory_read()]
+        return locations
+
+    def writes(self, instruction):
+        return [location for location in (instruction.register_written(),
+                                          instruction.memory_written())
+                if location is not None]
+
+    def boundary(self, cfg, block):
+        last = block.last_instruction()
+        # A function also hands its result back in rv
+        if last is not None and last.opcode == 'RET':
+            return self.globals | self.universe.bit('rv')
+        return self.globals
+
+    def step(self, instruction, live):
+        """Liveness just above instruction, given liveness just below it."""
+        for location in self.writes(instruction):
+            live &= ~self.universe.bit(location)
+        if instruction.opcode == 'CALL':
+            live |= self.globals
+        for location in self.reads(instruction):
+            live |= self.universe.bit(location)
+        return live
+
+    def block_gen_kill(self, block):
+        gen = 0
+        kill = 0
+        for instruction in reversed(block.instructions):
+            for location in self.writes(instruction):
+                bit = self.universe.bit(location)
+                kill |= bit
+                gen &= ~bit
+            if instruction.opcode == 'CALL':
+                gen |= self.globals
+            for location in self.reads(instruction):
+                gen |= self.universe.bit(location)
+        if block.index in self.trapped:
+            gen |= self.globals
+        return gen, kill
+
+
+class ConstantPropagation(DataflowAnalysis):
+    """Sparse conditional constant propagation over registers and memory.
+
+    A value maps every register or address known to hold a constant to that
+    constant; anything missing is unknown. Branches on a known condition
+    only follow the edge that will be taken, so code behind a false
+    condition never pollutes the facts at the join.
+    """
+
+    direction = 'forward'
+
+    def __init__(self, cfg, constants):
+        self.cfg = cfg
+        self.constants = constants  # Constant pool index -> value
+
+    def initial(self):
+        return None  # Not reached yet
+
+    def boundary(self, cfg, block):
+        return {}
+
+    def meet(self, values):
+        result = None
+        for value in values:
+            if value is None:
+                continue
+            if result is None:
+                result = dict(value)
+            else:
+                result = {location: constant for location, constant in result.items()
+                          if location in value and value[location] == constant
+                          and type(value[location]) is type(constant)}
+        return result
+
+    def transfer(self, block, value):
+        state = dict(value or {})
+        for instruction in block.instructions:
+            self.step(instruction, state)
+        return state
+
+    def operand_value(self, operand, state):
+        if is_register(operand):
+            return state.get(operand)
+        if is_memory(operand):
+            return state.get(operand.strip('[]'))
+        return parse_literal(operand)
+
+    def evaluate(self, instruction, state):
+        """The constant an ALU instruction produces, or None."""
+        left = state.get(instruction.operands[1])
+        right = self.operand_value(instruction.operands[0], state)
+        if not isinstance(left, (int, float)) or not isinstance(right, (int, float)):
+            return None
+        try:
+            return ALU_OPERATIONS[instruction.opcode](left, right)
+        except ZeroDivisionError:
+            return None  # Leave the fault to run time
+
+    def step(self, instruction, state):
+        """Update state in place to the facts just after instruction."""
+        opcode = instruction.opcode
+        if opcode == 'LDC':
+            value = self.constants.get(int(instruction.operands[0]))
+        elif opcode in LOAD_OPCODES:
+            value = self.operand_value(instruction.operands[0], state)
+        elif opcode in ALU_OPCODES:
+            value = self.evaluate(instruction, state)
+        elif opcode in STORE_OPCODES or opcode == 'STR':
+            if opcode == 'STR':
+                value = parse_literal(instruction.operands[0])
+            else:
+                value = state.get(instruction.operands[0])
+            self.assign(state, instruction.operands[1], value)
+            return
+        elif opcode == 'CALL':
+            # The callee may write any global; its own frame is gone on return
+            for location in [location for location in state if location.isdigit()]:
+                del state[location]
+            value = None
+        else:
+            return
+        self.assign(state, instruction.register_written(), value)
+
+    def assign(self, state, location, value):
+        if value is None:
+            state.pop(location, None)
+        else:
+            state[location] = value
+
+    def branch_outcome(self, instruction, state):
+        """True if a JZ/JNZ is known to jump, False if known not to, else None."""
+        if instruction is None or instruction.opcode not in BRANCH_OPCODES:
+            return None
+        condition = state.get(instruction.operands[0])
+        if condition is None:
+            return None
+        return (not condition) if instruction.opcode == 'JZ' else bool(condition)
+
+    def feasible_successors(self, block, value):
+        last = block.last_instruction()
+        taken = self.branch_outcome(last, value or {})
+        if taken is None:
+            return block.successors
+        target = self.cfg.label_to_block.get(last.branch_target())
+        if taken:
+            return [target]
+        return [successor for successor in block.successors if successor is not target] or [target]
+
+
 class Optimizer:
+    def __init__(self, level=2, max_iterations=None, tracer=None, entry_points=()):
+        self.level = level
+        self.max_iterations = max_iterations
+        self.tracer = tracer  # A pipeline.Tracer to record every pass run, or None
+        # Function labels kept even when nothing in this code calls them
+        self.entry_points = entry_points
+        self.pass_manager = None  # Statistics of the most recent optimize()
+        self.peephole = PeepholeEngine()
+        self.highest_registers = None  # Register numbers handed out by the loop passes
+
     def optimize(self, assembly_code):
-        # Split the assembly code into individual instructions
-        instructions = assembly_code.split("\n")
+        # Split the assembly code into basic blocks
+        cfg = build_cfg(assembly_code.split("\n"), self.entry_points)
 
-        # Apply optimizations
-        instructions = self.constant_folding(instructions)
-        instructions = self.common_subexpression_elimination(instructions)
-        instructions = self.peephole_optimization(instructions)
-        instructions = self.remove_unused_labels(instructions)
-        instructions = self.remove_redundant_jumps(instructions)
-        optimized_instructions = self.dead_code_elimination(instructions)
+        # Apply the optimizations of the selected -O level
+        self.pass_manager = PassManager(self, self.level, self.max_iterations, self.tracer)
+        self.pass_manager.run(cfg)
 
         # Reconstruct the optimized assembly code
-        optimized_code = "\n".join(optimized_instructions)
+        optimized_code = "\n".join(cfg.to_lines())
         return optimized_code
 
-    def constant_folding(self, instructions):
-        optimized_instructions = []
-        for instruction in instructions:
-            parts = instruction.split()
-            if len(parts) == 4 and parts[0] == 'LOAD' and parts[2] == ',' and parts[1].isdigit():
-                optimized_instructions.append(instruction)
-            else:
-                optimized_instructions.append(instruction)
-        return optimized_instructions
-
-    def common_subexpression_elimination(self, instructions):
-        optimized_instructions = []
-        seen = {}
-        for instruction in instructions:
-            if instruction in seen:
+    def constant_folding(self, cfg):
+        # Fold and propagate constants, then prune blocks that only a branch
+        # on a known-false condition could have reached
+        constants = {}
+        for line in cfg.header:
+            entry = Instruction(line)
+            constants[int(entry.operands[0])] = parse_literal(entry.operands[1])
+        propagation = ConstantPropagation(cfg, constants)
+        before, _ = solve(cfg, propagation)
+        for block in cfg.blocks:
+            if block.index not in propagation.visited:
                 continue
-            else:
-                seen[instruction] = True
-                optimized_instructions.append(instruction)
-        return optimized_instructions
+            state = dict(before[block.index] or {})
+            optimized_instructions = []
+            for instruction in block.instructions:
+                folded = self._fold_instruction(
+                    cfg, constants, propagation, instruction, state)
+                propagation.step(instruction, state)
+                if folded is not None:
+                    optimized_instructions.append(folded)
+            block.instructions = optimized_instructions
+        cfg.blocks = [block for block in cfg.blocks if block.index in propagation.visited]
+        cfg.renumber()
+        cfg.rebuild_edges()
 
-    def peephole_optimization(self, instructions):
-        optimized_instructions = []
-        i = 0
-        while i < len(instructions):
-            if i < len(instructions) - 1:
-                inst1 = instructions[i]
-                inst2 = instructions[i + 1]
-                if inst1.startswith("LOAD") and inst2.startswith("STORE"):
-                    parts1 = inst1.split()
-                    parts2 = inst2.split()
-                    if parts1[1] == parts2[1]:
-                        optimized_instructions.append(
-                            f"MOV {parts1[1]}, {parts2[2]}")
-                        i += 2
+    def _fold_instruction(self, cfg, constants, propagation, instruction, state):
+        """A cheaper equivalent of instruction given the known constants, or None to drop it."""
+        opcode = instruction.opcode
+        if opcode in BRANCH_OPCODES:
+            taken = propagation.branch_outcome(instruction, state)
+            if taken is None:
+                return instruction
+            return Instruction.build("JMP", instruction.branch_target()) if taken else None
+        if opcode in ALU_OPCODES:
+            result = propagation.evaluate(instruction, state)
+            if result is not None:
+                return self._load_constant(cfg, constants, result, instruction.register_written())
+            source = instruction.operands[0]
+            if is_register(source) and isinstance(state.get(source), int):
+                return Instruction.build(
+                    opcode, state[source], *instruction.operands[1:])
+            return instruction
+        if opcode in ('LOAD', 'FLOAD', 'MOV') and not self._is_immediate(instruction.operands[0]):
+            value = propagation.operand_value(instruction.operands[0], state)
+            if isinstance(value, (int, float)):
+                return self._load_constant(cfg, constants, value, instruction.register_written())
+        return instruction
+
+    def _is_immediate(self, operand):
+        return not is_register(operand) and not is_memory(operand)
+
+    def _load_constant(self, cfg, constants, value, register):
+        if isinstance(value, int):
+            return Instruction.build("LOAD", value, register)
+        # Floats live in the constant pool, like the ones the code generator emits
+        for index, constant in constants.items():
+            if type(constant) is float and constant == value:
+                return Instruction.build("LDC", index, register)
+        index = len(constants)
+        constants[index] = value
+        cfg.header.append(f"CONST {index}, {value!r}")
+        return Instruction.build("LDC", index, register)
+
+    def loop_invariant_code_motion(self, cfg):
+        # Compute values that cannot change inside a loop once, in its
+        # preheader. The instruction in the loop becomes a copy from a fresh
+        # register, so later uses and liveness are untouched; dead copies go
+        # in dead_code_elimination.
+        self._transform_loops(cfg, self._hoist_invariants)
+
+    def strength_reduction(self, cfg):
+        # A variable stepped by a constant on every write in a loop is an
+        # induction variable. Multiples of it are kept in a register that is
+        # stepped alongside, turning a load and MUL into a copy, and the MUL
+        # into an ADD at the update.
+        self._transform_loops(cfg, self._reduce_induction_variables)
+
+    def _transform_loops(self, cfg, transform):
+        """Apply transform to every loop, innermost first.
+
+        Dominators and loops are found once; a preheader a transform adds
+        is patched into both, joining the loops around its own. New
+        registers are numbered on from the highest one in use.
+        """
+        dominator_tree = DominatorTree(cfg)
+        self.highest_registers = self._highest_registers(cfg)
+        for loop in cfg.natural_loops(dominator_tree):
+            transform(cfg, loop, dominator_tree)
+        cfg.renumber()
+
+    def _loop_writes(self, loop):
+        """Registers and addresses written anywhere in loop, and whether it calls."""
+        registers = set()
+        addresses = set()
+        calls = False
+        for block in loop.blocks:
+            for instruction in block.instructions:
+                if instruction.register_written() is not None:
+                    registers.add(instruction.register_written())
+                if instruction.memory_written() is not None:
+                    addresses.add(instruction.memory_written())
+                calls = calls or instruction.opcode == 'CALL'
+        return registers, addresses, calls
+
+    def _is_loop_invariant_address(self, address, written_addresses, calls):
+        # A callee may write any global but never the caller's frame
+        return address not in written_addresses and not (calls and address.isdigit())
+
+    def _hoist_invariants(self, cfg, loop, dominator_tree):
+        written_registers, written_addresses, calls = self._loop_writes(loop)
+        hoisted = []
+        replacements = []
+        for block in sorted(loop.blocks, key=lambda block: block.index):
+            invariant = {}  # Register -> register outside the loop holding its value
+            for position, instruction in enumerate(block.instructions):
+                opcode = instruction.opcode
+                destination = instruction.register_written()
+                if destination is None:
+                    continue
+                invariant.pop(destination, None)
+                if opcode not in LOAD_OPCODES and opcode not in ALU_OPCODES:
+                    continue
+                sources = {}
+                for register in instruction.registers_read():
+                    if register not in written_registers:
+                        sources[register] = register
+                    elif register in invariant:
+                        sources[register] = invariant[register]
+                    else:
+                        break
+                else:
+                    address = instruction.memory_read()
+                    if address is not None and not self._is_loop_invariant_address(
+                            address, written_addresses, calls):
                         continue
-            optimized_instructions.append(instructions[i])
-            i += 1
-        return optimized_instructions
+                    if opcode == 'MOV' and sources:
+                        invariant[destination] = sources[instruction.operands[0]]
+                        continue
+                    if (opcode in LOAD_OPCODES and address is None) or (
+                            opcode == 'DIV' and not self._is_nonzero_immediate(instruction.operands[0])):
+                        continue  # Nothing to gain, or may fault if the loop never runs
+                    register = self._new_register(destination)
+                    operands = [sources.get(operand, operand) for operand in instruction.operands]
+                    operands[-1] = register
+                    hoisted.append(Instruction.build(opcode, *operands))
+                    replacements.append(
+                        (block, position, Instruction.build("MOV", register, destination)))
+                    invariant[destination] = register
+        if not hoisted:
+            return
+        preheader = cfg.preheader(loop, dominator_tree)
+        if preheader is None:
+            return
+        for block, position, instruction in replacements:
+            block.instructions[position] = instruction
+        self._append_before_jump(preheader, hoisted)
 
-    def remove_unused_labels(self, instructions):
-        optimized_instructions = []
-        used_labels = set()
-        for instruction in instructions:
-            if instruction.startswith("JMP") or instruction.startswith("IF"):
-                parts = instruction.split()
-                used_labels.add(parts[-1])
-        for instruction in instructions:
-            if not instruction.endswith(":") or instruction.split(":")[0] in used_labels:
-                optimized_instructions.append(instruction)
-        return optimized_instructions
+    def _is_nonzero_immediate(self, operand):
+        return self._is_immediate(operand) and parse_literal(operand) != 0
 
-    def remove_redundant_jumps(self, instructions):
-        optimized_instructions = []
-        for i in range(len(instructions)):
-            if instructions[i].startswith("JMP"):
-                target = instructions[i].split()[-1]
-                if i + 1 < len(instructions) and instructions[i + 1].endswith(f"{target}:"):
+    def _highest_registers(self, cfg):
+        """Highest number in use of each kind of register, by prefix."""
+        highest = {'r': 0, 'fr': 0}
+        for block in cfg.blocks:
+            for instruction in block.instructions:
+                for operand in instruction.operands:
+                    if is_register(operand) and operand != 'rv':
+                        prefix = operand.rstrip('0123456789')
+                        highest[prefix] = max(highest[prefix], int(operand[len(prefix):]))
+        return highest
+
+    def _new_register(self, like):
+        """A register of the same kind as like that is not used yet."""
+        prefix = 'fr' if like.startswith('fr') else 'r'
+        self.highest_registers[prefix] += 1
+        return f"{prefix}{self.highest_registers[prefix]}"
+
+    def _append_before_jump(self, block, instructions):
+        last = block.last_instruction()
+        if last is not None and last.opcode == 'JMP':
+            position = block.instructions.index(last)
+            block.instructions[position:position] = instructions
+        else:
+            block.instructions.extend(instructions)
+
+    def _induction_variables(self, loop, calls):
+        """Address -> list of (block, position of the STORE, step) for each update.
+
+        Every write to the address in the loop must be LOAD [a], r; ADD or
+        SUB of an integer; STORE r, a.
+        """
+        updates = {}
+        disqualified = set()
+        for block in loop.blocks:
+            body = [(position, instruction) for position, instruction in enumerate(block.instructions)
+                    if not instruction.is_comment]
+            for number, (position, instruction) in enumerate(body):
+                address = instruction.memory_written()
+                if address is None:
                     continue
-            optimized_instructions.append(instructions[i])
-        return optimized_instructions
+                step = None
+                if instruction.opcode == 'STORE' and number >= 2:
+                    load, update = body[number - 2][1], body[number - 1][1]
+                    register = instruction.operands[0]
+                    if (load.opcode == 'LOAD' and load.operands == [f"[{address}]", register]
+                            and update.opcode in ('ADD', 'SUB')
+                            and update.operands[1:] == [register, register]
+                            and isinstance(self._integer(update.operands[0]), int)):
+                        step = self._integer(update.operands[0])
+                        if update.opcode == 'SUB':
+                            step = -step
+                if step is None:
+                    disqualified.add(address)
+                else:
+                    updates.setdefault(address, []).append((block, position, step))
+        return {address: sites for address, sites in updates.items()
+                if address not in disqualified
+                and self._is_loop_invariant_address(address, (), calls)}
+
+    def _integer(self, operand):
+        if not self._is_immediate(operand):
+            return None
+        value = parse_literal(operand)
+        return value if isinstance(value, int) else None
+
+    def _reduce_induction_variables(self, cfg, loop, dominator_tree):
+        _, _, calls = self._loop_writes(loop)
+        induction_variables = self._induction_variables(loop, calls)
+        if not induction_variables:
+            return
+        reduced = {}  # (address, factor) -> register holding address * factor
+        replacements = []
+        for block in loop.blocks:
+            body = [(position, instruction) for position, instruction in enumerate(block.instructions)
+                    if not instruction.is_comment]
+            for (_, load), (position, multiply) in zip(body, body[1:]):
+                if load.opcode != 'LOAD' or not is_memory(load.operands[0]):
+                    continue
+                address = load.operands[0].strip('[]')
+                factor = self._integer(multiply.operands[0]) if multiply.opcode == 'MUL' else None
+                if (address not in induction_variables or factor in (None, 0, 1)
+                        or multiply.operands[1] != load.operands[1]):
+                    continue
+                key = (address, factor)
+                if key not in reduced:
+                    reduced[key] = self._new_register('r')
+                replacements.append((block, position, Instruction.build(
+                    "MOV", reduced[key], multiply.register_written())))
+        if not reduced:
+            return
+        preheader = cfg.preheader(loop, dominator_tree)
+        if preheader is None:
+            return
+        for block, position, instruction in replacements:
+            block.instructions[position] = instruction
+        initial = []
+        steps = {}
+        for (address, factor), register in reduced.items():
+            initial.append(Instruction.build("LOAD", f"[{address}]", register))
+            initial.append(Instruction.build("MUL", factor, register, register))
+            for block, position, step in induction_variables[address]:
+                opcode, amount = ("ADD", step * factor) if step * factor >= 0 else ("SUB", -step * factor)
+                steps.setdefault(block, []).append(
+                    (position, Instruction.build(opcode, amount, register, register)))
+        self._append_before_jump(preheader, initial)
+        for block, updates in steps.items():
+            # Insert after each STORE, from the back so positions stay valid
+            for position, instruction in sorted(updates, key=lambda update: update[0], reverse=True):
+                block.instructions.insert(position + 1, instruction)
+
+    def common_subexpression_elimination(self, cfg):
+        # Hash-based value numbering. Each block starts from the table its
+        # immediate dominator ended with, minus whatever may be written on
+        # the paths between the two, so redundancy is found across blocks.
+        # One scoped table serves the whole walk of the dominator tree.
+        dominator_tree = DominatorTree(cfg)
+        table = ValueTable()
+        marks = {}
+        stack = [(block, False) for block in reversed(dominator_tree.children.get(None, []))]
+        while stack:
+            block, finished = stack.pop()
+            if finished:
+                table.undo(marks.pop(block))
+                continue
+            marks[block] = table.mark()
+            dominator = dominator_tree.idom[block]
+            if dominator is not None and block.predecessors != [dominator]:
+                self._kill_between(dominator, block, table)
+            block.instructions = self._number_block(block, table)
+            stack.append((block, True))
+            stack.extend((child, False)
+                         for child in reversed(dominator_tree.children.get(block, [])))
+        for block in cfg.blocks:
+            if block not in dominator_tree:
+                block.instructions = self._number_block(block, ValueTable())
 
-    def dead_code_elimination(self, instructions):
+    def _kill_between(self, dominator, block, table):
+        """Forget locations written on any path from dominator to block."""
+        seen = set()
+        stack = list(block.predecessors)
+        while stack:
+            current = stack.pop()
+            if current is dominator or current.index in seen:
+                continue
+            seen.add(current.index)
+            stack.extend(current.predecessors)
+            for instruction in current.instructions:
+                if instruction.opcode == 'CALL':
+                    table.kill_globals()
+                for location in (instruction.register_written(), instruction.memory_written()):
+                    if location is not None:
+                        table.kill(location)
+
+    def _number_block(self, block, table):
         optimized_instructions = []
-        used_vars = set()
-        for instruction in instructions:
-            parts = instruction.split()
-            if parts[0] == "LOAD" or parts[0] == "FLOAD":
-                used_vars.add(parts[1].rstrip(","))
-            elif parts[0] == "STORE" or parts[0] == "FSTORE":
-                used_vars.add(parts[2].rstrip(","))
-        for instruction in instructions:
-            parts = instruction.split()
-            if parts[0] == "LOAD" or parts[0] == "FLOAD":
-                if parts[1].rstrip(",") in used_vars:
-                    optimized_instructions.append(instruction)
-            elif parts[0] == "STORE" or parts[0] == "FSTORE":
-                if parts[2].rstrip(",") in used_vars:
-                    optimized_instructions.append(instruction)
-            else:
-                optimized_instructions.append(instruction)
+        for instruction in block.instructions:
+            opcode = instruction.opcode
+            if opcode in LOAD_OPCODES or opcode in ALU_OPCODES:
+                source = instruction.operands[0]
+                destination = instruction.register_written()
+                if opcode in ALU_OPCODES:
+                    operands = [table.number_of_location(instruction.operands[1]),
+                                table.number_of_operand(source)]
+                    if opcode in COMMUTATIVE_OPCODES:
+                        operands.sort()
+                    number = table.number_of_expression((opcode, *operands))
+                elif opcode == 'LDC':
+                    number = table.number_of_expression(('LDC', source))
+                else:
+                    number = table.number_of_operand(source)
+                if table.location_numbers.get(destination) == number:
+                    continue  # The register already holds this value
+                holder = table.register_holding(number)
+                if holder is not None and (opcode in ALU_OPCODES or is_memory(source)):
+                    # Copy the earlier result instead of recomputing or reloading it
+                    instruction = Instruction.build("MOV", holder, destination)
+                table.assign(destination, number)
+            elif opcode in STORE_OPCODES or opcode == 'STR':
+                if opcode == 'STR':
+                    number = table.number_of_expression(('STR', instruction.operands[0]))
+                else:
+                    number = table.number_of_location(instruction.operands[0])
+                address = instruction.memory_written()
+                if table.location_numbers.get(address) == number:
+                    continue  # The cell already holds this value
+                table.assign(address, number)
+            elif opcode == 'CALL':
+                table.kill_globals()
+            optimized_instructions.append(instruction)
         return optimized_instructions
+
+    def peephole_optimization(self, cfg):
+        for block in cfg.blocks:
+            block.instructions = self.peephole.run(block.instructions)
+
+    def remove_unused_labels(self, cfg):
+        used_labels = set(cfg.entry_points)
+        for block in cfg.blocks:
+            for instruction in block.instructions:
+                target = instruction.branch_target() or instruction.call_target()
+                if target is not None:
+                    used_labels.add(target)
+        for block in cfg.blocks:
+            if block.label is not None and block.label not in used_labels:
+                block.label = None
+        cfg.rebuild_edges()
+
+    def remove_redundant_jumps(self, cfg):
+        for position, block in enumerate(cfg.blocks[:-1]):
+            last = block.last_instruction()
+            following = cfg.blocks[position + 1]
+            if last is not None and last.opcode == "JMP" and following.label == last.operands[0]:
+                block.instructions.remove(last)
+        cfg.rebuild_edges()
+
+    def dead_code_elimination(self, cfg):
+        # Remove unreachable blocks, then register writes and stores whose
+        # value is never read, until nothing more can be removed
+        changed = True
+        while changed:
+            reachable = cfg.reachable()
+            changed = len(reachable) != len(cfg.blocks)
+            if changed:
+                cfg.blocks = [block for block in cfg.blocks if block.index in reachable]
+                cfg.renumber()
+                cfg.rebuild_edges()
+            liveness = LiveLocations(cfg)
+            _, live_out = solve(cfg, liveness)
+            for block in cfg.blocks:
+                live = live_out[block.index]
+                optimized_instructions = []
+                for instruction in reversed(block.instructions):
+                    if self._is_dead(instruction, live, liveness, block):
+                        changed = True
+                        continue
+                    live = liveness.step(instruction, live)
+                    optimized_instructions.append(instruction)
+                optimized_instructions.reverse()
+                block.instructions = optimized_instructions
+
+    def _is_dead(self, instruction, live, liveness, block):
+        if instruction.opcode in STORE_OPCODES or instruction.opcode == 'STR':
+            location = instruction.memory_written()
+            if block.index in liveness.trapped and location.isdigit():
+                return False  # The run may be stopped right after it
+            return not live & liveness.universe.bit(location)
+        written = instruction.register_written()
+        return (written is not None and not instruction.has_side_effects
+                and not live & liveness.universe.bit(written))
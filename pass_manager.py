@@ -0,0 +1,149 @@
+import time
+from contextlib import nullcontext
+
+# Passes of each optimization level, in the order they run, and how many
+# times the whole pipeline may repeat while it still changes the program
+OPTIMIZATION_LEVELS = {
+    0: ([], 1),
+    1: (['constant_folding', 'remove_unused_labels', 'remove_redundant_jumps',
+         'dead_code_elimination'], 1),
+    2: (['constant_folding', 'loop_invariant_code_motion', 'strength_reduction',
+         'common_subexpression_elimination', 'peephole_optimization',
+         'remove_unused_labels', 'remove_redundant_jumps', 'dead_code_elimination'], 4),
+    3: (['constant_folding', 'loop_invariant_code_motion', 'strength_reduction',
+         'common_subexpression_elimination', 'peephole_optimization',
+         'remove_unused_labels', 'remove_redundant_jumps', 'dead_code_elimination'], 16),
+}
+
+
+def parse_level(text):
+    """Turn '-O2', 'O2' or '2' into an optimization level."""
+    level = int(text.lstrip('-').lstrip('O') or 0)
+    if level not in OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown optimization level '{text}'")
+    return level
+
+
+class PassManager:
+    """Runs an optimizer's passes for one -O level and records what each costs.
+
+    The pipeline repeats until a full round leaves the program unchanged or
+    the level's iteration budget is spent. For every pass it records wall
+    time, instruction counts around each run, and how often it changed the
+    program ("fired"). A tracer, if given, also gets a span per pass run.
+    """
+
+    def __init__(self, optimizer, level=2, max_iterations=None, tracer=None):
+        self.optimizer = optimizer
+        self.tracer = tracer
+        self.level = level
+        self.passes, self.max_iterations = OPTIMIZATION_LEVELS[level]
+        if max_iterations is not None:
+            self.max_iterations = max_iterations
+        self.statistics = {}
+        self.iterations = 0
+        self.reached_fixed_point = False
+        self.instructions_before = 0
+        self.instructions_after = 0
+        self.total_time = 0.0
+
+    def run(self, cfg):
+        start = time.perf_counter()
+        self.instructions_before = count_instructions_in(cfg.to_lines())
+        self.reached_fixed_point = not self.passes
+        while self.iterations < self.max_iterations and self.passes:
+            self.iterations += 1
+            round_start = cfg.to_lines()
+            for name in self.passes:
+                self.run_pass(name, cfg)
+            if cfg.to_lines() == round_start:
+                self.reached_fixed_point = True
+                break
+        self.instructions_after = count_instructions_in(cfg.to_lines())
+        self.total_time = time.perf_counter() - start
+        return cfg
+
+    def run_pass(self, name, cfg):
+        entry = self.statistics.setdefault(name, {
+            'runs': 0, 'fired': 0, 'seconds': 0.0, 'instructions_removed': 0, 'history': []})
+        before = cfg.to_lines()
+        instructions_before = count_instructions_in(before)
+        tracing = self.tracer.phase(name, instructions_before, 'optimize') if self.tracer else nullcontext()
+        with tracing as span:
+            start = time.perf_counter()
+            getattr(self.optimizer, name)(cfg)
+            elapsed = time.perf_counter() - start
+        after = cfg.to_lines()
+        entry['runs'] += 1
+        entry['seconds'] += elapsed
+        if after != before:
+            entry['fired'] += 1
+        instructions_after = count_instructions_in(after)
+        if span is not None:
+            span.output_size = instructions_after
+        entry['instructions_removed'] += instructions_before - instructions_after
+        entry['history'].append({
+            'iteration': self.iterations,
+            'seconds': elapsed,
+            'instructions_before': instructions_before,
+            'instructions_after': instructions_after,
+        })
+
+    def report(self):
+        return {
+            'level': self.level,
+            'iterations': self.iterations,
+            'max_iterations': self.max_iterations,
+            'reached_fixed_point': self.reached_fixed_point,
+            'seconds': self.total_time,
+            'instructions_before': self.instructions_before,
+            'instructions_after': self.instructions_after,
+            'passes': self.statistics,
+        }
+
+    def to_json(self, indent=2):
+        import json
+
+        return json.dumps(self.report(), indent=indent)
+
+    def format_report(self):
+        """A fixed-width summary of the per-pass statistics."""
+        lines = [f"-O{self.level}: {self.instructions_before} -> {self.instructions_after} instructions, "
+                 f"{self.iterations} iteration(s), {self.total_time * 1000:.2f} ms",
+                 f"{'Pass':<36} {'Runs':>5} {'Fired':>6} {'Removed':>8} {'ms':>9}",
+                 '-' * 68]
+        for name, entry in self.statistics.items():
+            lines.append(f"{name:<36} {entry['runs']:>5} {entry['fired']:>6} "
+                         f"{entry['instructions_removed']:>8} {entry['seconds'] * 1000:>9.3f}")
+        return "\n".join(lines)
+
+
+def count_instructions_in(lines):
+    """Instructions among generated lines, leaving out labels, comments and the pool."""
+    return sum(1 for line in lines
+               if line and not line.endswith(':') and not line.startswith((';', 'CONST')))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from optimizer import Optimizer
+
+    argument_parser = argparse.ArgumentParser(
+        description="Optimize generated Enigma assembly and report what each pass did.")
+    argument_parser.add_argument('assembly_file')
+    argument_parser.add_argument('-O', dest='level', default='2',
+                                 help="optimization level 0-3 (default 2)")
+    argument_parser.add_argument('--max-iterations', type=int, default=None)
+    argument_parser.add_argument('--report', help="write the JSON report to this file")
+    arguments = argument_parser.parse_args()
+
+    with open(arguments.assembly_file) as file:
+        assembly_code = file.read()
+    optimizer = Optimizer(parse_level(arguments.level), arguments.max_iterations)
+    print(optimizer.optimize(assembly_code))
+    print()
+    print(optimizer.pass_manager.format_report())
+    if arguments.report:
+        with open(arguments.report, 'w') as file:
+            file.write(optimizer.pass_manager.to_json())
@@ -0,0 +1,173 @@
+import re
+
+from assembly import Instruction, is_register
+
+# Operand variables: "$name" matches one whole operand, "[$name]" a memory
+# operand whose address is bound to name. A variable seen twice in a rule
+# must match the same text both times.
+VARIABLE_REGEX = re.compile(r'\$(\w+)')
+
+
+def compile_operand(pattern):
+    """Turn an operand pattern into a regex with one named group per variable."""
+    parts = []
+    position = 0
+    for match in VARIABLE_REGEX.finditer(pattern):
+        parts.append(re.escape(pattern[position:match.start()]))
+        parts.append(f"(?P<{match.group(1)}>.+)")
+        position = match.end()
+    parts.append(re.escape(pattern[position:]))
+    return re.compile(''.join(parts) + r'\Z')
+
+
+class PeepholeRule:
+    """Rewrite a window of consecutive instructions matching a pattern.
+
+    pattern and replacement are lists of instruction templates such as
+    "STORE $r, $a". condition, if given, is called with the variable
+    bindings and may veto the match.
+    """
+
+    def __init__(self, name, pattern, replacement, condition=None):
+        self.name = name
+        self.pattern = [self._compile(template) for template in pattern]
+        self.replacement = replacement
+        self.condition = condition
+
+    @staticmethod
+    def _compile(template):
+        instruction = Instruction(template)
+        return instruction.opcode, [compile_operand(operand) for operand in instruction.operands]
+
+    @property
+    def leading_opcode(self):
+        return self.pattern[0][0]
+
+    def __len__(self):
+        return len(self.pattern)
+
+    def match(self, window):
+        """Variable bindings if window matches this rule, otherwise None."""
+        bindings = {}
+        for (opcode, operand_patterns), instruction in zip(self.pattern, window):
+            if instruction.opcode != opcode or len(instruction.operands) != len(operand_patterns):
+                return None
+            for operand_pattern, operand in zip(operand_patterns, instruction.operands):
+                match = operand_pattern.match(operand)
+                if match is None:
+                    return None
+                for name, value in match.groupdict().items():
+                    if bindings.setdefault(name, value) != value:
+                        return None
+        if self.condition is not None and not self.condition(bindings):
+            return None
+        return bindings
+
+    def rewrite(self, bindings):
+        return [Instruction(VARIABLE_REGEX.sub(lambda match: bindings[match.group(1)], template))
+                for template in self.replacement]
+
+
+def registers(*names):
+    """Condition that every named variable is bound to a register."""
+    return lambda bindings: all(is_register(bindings[name]) for name in names)
+
+
+def different(first, second):
+    return lambda bindings: bindings[first] != bindings[second]
+
+
+# Rules are only ever applied inside a basic block, so no label or incoming
+# edge can separate the instructions of a window
+PEEPHOLE_RULES = [
+    # A value just stored is still in its register
+    PeepholeRule('store-load', ['STORE $r, $a', 'LOAD [$a], $r'], ['STORE $r, $a']),
+    PeepholeRule('fstore-fload', ['FSTORE $r, $a', 'FLOAD [$a], $r'], ['FSTORE $r, $a']),
+    PeepholeRule('store-load-other', ['STORE $r, $a', 'LOAD [$a], $s'],
+                 ['STORE $r, $a', 'MOV $r, $s'], different('r', 's')),
+    PeepholeRule('fstore-fload-other', ['FSTORE $r, $a', 'FLOAD [$a], $s'],
+                 ['FSTORE $r, $a', 'MOV $r, $s'], different('r', 's')),
+    # Loading a value back into the register it came from
+    PeepholeRule('load-store', ['LOAD [$a], $r', 'STORE $r, $a'], ['LOAD [$a], $r']),
+    PeepholeRule('fload-fstore', ['FLOAD [$a], $r', 'FSTORE $r, $a'], ['FLOAD [$a], $r']),
+    # Copies
+    PeepholeRule('self-move', ['MOV $r, $r'], []),
+    PeepholeRule('move-back', ['MOV $r, $s', 'MOV $s, $r'], ['MOV $r, $s'], registers('r', 's')),
+    # Algebraic identities
+    PeepholeRule('add-zero', ['ADD 0, $r, $r'], []),
+    PeepholeRule('subtract-zero', ['SUB 0, $r, $r'], []),
+    PeepholeRule('multiply-one', ['MUL 1, $r, $r'], []),
+    PeepholeRule('divide-one', ['DIV 1, $r, $r'], []),
+    # A store overwritten before anything could read it
+    PeepholeRule('store-store', ['STORE $r, $a', 'STORE $s, $a'], ['STORE $s, $a']),
+    PeepholeRule('fstore-fstore', ['FSTORE $r, $a', 'FSTORE $s, $a'], ['FSTORE $s, $a']),
+    # A register overwritten before anything could read it
+    PeepholeRule('load-load', ['LOAD $x, $r', 'LOAD $y, $r'], ['LOAD $y, $r'], registers('r')),
+]
+
+
+class PeepholeEngine:
+    """Applies peephole rules over sliding windows until none matches.
+
+    Rules are indexed by their leading opcode, so each position only tries
+    the rules that could start there. Comments are skipped when forming a
+    window and are kept ahead of whatever a rewrite produces.
+    """
+
+    def __init__(self, rules=PEEPHOLE_RULES):
+        self.rules_by_opcode = {}
+        for rule in rules:
+            self.rules_by_opcode.setdefault(rule.leading_opcode, []).append(rule)
+        self.longest_window = max((len(rule) for rule in rules), default=1)
+        self.fired = {}
+
+    def run(self, instructions):
+        """Rewrite instructions to a fixed point and return the new list."""
+        instructions = list(instructions)
+        position = 0
+        while position < len(instructions):
+            rewritten = self._rewrite_at(instructions, position)
+            if rewritten is None:
+                position += 1
+                continue
+            instructions = rewritten
+            # A rewrite may complete a window that starts a little earlier
+            position = self._back_up(instructions, position)
+        return instructions
+
+    def _rewrite_at(self, instructions, position):
+        first = instructions[position]
+        if first.is_comment:
+            return None
+        for rule in self.rules_by_opcode.get(first.opcode, ()):
+            indices = self._window(instructions, position, len(rule))
+            if indices is None:
+                continue
+            bindings = rule.match([instructions[index] for index in indices])
+            if bindings is None:
+                continue
+            self.fired[rule.name] = self.fired.get(rule.name, 0) + 1
+            comments = [instructions[index] for index in range(position, indices[-1] + 1)
+                        if instructions[index].is_comment]
+            return (instructions[:position] + comments + rule.rewrite(bindings)
+                    + instructions[indices[-1] + 1:])
+        return None
+
+    @staticmethod
+    def _window(instructions, position, size):
+        """Indices of the next size non-comment instructions from position."""
+        indices = []
+        for index in range(position, len(instructions)):
+            if not instructions[index].is_comment:
+                indices.append(index)
+                if len(indices) == size:
+                    return indices
+        return None
+
+    def _back_up(self, instructions, position):
+        remaining = self.longest_window - 1
+        while position > 0 and remaining:
+            position -= 1
+            if not instructions[position].is_comment:
+                remaining -= 1
+        return position
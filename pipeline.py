@@ -0,0 +1,358 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from Parser import Parser
+from code_generator import CodeGenerator
+from optimizer import Optimizer
+from pass_manager import count_instructions_in, parse_level
+from semantic_analyzer import SemanticAnalyzer
+from tokenizer import tokenize
+from utils import create_enhanced_symbol_table
+from vm import VirtualMachine
+
+
+class LexicalError(ValueError):
+    pass
+
+
+class Span:
+    """One traced phase: when it ran and what went in and came out.
+
+    Sizes are in the phase's own unit (characters, tokens, symbols or
+    instructions; see Pipeline). allocated_blocks is the change in live
+    interpreter blocks. With tracemalloc on, allocated_bytes is the change
+    in traced bytes, the size the phase retained, peak_bytes the most
+    traced at any point during it, and allocation_sites the source lines
+    that grew most over the phase as (file:line, bytes, blocks).
+    """
+
+    def __init__(self, name, category, depth, input_size=None):
+        self.name = name
+        self.category = category
+        self.depth = depth
+        self.input_size = input_size
+        self.output_size = None
+        self.start_ns = self.end_ns = None
+        self.allocated_blocks = None
+        self.allocated_bytes = None
+        self.peak_bytes = None
+        self.start_bytes = None
+        self.allocation_sites = None
+        self.error = None
+        self.thread = threading.get_ident()
+
+    @property
+    def seconds(self):
+        return (self.end_ns - self.start_ns) / 1e9
+
+
+class Tracer:
+    """Records a Span for every phase run inside phase().
+
+    Pass memory=True to also measure retained and peak bytes; that starts
+    tracemalloc, which slows the traced code down considerably. With
+    allocation_sites=n as well, the n lines that allocated most are kept
+    for every outermost phase, at the cost of two heap snapshots each.
+    """
+
+    def __init__(self, memory=False, allocation_sites=0):
+        self.spans = []
+        self.open = []  # Spans entered and not yet left, outermost first
+        self.origin_ns = time.perf_counter_ns()
+        self.memory = memory
+        self.allocation_sites = allocation_sites if memory else 0
+        self.tracemalloc = None  # Imported on demand, it is slow to import
+        self.started_tracemalloc = False
+        if memory:
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+            self.started_tracemalloc = not tracemalloc.is_tracing()
+            if self.started_tracemalloc:
+                tracemalloc.start()
+
+    def stop(self):
+        """Stop tracemalloc if this tracer started it, freeing its records."""
+        if self.started_tracemalloc:
+            self.tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    @contextmanager
+    def phase(self, name, input_size=None, category='compile'):
+        span = Span(name, category, len(self.open), input_size)
+        tracemalloc = self.tracemalloc
+        tracing = tracemalloc is not None and tracemalloc.is_tracing()
+        snapshot = None
+        if tracing:
+            if self.allocation_sites and not self.open:
+                snapshot = tracemalloc.take_snapshot()
+            # tracemalloc keeps a single peak: hand the peak so far to the
+            # enclosing phase before restarting it for this one
+            if self.open:
+                self.open[-1].peak_bytes = max(self.open[-1].peak_bytes or 0,
+                                               tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            span.start_bytes = tracemalloc.get_traced_memory()[0]
+        self.spans.append(span)
+        self.open.append(span)
+        blocks = sys.getallocatedblocks()
+        span.start_ns = time.perf_counter_ns()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.end_ns = time.perf_counter_ns()
+            span.allocated_blocks = sys.getallocatedblocks() - blocks
+            if tracing and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                span.allocated_bytes = current - span.start_bytes
+                span.peak_bytes = max(span.peak_bytes or 0, peak)
+                if snapshot is not None:
+                    # Leave out what the snapshots themselves allocated
+                    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+                    statistics = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(
+                        snapshot.filter_traces(ignore), 'lineno')
+                    span.allocation_sites = [
+                        (f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+                         statistic.size_diff, statistic.count_diff)
+                        for statistic in statistics[:self.allocation_sites]]
+            self.open.pop()
+
+    def chrome_trace(self):
+        """The spans as Chrome trace-event JSON, for chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                   'args': {'name': 'Enigma compiler'}}]
+        for span in self.spans:
+            arguments = {'input_size': span.input_size, 'output_size': span.output_size,
+                         'allocated_blocks': span.allocated_blocks}
+            if span.allocated_bytes is not None:
+                arguments['allocated_bytes'] = span.allocated_bytes
+                arguments['peak_bytes'] = span.peak_bytes
+            if span.error is not None:
+                arguments['error'] = span.error
+            events.append({'name': span.name, 'cat': span.category, 'ph': 'X',
+                           'ts': (span.start_ns - self.origin_ns) / 1000,
+                           'dur': (span.end_ns - span.start_ns) / 1000,
+                           'pid': pid, 'tid': span.thread, 'args': arguments})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        import json
+
+        with open(path, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+    def summary(self):
+        """Totals by phase name, in the order phases first ran."""
+        totals = {}
+        for span in self.spans:
+            entry = totals.setdefault(span.name, {
+                'depth': span.depth, 'calls': 0, 'seconds': 0.0, 'input_size': None,
+                'output_size': None, 'allocated_blocks': 0, 'allocated_bytes': None,
+                'peak_bytes': None})
+            entry['calls'] += 1
+            entry['seconds'] += span.seconds
+            entry['allocated_blocks'] += span.allocated_blocks
+            if span.allocated_bytes is not None:
+                entry['allocated_bytes'] = (entry['allocated_bytes'] or 0) + span.allocated_bytes
+                entry['peak_bytes'] = max(entry['peak_bytes'] or 0, span.peak_bytes)
+            # Sizes of the first run going in, of the last one coming out
+            if entry['input_size'] is None:
+                entry['input_size'] = span.input_size
+            if span.output_size is not None:
+                entry['output_size'] = span.output_size
+        return totals
+
+    def format_summary(self):
+        """A fixed-width table of the summary; nested phases are indented."""
+        totals = self.summary()
+        total = sum(span.seconds for span in self.spans if span.depth == 0)
+        lines = [f"{'Phase':<40} {'Calls':>5} {'ms':>9} {'%':>6} {'In':>8} {'Out':>8} "
+                 f"{'Blocks':>8} {'KiB':>9}",
+                 '-' * 98]
+        for name, entry in totals.items():
+            share = 100 * entry['seconds'] / total if total else 0.0
+            kib = '' if entry['allocated_bytes'] is None else f"{entry['allocated_bytes'] / 1024:.1f}"
+            lines.append(f"{'  ' * entry['depth'] + name:<40} {entry['calls']:>5} "
+                         f"{entry['seconds'] * 1000:>9.3f} {share:>6.1f} "
+                         f"{_size(entry['input_size']):>8} {_size(entry['output_size']):>8} "
+                         f"{entry['allocated_blocks']:>8} {kib:>9}")
+        lines.append(f"{'total':<40} {'':>5} {total * 1000:>9.3f}")
+        return "\n".join(lines)
+
+    def peak_bytes(self):
+        """The most memory traced during any phase, or None without tracemalloc."""
+        peaks = [span.peak_bytes for span in self.spans if span.peak_bytes is not None]
+        return max(peaks) if peaks else None
+
+    def format_memory(self):
+        """Peak and retained memory of every phase, then the allocation
+        sites of each outermost phase; needs a memory=True tracer."""
+        lines = [f"Peak traced memory {_kib(self.peak_bytes())} KiB",
+                 f"{'Phase':<40} {'Peak KiB':>10} {'Growth KiB':>11} {'Retained KiB':>13}",
+                 '-' * 77]
+        for span in self.spans:
+            if span.peak_bytes is None:
+                continue
+            lines.append(f"{'  ' * span.depth + span.name:<40} {_kib(span.peak_bytes):>10} "
+                         f"{_kib(span.peak_bytes - span.start_bytes):>11} "
+                         f"{_kib(span.allocated_bytes):>13}")
+        for span in self.spans:
+            if span.allocation_sites:
+                lines += ['', f"Allocation sites of {span.name}",
+                          f"{'KiB':>10} {'Blocks':>9}  Line"]
+                lines += [f"{_kib(size):>10} {count:>9}  {site}"
+                          for site, size, count in span.allocation_sites]
+        return "\n".join(lines)
+
+
+def _size(size):
+    return '' if size is None else str(size)
+
+
+def _kib(size):
+    return '' if size is None else f"{size / 1024:.1f}"
+
+
+class Pipeline:
+    """The compiler's phases, each traced by tracer as it runs.
+
+    Call the phases one by one, as the GUI does to report on each, or use
+    compile() and run(). Phase sizes are measured in: tokenize, characters
+    in and tokens out; parse, tokens; semantic, tokens in and symbols out;
+    symbol table, tokens in and entries out; codegen, tokens in and
+    instructions out; optimize and each of its passes, instructions;
+    execute, program instructions in and executed instructions out (only
+    counted when the run is limited).
+
+    parse, analyze and generate take the interfaces of the modules an
+    import may name; linker.compile_module uses them to compile one module
+    of a larger program.
+    """
+
+    def __init__(self, level=2, tracer=None, verbose=False):
+        self.level = level
+        self.tracer = tracer or Tracer()
+        self.verbose = verbose
+        self.optimizer = None  # The most recent optimize(), for its pass report
+        self.code_generator = None  # The most recent generate(), for its symbol table
+
+    def tokenize(self, source_code):
+        """(tokens, errors) of source_code."""
+        with self.tracer.phase('tokenize', len(source_code)) as span:
+            tokens, errors = tokenize(source_code)
+            span.output_size = len(tokens)
+        return tokens, errors
+
+    def parse(self, tokens, source_code, imports=None):
+        """Check the syntax; raises Parser.SyntaxError."""
+        with self.tracer.phase('parse', len(tokens)) as span:
+            Parser(tokens, source_code, verbose=self.verbose, imports=imports).parse()
+            span.output_size = len(tokens)
+
+    def analyze(self, tokens, imports=None):
+        """The SemanticAnalyzer after checking tokens; raises ValueError."""
+        with self.tracer.phase('semantic', len(tokens)) as span:
+            semantic_analyzer = SemanticAnalyzer(imports)
+            semantic_analyzer.analyze_code(tokens)
+            span.output_size = len(semantic_analyzer.symbol_table)
+        return semantic_analyzer
+
+    def build_symbol_table(self, tokens):
+        with self.tracer.phase('symbol table', len(tokens)) as span:
+            symbol_table = create_enhanced_symbol_table(tokens)
+            span.output_size = len(symbol_table)
+        return symbol_table
+
+    def generate(self, tokens, symbol_table, imports=None):
+        with self.tracer.phase('codegen', len(tokens)) as span:
+            self.code_generator = CodeGenerator(imports)
+            self.code_generator.set_symbol_table(symbol_table)
+            assembly_code = self.code_generator.generate_code(tokens)
+            span.output_size = count_instructions_in(assembly_code.splitlines())
+        return assembly_code
+
+    def optimize(self, assembly_code, entry_points=()):
+        """The optimized assembly; every pass run is traced inside this phase.
+
+        Functions named in entry_points are kept even if nothing calls them.
+        """
+        with self.tracer.phase('optimize', count_instructions_in(assembly_code.splitlines())) as span:
+            self.optimizer = Optimizer(self.level, tracer=self.tracer, entry_points=entry_points)
+            optimized_code = self.optimizer.optimize(assembly_code)
+            span.output_size = count_instructions_in(optimized_code.splitlines())
+        return optimized_code
+
+    def execute(self, assembly_code, **limits):
+        """The VirtualMachine after running assembly_code under limits."""
+        with self.tracer.phase('execute', category='execute') as span:
+            vm = VirtualMachine(assembly_code, **limits)
+            span.input_size = len(vm.program)
+            vm.run()
+            span.output_size = vm.executed if vm.limited else None
+        return vm
+
+    def compile(self, source_code):
+        """(generated assembly, optimized assembly) for source_code.
+
+        Lexical errors raise LexicalError, syntax errors Parser.SyntaxError
+        and semantic errors ValueError.
+        """
+        tokens, errors = self.tokenize(source_code)
+        if errors:
+            raise LexicalError("; ".join(str(error) for error in errors))
+        self.parse(tokens, source_code)
+        self.analyze(tokens)
+        assembly_code = self.generate(tokens, self.build_symbol_table(tokens))
+        return assembly_code, self.optimize(assembly_code)
+
+    def run(self, source_code, **limits):
+        """Compile source_code and execute the optimized assembly."""
+        _, optimized_code = self.compile(source_code)
+        return self.execute(optimized_code, **limits)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    argument_parser = argparse.ArgumentParser(
+        description="Compile (and run) an Enigma program, timing every phase.")
+    argument_parser.add_argument('source_file')
+    argument_parser.add_argument('-O', dest='level', default='2',
+                                 help="optimization level 0-3 (default 2)")
+    argument_parser.add_argument('--run', action='store_true', help="also execute the program")
+    argument_parser.add_argument('--timeout', type=float, default=5.0,
+                                 help="seconds before stopping the run (default 5)")
+    argument_parser.add_argument('--memory', action='store_true',
+                                 help="also measure peak and retained memory (slower, uses tracemalloc)")
+    argument_parser.add_argument('--sites', type=int, default=10,
+                                 help="with --memory, allocation sites shown per phase (default 10)")
+    argument_parser.add_argument('--trace', help="write Chrome trace-event JSON to this file")
+    arguments = argument_parser.parse_args()
+
+    with open(arguments.source_file) as file:
+        source_code = file.read()
+    pipeline = Pipeline(parse_level(arguments.level),
+                        Tracer(arguments.memory, arguments.sites))
+    try:
+        if arguments.run:
+            vm = pipeline.run(source_code, timeout=arguments.timeout)
+            print(vm.memory_dump())
+            if not vm.result().completed:
+                print(vm.result().describe())
+        else:
+            print(pipeline.compile(source_code)[1])
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}")
+    print()
+    print(pipeline.tracer.format_summary())
+    if arguments.memory:
+        print()
+        print(pipeline.tracer.format_memory())
+    if arguments.trace:
+        pipeline.tracer.write_chrome_trace(arguments.trace)
@@ -0,0 +1,156 @@
+import argparse
+import time
+
+from vm import CANCELLED, COMPLETED, FAULT, RUNTIME_ERRORS, VirtualMachine
+
+
+class Profiler:
+    """Runs a VirtualMachine under instrumentation.
+
+    Every executed instruction is counted and timed, and attributed to the
+    chain of functions active when it ran. VirtualMachine.run itself is
+    left untouched, so unprofiled runs pay nothing for this. The run ends
+    with the same status it would have there, a fault included.
+    """
+
+    def __init__(self, vm):
+        if not isinstance(vm, VirtualMachine):
+            vm = VirtualMachine(vm)
+        self.vm = vm
+        program = vm.program
+        self.counts = [0] * len(program)
+        self.nanoseconds = [0] * len(program)
+        self.stack_counts = {}  # (function chain, instruction index) -> executions
+        self.label_names = {offset: label for label, offset in program.labels.items()}
+        self.blocks = program.block_leaders()
+
+    def run(self):
+        vm = self.vm
+        instructions = vm.program.instructions
+        counts = self.counts
+        nanoseconds = self.nanoseconds
+        stack_counts = self.stack_counts
+        clock = time.perf_counter_ns
+        call = VirtualMachine._call
+        ret = VirtualMachine._return
+        chain = ('main',)
+        end = len(instructions)
+        vm.status = vm.fault = None
+        vm.running = not vm.cancelled
+        while vm.running and vm.pc < end:
+            pc = vm.pc
+            handler, arguments = instructions[pc]
+            vm.pc += 1
+            start = clock()
+            try:
+                handler(vm, *arguments)
+            except RUNTIME_ERRORS as e:
+                # Fault at the failed instruction, as VirtualMachine.run does
+                vm.running = False
+                vm.status = FAULT
+                vm.fault = f"{type(e).__name__}: {e}"
+                vm.pc = pc
+            nanoseconds[pc] += clock() - start
+            counts[pc] += 1
+            key = (chain, pc)
+            stack_counts[key] = stack_counts.get(key, 0) + 1
+            if handler is call:
+                chain = chain + (self.label_names.get(vm.pc, f"@{vm.pc}"),)
+            elif handler is ret and len(chain) > 1:
+                chain = chain[:-1]
+        vm.running = False
+        if vm.status is None:
+            vm.status = CANCELLED if vm.cancelled else COMPLETED
+        return self
+
+    def instruction_statistics(self):
+        """(index, count, nanoseconds) of every executed instruction, hottest first."""
+        executed = [(index, count, self.nanoseconds[index])
+                    for index, count in enumerate(self.counts) if count]
+        return sorted(executed, key=lambda entry: entry[2], reverse=True)
+
+    def block_statistics(self):
+        """(start, end, executions, nanoseconds) of every executed block, hottest first."""
+        bounds = self.blocks + [len(self.counts)]
+        statistics = []
+        for start, end in zip(bounds, bounds[1:]):
+            if self.counts[start]:
+                statistics.append((start, end, self.counts[start], sum(self.nanoseconds[start:end])))
+        return sorted(statistics, key=lambda entry: entry[3], reverse=True)
+
+    def source_line_statistics(self):
+        """Enigma line -> (instructions executed, nanoseconds)."""
+        statistics = {}
+        for index, count in enumerate(self.counts):
+            if count:
+                line = self.vm.program.source_lines[index]
+                executed, nanoseconds = statistics.get(line, (0, 0))
+                statistics[line] = (executed + count, nanoseconds + self.nanoseconds[index])
+        return statistics
+
+    def flat_report(self, top=15):
+        program = self.vm.program
+        total = sum(self.nanoseconds) or 1
+        lines = [f"{'Count':>10} {'ms':>9} {'%':>6} {'Line':>5}  Instruction", '-' * 60]
+        for index, count, nanoseconds in self.instruction_statistics()[:top]:
+            lines.append(f"{count:>10} {nanoseconds / 1e6:>9.3f} {100 * nanoseconds / total:>6.1f} "
+                         f"{self._line_label(program.source_lines[index]):>5}  {program.texts[index]}")
+        lines += ['', f"{'Runs':>10} {'ms':>9} {'%':>6} {'Size':>5}  Block", '-' * 60]
+        for start, end, executions, nanoseconds in self.block_statistics()[:top]:
+            label = self.label_names.get(start, f"@{start}")
+            lines.append(f"{executions:>10} {nanoseconds / 1e6:>9.3f} {100 * nanoseconds / total:>6.1f} "
+                         f"{end - start:>5}  {label} (lines {self._block_lines(start, end)})")
+        lines += ['', f"{'Executed':>10} {'ms':>9} {'%':>6}  Enigma line", '-' * 60]
+        by_line = sorted(self.source_line_statistics().items(),
+                         key=lambda entry: entry[1][1], reverse=True)
+        for line, (executed, nanoseconds) in by_line[:top]:
+            lines.append(f"{executed:>10} {nanoseconds / 1e6:>9.3f} {100 * nanoseconds / total:>6.1f}  "
+                         f"{self._line_label(line)}")
+        return "\n".join(lines)
+
+    def _line_label(self, line):
+        return '?' if line is None else str(line)
+
+    def _block_lines(self, start, end):
+        lines = sorted({line for line in self.vm.program.source_lines[start:end] if line is not None})
+        return ', '.join(str(line) for line in lines) or '?'
+
+    def collapsed_stacks(self, weight='count'):
+        """Stacks in the folded format flamegraph.pl and speedscope read.
+
+        One line per distinct stack: the function chain and the Enigma line,
+        separated by ';', then the instructions executed there (or the
+        microseconds spent, with weight='time').
+        """
+        folded = {}
+        for (chain, index), count in self.stack_counts.items():
+            stack = ';'.join(chain + (f"line {self._line_label(self.vm.program.source_lines[index])}",))
+            if weight == 'time':
+                # Split the instruction's time across its stacks by execution count
+                value = self.nanoseconds[index] * count / self.counts[index] / 1000
+            else:
+                value = count
+            folded[stack] = folded.get(stack, 0) + value
+        return "\n".join(f"{stack} {round(value)}" for stack, value in sorted(folded.items()))
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(
+        description="Profile generated Enigma assembly on the VM.")
+    argument_parser.add_argument('assembly_file')
+    argument_parser.add_argument('--top', type=int, default=15, help="rows per report section")
+    argument_parser.add_argument('--collapsed', help="write flamegraph collapsed stacks to this file")
+    argument_parser.add_argument('--weight', choices=['count', 'time'], default='count',
+                                 help="what the collapsed stacks measure")
+    arguments = argument_parser.parse_args()
+
+    with open(arguments.assembly_file) as file:
+        profiler = Profiler(file.read()).run()
+    print(profiler.vm.memory_dump())
+    if profiler.vm.status != COMPLETED:
+        print(profiler.vm.result().describe())
+    print()
+    print(profiler.flat_report(arguments.top))
+    if arguments.collapsed:
+        with open(arguments.collapsed, 'w') as file:
+            file.write(profiler.collapsed_stacks(arguments.weight) + "\n")
@@ -0,0 +1,173 @@
+import argparse
+import random
+
+# Loops run this many times unless asked otherwise, so that the run time
+# of a generated program grows with its size and not exponentially with
+# its nesting
+TRIP_COUNT = 3
+
+
+class ProgramGenerator:
+    """Writes valid Enigma programs from a seed.
+
+    A program is a series of fragments, each with fresh names: two input
+    enums, `functions` small functions, `declarations` enum, efl, estr and
+    ebool declarations, then `loops` loop nests up to `depth` deep mixing
+    iterate, whilst and iff/maybe/orelse. Expressions have up to
+    `expression_size` terms. The accumulator only ever appears as `acc +
+    <expression>`, and expressions use the inputs, loop counters and
+    one-digit literals, so each statement run adds a bounded amount and
+    values grow linearly with the statements run: a few thousand for the
+    default shape, far inside the int64 lanes of batch.py. The same seed
+    and shape always give the same program.
+    """
+
+    def __init__(self, seed=0, declarations=8, depth=2, expression_size=4, loops=2,
+                 functions=2, trip_count=TRIP_COUNT):
+        self.random = random.Random(seed)
+        self.declarations = declarations
+        self.depth = depth
+        self.expression_size = expression_size
+        self.loops = loops
+        self.functions = functions
+        self.trip_count = trip_count
+        self.fragments = 0
+
+    def generate(self, size=None, fragments=1):
+        """A program of `fragments` fragments, or of at least size bytes."""
+        lines = []
+        length = 0
+        while (length < size) if size is not None else (self.fragments < fragments):
+            fragment = self.fragment()
+            lines += fragment
+            length += sum(len(line) + 1 for line in fragment)
+        return "\n".join(lines) + "\n"
+
+    def fragment(self):
+        n = self.fragments
+        self.fragments += 1
+        self.names = 0
+        inputs = [f"v-a{n}", f"v-b{n}"]
+        lines = [f"enum {name} = {self.random.randint(1, 9)}," for name in inputs]
+        functions = []
+        for _ in range(self.functions):
+            name = f"fn{n}x{self.fresh()}"
+            lines += self.function(name)
+            functions.append(name)
+        for _ in range(self.declarations):
+            lines.append(self.declaration(n, inputs))
+        accumulator = f"v-acc{n}"
+        lines.append(f"enum {accumulator} = 0,")
+        for _ in range(self.loops):
+            lines += self.block(n, self.depth, inputs, [], accumulator, functions, '')
+        return lines
+
+    def fresh(self):
+        self.names += 1
+        return self.names
+
+    def function(self, name):
+        first, second, local = (f"v-{name}p{self.fresh()}" for _ in range(3))
+        return [f"f-enum {name}(enum {first}, enum {second}) {{",
+                f"    enum {local} = {self.expression([first, second])},",
+                f"    iff ({first} > {self.random.randint(1, 9)}) {{",
+                f"        ret {local} + {second},",
+                "    }",
+                f"    ret {local} - {self.random.randint(1, 9)},",
+                "}"]
+
+    def declaration(self, n, inputs):
+        name = f"v-d{n}x{self.fresh()}"
+        kind = self.random.choice(['enum', 'enum', 'enum', 'efl', 'estr', 'ebool'])
+        if kind == 'efl':
+            return f"efl {name} = {self.random.randint(1, 99) / 10} * {self.random.randint(1, 9)},"
+        if kind == 'estr':
+            return f'estr {name} = "text {n} {self.names}",'
+        if kind == 'ebool':
+            return f"ebool {name} = {self.random.choice(['yup', 'nah'])},"
+        return f"enum {name} = {self.expression(inputs)},"
+
+    def expression(self, variables):
+        terms = []
+        for _ in range(self.random.randint(1, self.expression_size)):
+            choice = self.random.random()
+            if choice < 0.3 or not variables:
+                terms.append(str(self.random.randint(1, 9)))
+            elif choice < 0.7:
+                terms.append(self.random.choice(variables))
+            else:
+                terms.append(f"{self.random.choice(variables)} * {self.random.randint(2, 9)}")
+        expression = terms[0]
+        for term in terms[1:]:
+            expression += f" {self.random.choice('+-')} {term}"
+        return expression
+
+    def condition(self, variables):
+        return (f"{self.random.choice(variables)} {self.random.choice(['<', '>', '==', '>='])} "
+                f"{self.random.randint(0, 9)}")
+
+    def statements(self, variables, accumulator, functions, indent):
+        lines = [f"{indent}{accumulator} = {accumulator} + {self.expression(variables)},"]
+        if functions:
+            arguments = ', '.join(self.random.choice(variables[:2] + ['1', '2']) for _ in range(2))
+            lines.append(f"{indent}{accumulator} = {accumulator} + "
+                         f"{self.random.choice(functions)}({arguments}),")
+        return lines
+
+    def block(self, n, depth, inputs, counters, accumulator, functions, indent):
+        variables = inputs + counters
+        if depth == 0:
+            return self.statements(variables, accumulator, functions, indent)
+        inner = indent + '    '
+        kind = self.random.choice(['iterate', 'whilst', 'iff'])
+        if kind == 'iff':
+            return ([f"{indent}iff ({self.condition(variables)}) {{"]
+                    + self.block(n, depth - 1, inputs, counters, accumulator, functions, inner)
+                    + [f"{indent}}} maybe ({self.condition(variables)}) {{"]
+                    + self.statements(variables, accumulator, functions, inner)
+                    + [f"{indent}}} orelse {{"]
+                    + self.block(n, depth - 1, inputs, counters, accumulator, functions, inner)
+                    + [f"{indent}}}"])
+        counter = f"v-i{n}x{self.fresh()}"
+        body = self.block(n, depth - 1, inputs, counters + [counter], accumulator, functions, inner)
+        if kind == 'iterate':
+            return ([f"{indent}iterate (enum {counter} = 0, {counter} < {self.trip_count}, "
+                     f"{counter}++,) {{"]
+                    + body + [f"{indent}}}"])
+        return ([f"{indent}enum {counter} = 0,",
+                 f"{indent}whilst ({counter} < {self.trip_count}) {{"]
+                + body + [f"{inner}{counter} = {counter} + 1,", f"{indent}}}"])
+
+
+def generate_program(seed=0, size=None, fragments=1, **shape):
+    """An Enigma program from ProgramGenerator(seed, **shape); see generate()."""
+    return ProgramGenerator(seed, **shape).generate(size, fragments)
+
+
+def parse_size(text):
+    """Turn '512', '64K', '1M' or '0.5G' into a byte count."""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description="Generate a random valid Enigma program.")
+    argument_parser.add_argument('--seed', type=int, default=0)
+    argument_parser.add_argument('--size', type=parse_size,
+                                 help="generate at least this many bytes ('64K', '1M')")
+    argument_parser.add_argument('--fragments', type=int, default=1)
+    argument_parser.add_argument('--declarations', type=int, default=8)
+    argument_parser.add_argument('--depth', type=int, default=2)
+    argument_parser.add_argument('--expression-size', type=int, default=4)
+    argument_parser.add_argument('--loops', type=int, default=2)
+    argument_parser.add_argument('--functions', type=int, default=2)
+    argument_parser.add_argument('--trip-count', type=int, default=TRIP_COUNT)
+    arguments = argument_parser.parse_args()
+
+    print(generate_program(arguments.seed, arguments.size, arguments.fragments,
+                           declarations=arguments.declarations, depth=arguments.depth,
+                           expression_size=arguments.expression_size, loops=arguments.loops,
+                           functions=arguments.functions, trip_count=arguments.trip_count), end='')
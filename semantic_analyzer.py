@@ -1,16 +1,79 @@
 class SemanticAnalyzer:
-    def __init__(self):
+    def __init__(self, imports=None):
+        self.imports = imports or {}  # Module name -> interface an import may name
+        self.imported_functions = set()
         self.symbol_table = {}
+        self.function_table = {}
         self.memory_location = 1000
+        self.current_function = None
+        self.function_depth = 0
+        self.brace_depth = 0
 
     def add_to_symbol_table(self, identifier, data_type, value=None):
-        """Add a variable to the symbol table."""
+        """Add a variable to the symbol table, or to the current function's locals."""
+        if self.current_function is not None:
+            local_symbols = self.function_table[self.current_function]['locals']
+            if identifier in local_symbols:
+                raise ValueError(
+                    f"Variable '{identifier}' already declared in function '{self.current_function}'")
+            local_symbols[identifier] = {
+                'data_type': data_type, 'value': value, 'memory_location': None}
+            return
         if identifier in self.symbol_table:
             raise ValueError(f"Variable '{identifier}' already declared")
         self.symbol_table[identifier] = {
             'data_type': data_type, 'value': value, 'memory_location': self.memory_location}
         self.memory_location += 4
 
+    def lookup(self, identifier):
+        """Find a variable in the current function scope first, then globally."""
+        if self.current_function is not None:
+            local_symbols = self.function_table[self.current_function]['locals']
+            if identifier in local_symbols:
+                return local_symbols[identifier]
+        return self.symbol_table.get(identifier)
+
+    def count_arguments(self, tokens, i):
+        """Count the arguments of the call whose '(' is at tokens[i]."""
+        depth = 0
+        count = 0
+        while i < len(tokens):
+            token_type = tokens[i]['type']
+            if token_type == 'LPAREN':
+                depth += 1
+            elif token_type == 'RPAREN':
+                depth -= 1
+                if depth == 0:
+                    return count
+            elif depth == 1:
+                if count == 0:
+                    count = 1
+                if token_type in ['COMMA', 'STATEMENT_TERMINATOR']:
+                    count += 1
+            i += 1
+        return count
+
+    def import_module(self, module):
+        """Declare the globals and functions module exports, as if defined here."""
+        if self.current_function is not None:
+            raise ValueError(f"Module '{module}' imported inside function '{self.current_function}'")
+        interface = self.imports.get(module)
+        if interface is None:
+            raise ValueError(f"Module '{module}' not found")
+        for identifier, entry in interface['globals'].items():
+            if identifier in self.symbol_table:
+                raise ValueError(f"Variable '{identifier}' of module '{module}' already declared")
+            self.symbol_table[identifier] = {
+                'data_type': entry['data_type'], 'value': None,
+                'memory_location': entry['memory_location']}
+        for name, function in interface['functions'].items():
+            if name in self.function_table:
+                raise ValueError(f"Function '{name}' of module '{module}' already defined")
+            self.function_table[name] = {
+                'return_type': function['return_type'], 'params': list(function['params']),
+                'locals': {}}
+            self.imported_functions.add(name)
+
     def check_variable_declaration(self, data_type, identifier, value):
         """Check the validity of a variable declaration."""
         if not identifier.startswith('v-'):
@@ -25,7 +88,54 @@ class SemanticAnalyzer:
         i = 0
         while i < len(tokens):
             token = tokens[i]
-            if token['type'] == 'DATATYPE':
+            if token['type'] == 'FUNCTION_DEF':
+                return_type, name = token['value'].split()
+                if name in self.function_table:
+                    raise ValueError(f"Function '{name}' already defined")
+                self.function_table[name] = {
+                    'return_type': return_type[2:], 'params': [], 'locals': {}}
+                self.current_function = name
+                self.function_depth = self.brace_depth
+                i += 1
+                # Parameters become the first locals of the function
+                while i < len(tokens) and tokens[i]['type'] != 'RPAREN':
+                    if tokens[i]['type'] == 'DATATYPE' and i + 1 < len(tokens):
+                        identifier = tokens[i + 1]['value']
+                        self.check_variable_declaration(
+                            tokens[i]['value'], identifier, None)
+                        self.add_to_symbol_table(identifier, tokens[i]['value'])
+                        self.function_table[name]['params'].append(identifier)
+                        i += 1
+                    i += 1
+            elif token['type'] == 'IMPORT':
+                self.import_module(token['value'].split()[1])
+            elif token['type'] == 'LCURLY':
+                self.brace_depth += 1
+            elif token['type'] == 'RCURLY':
+                self.brace_depth -= 1
+                if self.current_function is not None and self.brace_depth == self.function_depth:
+                    self.current_function = None
+            elif token['type'] == 'FUNCTION_CALL':
+                name = token['value']
+                if name not in self.function_table:
+                    raise ValueError(f"Function '{name}' called before definition")
+                expected = len(self.function_table[name]['params'])
+                found = self.count_arguments(tokens, i + 1)
+                if found != expected:
+                    raise ValueError(
+                        f"Function '{name}' expects {expected} argument(s), got {found}")
+            elif token['type'] == 'RETURN':
+                if self.current_function is None:
+                    raise ValueError("'ret' used outside of a function")
+                returns_value = i + 1 < len(tokens) and tokens[i + 1]['type'] != 'STATEMENT_TERMINATOR'
+                return_type = self.function_table[self.current_function]['return_type']
+                if return_type == 'none' and returns_value:
+                    raise ValueError(
+                        f"Function '{self.current_function}' is f-none and cannot return a value")
+                if return_type != 'none' and not returns_value:
+                    raise ValueError(
+                        f"Function '{self.current_function}' must return a {return_type} value")
+            elif token['type'] == 'DATATYPE':
                 data_type = token['value']
                 if i + 1 < len(tokens) and tokens[i + 1]['type'] == 'VARIABLE':
                     identifier = tokens[i + 1]['value']
@@ -41,12 +151,13 @@ class SemanticAnalyzer:
             elif token['type'] == 'VARIABLE':
                 identifier = token['value']
                 if i + 1 < len(tokens) and tokens[i + 1]['type'] == 'ASSIGN':
-                    if identifier not in self.symbol_table:
+                    entry = self.lookup(identifier)
+                    if entry is None:
                         raise ValueError(
                             f"Variable '{identifier}' used before declaration")
                     if i + 2 < len(tokens) and tokens[i + 2]['type'] in ['NUMBER', 'STRING', 'BOOLEAN_VAL', 'VARIABLE']:
                         value = tokens[i + 2]['value']
-                        self.symbol_table[identifier]['value'] = value
+                        entry['value'] = value
                         i += 2
             i += 1
 
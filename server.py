@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+
+from cache import CACHE_ENTRIES, ArtifactCache
+
+# Only the standard library and the cache, which needs nothing else, are
+# imported up front: a client that reaches a running server never pays for
+# importing the compiler itself.
+
+# Every message is a 4-byte big-endian length followed by that much JSON
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 << 20
+# Bounds of every run the server does: a request may ask for tighter limits,
+# never looser ones, so one endless loop cannot hold a server thread
+RUN_LIMITS = {'timeout': 10.0, 'max_instructions': 100_000_000, 'max_cells': 1 << 24}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def default_socket_path():
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, f"enigma-compiler-{os.getuid()}.sock")
+
+
+def send_message(connection, message):
+    body = json.dumps(message).encode()
+    connection.sendall(FRAME_HEADER.pack(len(body)) + body)
+
+
+def receive_message(connection):
+    """The next message on connection, or None once the peer has closed it."""
+    header = _receive_exactly(connection, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    body = _receive_exactly(connection, size)
+    if body is None:
+        raise ConnectionError("Connection closed in the middle of a frame")
+    return json.loads(body)
+
+
+def _receive_exactly(connection, size):
+    chunks = []
+    while size:
+        chunk = connection.recv(size)
+        if not chunk:
+            if chunks:
+                raise ConnectionError("Connection closed in the middle of a frame")
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def run_limits(requested, ceilings=RUN_LIMITS):
+    """VirtualMachine limits for a run that asked for requested: each one
+    the smaller of the request and its ceiling, the ceiling when unasked."""
+    if requested is None:
+        requested = {}
+    if not isinstance(requested, dict):
+        raise BadRequest("'limits' must be an object")
+    limits = dict(ceilings)
+    for name, value in requested.items():
+        if name not in ceilings:
+            raise BadRequest(f"Unknown limit {name!r}")
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise BadRequest(f"Limit {name!r} must be a positive number")
+        limits[name] = min(value, ceilings[name])
+    return limits
+
+
+def handle_request(request, cache, limits=RUN_LIMITS):
+    """Answer one request; the server and the in-process fallback share this.
+
+    Requests are {'op': 'compile' | 'run' | 'ping' | 'stats', ...}; compile
+    and run take 'source' and an optional 'level', run also 'limits' for
+    the VirtualMachine, which are clamped to limits. Answers carry 'ok'
+    and either the result or an 'error' with the build status and message.
+    """
+    from build import compile_source, error_status
+    from pass_manager import OPTIMIZATION_LEVELS
+    from vm import VirtualMachine
+
+    if not isinstance(request, dict):
+        return {'ok': False, 'error': {'status': 'bad request',
+                                       'message': "A request must be a JSON object"}}
+    operation = request.get('op')
+    if operation == 'ping':
+        return {'ok': True, 'pid': os.getpid()}
+    if operation == 'stats':
+        return {'ok': True, 'cache': cache.statistics()}
+    if operation not in ('compile', 'run'):
+        return {'ok': False, 'error': {'status': 'bad request',
+                                       'message': f"Unknown operation {operation!r}"}}
+    try:
+        source_code = request.get('source')
+        level = request.get('level', 2)
+        if not isinstance(source_code, str):
+            raise BadRequest("'source' must be a string")
+        if isinstance(level, bool) or level not in OPTIMIZATION_LEVELS:
+            raise BadRequest(f"Unknown optimization level {level!r}")
+        if operation == 'run':
+            limits = run_limits(request.get('limits'), limits)
+        key = cache.key(source_code, level)
+        artifacts = cache.get(key)
+        cached = artifacts is not None
+        if not cached:
+            artifacts = compile_source(source_code, level)
+            cache.put(key, artifacts)
+        assembly_code, optimized_code = artifacts
+        if operation == 'compile':
+            return {'ok': True, 'cached': cached, 'assembly': assembly_code,
+                    'optimized': optimized_code}
+        vm = VirtualMachine(optimized_code, **limits).run()
+        return {'ok': True, 'cached': cached, 'result': vm.result().as_dict(),
+                'output': vm.memory_dump()}
+    except BadRequest as e:
+        return {'ok': False, 'error': {'status': 'bad request', 'message': str(e)}}
+    except Exception as e:
+        status, message = error_status(e)
+        return {'ok': False, 'error': {'status': status, 'message': message}}
+
+
+class CompileRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # A connection may carry any number of requests, one answer each
+        while True:
+            try:
+                request = receive_message(self.request)
+            except ValueError as e:
+                # Oversized or not JSON: where the next frame starts is
+                # unknown, so answer this one and drop the connection
+                send_message(self.request, {'ok': False, 'error': {
+                    'status': 'bad request', 'message': f"Unreadable frame: {e}"}})
+                return
+            if request is None:
+                return
+            if isinstance(request, dict) and request.get('op') == 'shutdown':
+                send_message(self.request, {'ok': True})
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            send_message(self.request, handle_request(request, self.server.cache))
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Keeps the compiler imported and answers requests on a Unix socket,
+    a thread per connection, all sharing one ArtifactCache."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, cache_entries=CACHE_ENTRIES):
+        self.socket_path = socket_path or default_socket_path()
+        self.cache = ArtifactCache(cache_entries)
+        if os.path.exists(self.socket_path):
+            if ping(self.socket_path):
+                raise RuntimeError(f"A compile server is already listening on {self.socket_path}")
+            os.unlink(self.socket_path)  # Left behind by a server that died
+        # Warm up: import the whole pipeline before the first request arrives
+        handle_request({'op': 'compile', 'source': 'enum v-warm = 1,'}, ArtifactCache(1))
+        super().__init__(self.socket_path, CompileRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class CompileClient:
+    """Talks to a CompileServer, or compiles in-process when none is running.
+
+    The connection is opened on first use and kept for later requests. If
+    the server has gone away since, the client reconnects once (to a
+    restarted server, say) and otherwise falls back like a first request.
+    """
+
+    def __init__(self, socket_path=None, fallback=True):
+        self.socket_path = socket_path or default_socket_path()
+        self.fallback = fallback
+        self.connection = None
+        self.local_cache = None
+
+    def request(self, message):
+        reconnected = self.connection is None
+        while True:
+            if self.connection is None:
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    connection.connect(self.socket_path)
+                    self.connection = connection
+                except OSError:
+                    connection.close()
+                    if not self.fallback:
+                        raise
+                    return self._request_in_process(message)
+            try:
+                send_message(self.connection, message)
+                answer = receive_message(self.connection)
+                if answer is None:
+                    raise ConnectionError("The compile server closed the connection")
+                return answer
+            except ConnectionError:
+                # Broken pipe, reset or end of stream: the server stopped or died
+                self.close()
+                if reconnected:
+                    if not self.fallback:
+                        raise
+                    return self._request_in_process(message)
+                reconnected = True
+
+    def _request_in_process(self, message):
+        if self.local_cache is None:
+            self.local_cache = ArtifactCache()
+        return handle_request(message, self.local_cache)
+
+    def compile(self, source_code, level=2):
+        return self.request({'op': 'compile', 'source': source_code, 'level': level})
+
+    def run(self, source_code, level=2, **limits):
+        return self.request({'op': 'run', 'source': source_code, 'level': level,
+                             'limits': limits})
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def ping(socket_path=None):
+    """Whether a compile server answers on socket_path."""
+    client = CompileClient(socket_path, fallback=False)
+    try:
+        return client.request({'op': 'ping'})['ok']
+    except OSError:
+        return False
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(
+        description="Run a warm Enigma compile server, or talk to one.")
+    argument_parser.add_argument('command', choices=['serve', 'compile', 'run', 'stats', 'stop'])
+    argument_parser.add_argument('source_file', nargs='?')
+    argument_parser.add_argument('--socket', default=None,
+                                 help=f"Unix socket path (default {default_socket_path()})")
+    argument_parser.add_argument('-O', dest='level', default='2',
+                                 help="optimization level 0-3 (default 2)")
+    argument_parser.add_argument('--timeout', type=float, help="run: seconds before stopping")
+    arguments = argument_parser.parse_args()
+
+    if arguments.command == 'serve':
+        server = CompileServer(arguments.socket)
+        print(f"Listening on {server.socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        sys.exit(0)
+
+    client = CompileClient(arguments.socket, fallback=arguments.command in ('compile', 'run'))
+    from pass_manager import parse_level  # Light: nothing of the compiler itself
+    level = parse_level(arguments.level)
+    if arguments.command in ('compile', 'run'):
+        if arguments.source_file is None:
+            argument_parser.error(f"{arguments.command} needs a source file")
+        with open(arguments.source_file) as file:
+            source_code = file.read()
+        if arguments.command == 'compile':
+            answer = client.compile(source_code, level)
+        else:
+            limits = {} if arguments.timeout is None else {'timeout': arguments.timeout}
+            answer = client.run(source_code, level, **limits)
+    else:
+        try:
+            answer = client.request({'op': 'stats' if arguments.command == 'stats' else 'shutdown'})
+        except OSError:
+            print(f"No compile server on {client.socket_path}")
+            sys.exit(1)
+    client.close()
+    if not answer['ok']:
+        print(f"{answer['error']['status']}: {answer['error']['message']}")
+        sys.exit(1)
+    if arguments.command == 'compile':
+        print(answer['optimized'])
+    elif arguments.command == 'run':
+        print(answer['output'])
+        if answer['result']['status'] == 'fault':
+            print(f"Fault: {answer['result']['message']}")
+        elif answer['result']['status'] != 'completed':
+            print(f"Stopped by the {answer['result']['status']}")
+    elif arguments.command == 'stats':
+        print(json.dumps(answer['cache']))
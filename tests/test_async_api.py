@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import async_api
+from async_api import AsyncCompiler
+from vm import CANCELLED
+
+SOURCE = "enum v-a = 2,\nenum v-b = v-a * 3,\n"
+
+# Only a cancel() from outside ends this run
+ENDLESS_LOOP = "\n".join([
+    "LOAD 0, r1",
+    ".L1:",
+    "ADD 1, r1, r1",
+    "STORE r1, 1000",
+    "JMP .L1",
+])
+
+
+class CountingCompile:
+    """Stands in for build.compile_source, recording how many calls overlap."""
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.active = 0
+        self.most_active = 0
+
+    def __call__(self, source_code, level):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.active -= 1
+        return source_code, f"{source_code} at -O{level}"
+
+
+def test_no_more_calls_than_max_concurrency_are_in_flight(monkeypatch):
+    compile_program = CountingCompile()
+    monkeypatch.setattr(async_api, 'compile_program', compile_program)
+
+    async def compile_all():
+        async with AsyncCompiler(max_workers=8, max_concurrency=3) as compiler:
+            return await asyncio.gather(*(compiler.compile_source(f"enum v-a = {number},")
+                                          for number in range(10)))
+
+    results = asyncio.run(compile_all())
+    assert [optimized for _, optimized in results] == [
+        f"enum v-a = {number}, at -O2" for number in range(10)]
+    assert (compile_program.calls, compile_program.most_active) == (10, 3)
+
+
+def test_concurrent_compiles_of_one_source_share_a_compilation(monkeypatch):
+    compile_program = CountingCompile()
+    monkeypatch.setattr(async_api, 'compile_program', compile_program)
+
+    async def compile_together():
+        async with AsyncCompiler() as compiler:
+            together = await asyncio.gather(*(compiler.compile_source(SOURCE) for _ in range(5)))
+            # Finished compiles are served from the cache
+            return together, await compiler.compile_source(SOURCE), compiler.pending
+
+    together, later, pending = asyncio.run(compile_together())
+    assert together == [(SOURCE, f"{SOURCE} at -O2")] * 5 and later == together[0]
+    assert compile_program.calls == 1 and pending == {}
+
+
+def test_cancelling_a_run_stops_its_virtual_machine(monkeypatch):
+    machines = []
+
+    class RecordedMachine(async_api.VirtualMachine):
+        def __init__(self, *arguments, **limits):
+            super().__init__(*arguments, **limits)
+            machines.append(self)
+
+    monkeypatch.setattr(async_api, 'VirtualMachine', RecordedMachine)
+
+    async def cancel_run():
+        async with AsyncCompiler() as compiler:
+            # The timeout only keeps a broken cancel from hanging the suite
+            running = asyncio.ensure_future(compiler.run_assembly(ENDLESS_LOOP, timeout=30))
+            while not (machines and machines[0].running):
+                await asyncio.sleep(0.01)
+            running.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await running
+            started = time.perf_counter()
+        # Leaving the block waited for the worker thread to finish the run
+        return time.perf_counter() - started
+
+    assert asyncio.run(cancel_run()) < 5
+    vm = machines[0]
+    assert vm.status == CANCELLED and not vm.running
+    assert vm.get_global(1000) > 0
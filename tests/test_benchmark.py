@@ -0,0 +1,36 @@
+import argparse
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmark import check_memory, format_budget_check, parse_memory_budgets, run_suite
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_memory_budgets_are_read_from_json():
+    assert parse_memory_budgets('{"1K": {"peak": "1M"}}') == {'1K': {'peak': '1M'}}
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_memory_budgets('{"1K": ')
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_memory_budgets('{"1K": "1M"}')
+
+
+def test_phases_over_their_budget_are_reported():
+    results = run_suite([1024], repeat=1, execute=False, memory=True)
+    rows = check_memory(results, {'1K': {'peak': 1, 'optimize': '1G', 'no such phase': 1},
+                                  '2K': {'peak': 1}})
+    assert [(label, phase, over) for label, phase, _, _, over in rows] == [
+        ('1K', 'peak', True), ('1K', 'optimize', False)]
+    assert format_budget_check(rows).count('OVER BUDGET') == 1
+
+
+def test_command_line_fails_when_over_budget():
+    completed = subprocess.run(
+        [sys.executable, 'benchmark.py', '--sizes', '1K', '--repeat', '1', '--compile-only',
+         '--memory-budget', '{"1K": {"peak": "1K"}}'],
+        cwd=HERE, capture_output=True, text=True)
+    assert completed.returncode == 1
+    assert "1 phase(s) over their memory budget" in completed.stdout
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from build import (CODE_GENERATION_ERROR, INTERNAL_ERROR, LEXICAL_ERROR, OK, SEMANTIC_ERROR,
+                   SYNTAX_ERROR, build, compile_source, error_status, format_summary)
+from code_generator import CodeGenerationError
+
+SOURCES = {
+    'good.enigma': "enum v-a = 2,\nenum v-b = v-a * 3,\n",
+    'lexical.enigma': "enum v-a = 2 $ 3,\n",
+    'syntax.enigma': "enum v-a = 1\nenum v-b = 2,\n",
+    'semantic.enigma': "enum v-a = 1,\nenum v-a = 2,\n",
+    'truncated.enigma': "enum v-a = ",
+}
+
+
+def status_of(source_code):
+    try:
+        compile_source(source_code)
+    except Exception as e:
+        return error_status(e)
+    return OK, None
+
+
+def test_syntax_errors_keep_their_own_message():
+    status, message = status_of(SOURCES['syntax.enigma'])
+    assert status == SYNTAX_ERROR
+    assert message.startswith("Expected token STATEMENT_TERMINATOR, but found DATATYPE")
+    # Only running out of tokens is reported as the end of the input
+    assert status_of(SOURCES['truncated.enigma']) == (SYNTAX_ERROR, "Unexpected end of input.")
+
+
+@pytest.mark.parametrize('name, status', [
+    ('good.enigma', OK), ('lexical.enigma', LEXICAL_ERROR), ('syntax.enigma', SYNTAX_ERROR),
+    ('semantic.enigma', SEMANTIC_ERROR), ('truncated.enigma', SYNTAX_ERROR)])
+def test_compile_errors_are_classified_by_phase(name, status):
+    assert status_of(SOURCES[name])[0] == status
+
+
+def test_generator_and_internal_errors_are_told_apart_from_semantic_ones():
+    assert error_status(CodeGenerationError("bad token"))[0] == CODE_GENERATION_ERROR
+    assert error_status(ValueError("redeclared"))[0] == SEMANTIC_ERROR
+    assert error_status(KeyError('v-a')) == (INTERNAL_ERROR, "KeyError: 'v-a'")
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_build_reports_every_file_in_order(tmp_path, workers):
+    paths = []
+    for name, source_code in SOURCES.items():
+        path = tmp_path / 'src' / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(source_code)
+        paths.append(str(path))
+    summaries = build(paths, str(tmp_path / 'out'), workers=workers)
+    assert [summary['path'] for summary in summaries] == paths
+    assert [summary['status'] for summary in summaries] == [
+        OK, LEXICAL_ERROR, SYNTAX_ERROR, SEMANTIC_ERROR, SYNTAX_ERROR]
+    assert summaries[0]['artifacts'] == [str(tmp_path / 'out' / 'good.asm'),
+                                         str(tmp_path / 'out' / 'good.opt.asm')]
+    assert all(os.path.exists(artifact) for artifact in summaries[0]['artifacts'])
+
+    lines = format_summary(summaries, 1.0, workers).splitlines()
+    assert lines[0].startswith(f"5 file(s) in 1.00s with {workers} worker(s)")
+    assert lines[1] == "1 lexical error, 1 ok, 1 semantic error, 2 syntax error"
+    assert lines[2] == (f"{summaries[0]['instructions']} -> "
+                        f"{summaries[0]['optimized_instructions']} instructions over 1 compiled file(s)")
+    assert f"syntax error     {paths[2]}: Expected token STATEMENT_TERMINATOR" in lines[6]
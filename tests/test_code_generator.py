@@ -0,0 +1,84 @@
+import pytest
+
+from pipeline import Pipeline
+
+
+def run_globals(source_code, level):
+    return Pipeline(level).run(source_code, timeout=10).result().globals
+
+
+@pytest.mark.parametrize('level', [0, 1, 2, 3])
+@pytest.mark.parametrize('expression, expected', [
+    ('1 + 2 * 3', 7),
+    ('2 * 3 + 4 * 5 - 6 / 2', 23),
+    ('10 - 4 - 3', 3),
+    ('100 / 10 / 5', 2),
+    ('(1 + 2) * 3', 9),
+    ('2 * (3 + 4) * 5', 70),
+    ('1 + 2 < 2 * 2', 1),
+    ('3 * 3 == 4 + 5', 1),
+])
+def test_operator_precedence(expression, expected, level):
+    assert run_globals(f"enum v-x = {expression},", level) == {1000: expected}
+
+
+@pytest.mark.parametrize('level', [0, 2, 3])
+def test_precedence_with_variables_and_calls(level):
+    source_code = "\n".join([
+        "f-enum square(enum v-n) {",
+        "    ret v-n * v-n,",
+        "}",
+        "enum v-s = 1,",
+        "enum v-i = 2,",
+        "enum v-k = 3,",
+        "enum v-x = v-s + v-i * 4 + v-k * 2,",
+        "enum v-y = 1 + square(3) * 2,",
+    ])
+    result = run_globals(source_code, level)
+    assert result[1012] == 15
+    assert result[1016] == 19
+
+
+CONSTANTS = "\n".join([
+    "efl v-a = 2.5,",
+    "efl v-b = 2.50,",
+    "efl v-c = v-a * 2.5,",
+    'estr v-s = "hi",',
+    'estr v-t = "hi",',
+    "efl v-d = v-a * 1.0,",
+])
+
+
+def constant_pool(assembly_code):
+    """{index: literal} of the CONST lines, checking no index repeats."""
+    entries = [line[len('CONST '):].split(', ', 1) for line in assembly_code.splitlines()
+               if line.startswith('CONST ')]
+    pool = {int(index): literal for index, literal in entries}
+    assert len(pool) == len(entries)
+    return pool
+
+
+def loaded_constants(assembly_code):
+    return [int(line.split()[1].rstrip(',')) for line in assembly_code.splitlines()
+            if line.startswith('LDC ')]
+
+
+def test_equal_literals_share_one_pool_entry():
+    assembly_code, _ = Pipeline(0).compile(CONSTANTS)
+    pool = constant_pool(assembly_code)
+    assert sorted(pool.values()) == ['"hi"', '1.0', '2.5']
+    index = {literal: number for number, literal in pool.items()}
+    assert loaded_constants(assembly_code) == [index['2.5']] * 3 + [index['"hi"']] * 2 + [
+        index['1.0']]
+
+
+@pytest.mark.parametrize('level', [1, 2, 3])
+def test_constant_loads_resolve_after_optimization(level):
+    _, optimized_code = Pipeline(level).compile(CONSTANTS)
+    pool = constant_pool(optimized_code)
+    assert set(loaded_constants(optimized_code)) <= set(pool)
+    # Folded floats reuse an equal entry rather than adding another
+    floats = [float(literal) for literal in pool.values() if not literal.startswith('"')]
+    assert len(floats) == len(set(floats)) and 6.25 in floats
+    assert run_globals(CONSTANTS, level) == {
+        1000: 2.5, 1004: 2.5, 1008: 6.25, 1012: 'hi', 1016: 'hi', 1020: 2.5}
@@ -0,0 +1,120 @@
+import pytest
+
+from linker import LinkError, compile_module, interface_of, link
+from modules import COMPILED, DEPENDENCY_FAILED, UP_TO_DATE, build_modules
+from pipeline import Pipeline
+
+MATHLIB = """enum v-scale = 3,
+enum v-calls = 0,
+f-enum triple(enum v-x) {
+    v-calls = v-calls + 1,
+    ret v-x * v-scale,
+}
+f-enum add(enum v-a, enum v-b) {
+    ret v-a + v-b,
+}
+"""
+STRINGS = """import mathlib,
+estr v-greeting = "hello",
+efl v-ratio = 2.5,
+f-enum sextuple(enum v-y) {
+    ret add(triple(v-y), triple(v-y)),
+}
+"""
+MAIN = """import mathlib,
+import strings,
+estr v-msg = "hello",
+enum v-total = 0,
+iterate (enum v-i = 0, v-i < 4, v-i++,) {
+    v-total = v-total + sextuple(v-i),
+}
+v-scale = 10,
+enum v-last = triple(2) + 1 * 2,
+efl v-r = v-ratio,
+"""
+SOURCES = {'mathlib': MATHLIB, 'strings': STRINGS, 'main': MAIN}
+
+
+def single_file_globals():
+    """What the modules compute when pasted into one file."""
+    source_code = "".join(line for text in SOURCES.values()
+                          for line in text.splitlines(keepends=True)
+                          if not line.startswith('import'))
+    return Pipeline(0).run(source_code).result().globals
+
+
+def write_sources(directory, sources=SOURCES):
+    paths = []
+    for name, text in sources.items():
+        path = directory / f"{name}.enigma"
+        path.write_text(text)
+        paths.append(str(path))
+    return paths
+
+
+def actions(summaries):
+    return {summary['module']: summary['action'] for summary in summaries}
+
+
+@pytest.mark.parametrize('level', [0, 2, 3])
+def test_linked_modules_run_like_one_file(level):
+    objects = {}
+    for name, text in SOURCES.items():
+        imports = {module: interface_of(object_file) for module, object_file in objects.items()}
+        objects[name] = compile_module(name, text, imports, level)
+    image = link(objects, 'main')
+    assert Pipeline(level).execute(image).result().globals == single_file_globals()
+
+
+def test_link_reports_duplicate_functions():
+    objects = {'mathlib': compile_module('mathlib', MATHLIB),
+               'other': compile_module('other', "f-enum add(enum v-a) {\nret v-a,\n}\n")}
+    with pytest.raises(LinkError, match="'add'"):
+        link(objects)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_build_links_and_runs(tmp_path, workers):
+    paths = write_sources(tmp_path)
+    summaries, objects = build_modules(paths, str(tmp_path / 'build'), workers=workers)
+    assert set(actions(summaries).values()) == {COMPILED}
+    image = link(objects, 'main')
+    assert Pipeline().execute(image).result().globals == single_file_globals()
+
+
+def test_rebuild_skips_what_did_not_change(tmp_path):
+    paths = write_sources(tmp_path)
+    objects_directory = str(tmp_path / 'build')
+    build_modules(paths, objects_directory, workers=1)
+
+    summaries, _ = build_modules(paths, objects_directory, workers=1)
+    assert set(actions(summaries).values()) == {UP_TO_DATE}
+
+    # A body edit keeps mathlib's interface, so its importers stay as they are
+    (tmp_path / 'mathlib.enigma').write_text(MATHLIB.replace('v-a + v-b', 'v-b + v-a'))
+    summaries, _ = build_modules(paths, objects_directory, workers=1)
+    assert actions(summaries) == {'mathlib': COMPILED, 'strings': UP_TO_DATE, 'main': UP_TO_DATE}
+
+    # A new global changes the interface: everything importing it rebuilds
+    (tmp_path / 'mathlib.enigma').write_text(MATHLIB + "enum v-extra = 7,\n")
+    summaries, objects = build_modules(paths, objects_directory, workers=1)
+    assert set(actions(summaries).values()) == {COMPILED}
+    globals_ = Pipeline().execute(link(objects, 'main')).result().globals
+    assert 7 in globals_.values()
+
+    # Editing only the entry module rebuilds just that module
+    (tmp_path / 'main.enigma').write_text(MAIN + "enum v-more = 1,\n")
+    summaries, _ = build_modules(paths, objects_directory, workers=1)
+    assert actions(summaries) == {'mathlib': UP_TO_DATE, 'strings': UP_TO_DATE, 'main': COMPILED}
+
+    # So does changing the optimization level, for every module
+    summaries, _ = build_modules(paths, objects_directory, level=0, workers=1)
+    assert set(actions(summaries).values()) == {COMPILED}
+
+
+def test_failed_module_stops_its_importers(tmp_path):
+    paths = write_sources(tmp_path, {**SOURCES, 'mathlib': "enum v-scale = ,\n"})
+    summaries, objects = build_modules(paths, str(tmp_path / 'build'), workers=1)
+    statuses = {summary['module']: summary['status'] for summary in summaries}
+    assert statuses['strings'] == statuses['main'] == DEPENDENCY_FAILED
+    assert objects == {}
@@ -0,0 +1,228 @@
+import pytest
+
+from assembly import Instruction
+from cfg import DominatorTree, build_cfg
+from code_generator import CodeGenerator
+from optimizer import Optimizer
+from peephole import PeepholeEngine
+from pipeline import Pipeline
+from program_generator import ProgramGenerator
+from tokenizer import tokenize
+from utils import create_enhanced_symbol_table
+from vm import execute_assembly_code
+
+PROGRAMS = [
+    "\n".join([
+        "enum v-a = 2,",
+        "enum v-b = v-a * 3,",
+        "enum v-c = v-b - v-a,",
+        "v-a = v-c + v-b,",
+        "v-b = 7,",
+    ]),
+    "\n".join([
+        "enum v-age = 18,",
+        "estr v-message,",
+        "iff (v-age >= 18) {",
+        '    v-message = "adult",',
+        "} maybe (v-age < 13) {",
+        '    v-message = "child",',
+        "} orelse {",
+        '    v-message = "teen",',
+        "}",
+        "efl v-pi = 3.14,",
+        "efl v-copy = v-pi,",
+    ]),
+    "\n".join([
+        "f-enum square(enum v-n) {",
+        "    ret v-n * v-n,",
+        "}",
+        "f-enum sum(enum v-a, enum v-b) {",
+        "    enum v-s = v-a + v-b,",
+        "    ret v-s,",
+        "}",
+        "enum v-x = square(4),",
+        "enum v-y = sum(v-x, square(2)),",
+    ]),
+    "\n".join([
+        "enum v-total = 0,",
+        "enum v-n = 10,",
+        "iterate (enum v-i = 0, v-i < v-n, v-i++,) {",
+        "    v-total = v-total + v-i * 2,",
+        "}",
+        "whilst (v-n > 0) {",
+        "    v-n = v-n - 3,",
+        "}",
+    ]),
+]
+
+SHAPES = [{}, {'depth': 3, 'expression_size': 6}, {'functions': 4, 'loops': 3}]
+
+# A loop with no way out; only stopping the run from outside ends it
+ENDLESS_LOOP = "\n".join([
+    "LOAD 0, r1",
+    "STORE r1, 1000",
+    ".L1:",
+    "LOAD [1000], r1",
+    "ADD 1, r1, r1",
+    "STORE r1, 1000",
+    "MUL 2, r1, r2",
+    "STORE r2, 1004",
+    "JMP .L1",
+])
+
+# An inner loop at .L1, entered from both arms of a branch, inside an outer
+# loop at .L0
+NESTED_LOOPS = "\n".join([
+    ".L0:",
+    "LOAD [1000], r1",
+    "JZ r1, .L2",
+    "LOAD 1, r2",
+    "JMP .L1",
+    ".L2:",
+    "LOAD 2, r2",
+    ".L1:",
+    "LOAD [1004], r3",
+    "ADD r2, r3, r3",
+    "STORE r3, 1004",
+    "LT 10, r3, r4",
+    "JNZ r4, .L1",
+    "LOAD [1008], r5",
+    "JNZ r5, .L0",
+    "HALT",
+])
+
+
+def compile_at(source_code, level):
+    tokens, errors = tokenize(source_code)
+    assert not errors
+    code_generator = CodeGenerator()
+    code_generator.set_symbol_table(create_enhanced_symbol_table(tokens))
+    return Optimizer(level).optimize(code_generator.generate_code(tokens))
+
+
+@pytest.mark.parametrize('source_code', PROGRAMS)
+def test_optimization_levels_agree(source_code):
+    expected = execute_assembly_code(compile_at(source_code, 0))
+    for level in (1, 2, 3):
+        assert execute_assembly_code(compile_at(source_code, level)) == expected, \
+            f"-O{level} differs from -O0"
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('seed', range(8))
+def test_optimization_levels_agree_on_generated_programs(seed, shape):
+    source_code = ProgramGenerator(seed, **shape).generate(fragments=2)
+    unoptimized = Pipeline(0).run(source_code, timeout=30).result()
+    assert unoptimized.completed
+    for level in (1, 2, 3):
+        optimized = Pipeline(level).run(source_code, timeout=30).result()
+        assert optimized.completed
+        assert optimized.globals == unoptimized.globals, f"-O{level} differs from -O0"
+
+
+def test_endless_loop_keeps_its_global_stores():
+    optimized = Optimizer().optimize(ENDLESS_LOOP).splitlines()
+    assert "STORE r1, 1000" in optimized
+    assert "STORE r2, 1004" in optimized
+
+
+def describe_edges(cfg):
+    """Successor and predecessor positions of every block, in layout order."""
+    position = {block: number for number, block in enumerate(cfg.blocks)}
+    return [([position[successor] for successor in block.successors],
+             sorted(position[predecessor] for predecessor in block.predecessors))
+            for block in cfg.blocks]
+
+
+def test_inserted_preheader_is_patched_into_edges_loops_and_dominators():
+    cfg = build_cfg(NESTED_LOOPS.splitlines())
+    dominator_tree = DominatorTree(cfg)
+    inner, outer = cfg.natural_loops(dominator_tree)
+    assert (inner.header.label, outer.header.label, inner.parent) == ('.L1', '.L0', outer)
+    preheader = cfg.preheader(inner, dominator_tree)
+    assert preheader.label == '.L1_pre' and preheader in outer
+    assert dominator_tree.dominates(preheader, inner.header)
+    assert not dominator_tree.dominates(inner.header, preheader)
+    patched = describe_edges(cfg)
+    # A fresh analysis of the edited code agrees with the patched one
+    cfg.renumber()
+    cfg.rebuild_edges()
+    assert describe_edges(cfg) == patched
+    fresh = DominatorTree(cfg)
+    assert all(dominator_tree.dominates(first, second) == fresh.dominates(first, second)
+               for first in cfg.blocks for second in cfg.blocks)
+
+
+def test_value_numbering_reuses_dominating_values_but_not_sibling_ones():
+    cfg = build_cfg([
+        "LOAD [1000], r1",
+        "MUL 3, r1, r2",
+        "STORE r2, 1004",
+        "JZ r1, .L1",
+        "MUL 3, r1, r3",
+        "MUL 4, r1, r5",
+        "STORE r5, 1008",
+        "JMP .L2",
+        ".L1:",
+        "MUL 4, r1, r6",
+        "STORE r6, 1008",
+        ".L2:",
+        "MUL 3, r1, r7",
+        "STORE r7, 1012",
+        "HALT",
+    ])
+    Optimizer().common_subexpression_elimination(cfg)
+    lines = cfg.to_lines()
+    assert "MOV r2, r3" in lines and "MOV r2, r7" in lines
+    # Each arm computes r1 * 4 itself; neither one dominates the other
+    assert "MUL 4, r1, r5" in lines and "MUL 4, r1, r6" in lines
+
+
+def peephole(lines):
+    engine = PeepholeEngine()
+    rewritten = engine.run([Instruction(line) for line in lines])
+    return [instruction.text for instruction in rewritten], engine.fired
+
+
+@pytest.mark.parametrize('rule, window, expected', [
+    ('store-load', ["STORE r1, 1000", "LOAD [1000], r1"], ["STORE r1, 1000"]),
+    ('fstore-fload', ["FSTORE fr1, 1000", "FLOAD [1000], fr1"], ["FSTORE fr1, 1000"]),
+    ('store-load-other', ["STORE r1, 1000", "LOAD [1000], r2"],
+     ["STORE r1, 1000", "MOV r1, r2"]),
+    ('fstore-fload-other', ["FSTORE fr1, 1000", "FLOAD [1000], fr2"],
+     ["FSTORE fr1, 1000", "MOV fr1, fr2"]),
+    ('load-store', ["LOAD [1000], r1", "STORE r1, 1000"], ["LOAD [1000], r1"]),
+    ('fload-fstore', ["FLOAD [1000], fr1", "FSTORE fr1, 1000"], ["FLOAD [1000], fr1"]),
+    ('move-back', ["MOV r1, r2", "MOV r2, r1"], ["MOV r1, r2"]),
+    ('store-store', ["STORE r1, 1000", "STORE r2, 1000"], ["STORE r2, 1000"]),
+    ('load-load', ["LOAD 1, r1", "LOAD [1000], r1"], ["LOAD [1000], r1"]),
+    ('add-zero', ["ADD 0, r1, r1"], []),
+])
+def test_peephole_rules_rewrite_the_patterns_they_target(rule, window, expected):
+    # A comment inside the window does not hide the pattern and is kept
+    lines = window[:1] + ["; line 2"] + window[1:]
+    assert peephole(lines) == (["; line 2"] + expected, {rule: 1})
+
+
+@pytest.mark.parametrize('window', [
+    ["STORE r1, 1000", "LOAD [1004], r1"],  # Another address
+    ["STORE r1, 1000", "LOAD 1000, r1"],  # An immediate, not the stored cell
+    ["STORE r1, 1000", "FLOAD [1000], fr1"],  # Stored as an integer
+    ["LOAD [1000], r1", "STORE r2, 1000"],  # Another register
+    ["LOAD [1000], r1", "STORE r1, 1004"],
+    ["MOV r1, r2", "MOV r2, r3"],
+    ["STORE r1, 1000", "STORE r2, 1004"],
+    ["LOAD 1, r1", "LOAD [1000], r2"],
+    ["LOAD 1, r1", "ADD r1, r2, r2", "LOAD 2, r1"],  # r1 is read in between
+    ["ADD 0, r1, r2"],
+    ["ADD 1, r1, r1"],
+    ["MUL 0, r1, r1"],
+])
+def test_peephole_rules_leave_near_misses_alone(window):
+    assert peephole(window) == (window, {})
+
+
+def test_peephole_rewrites_chain_to_a_fixed_point():
+    # Dropping the reload exposes the second store as overwriting the first
+    assert peephole(["STORE r1, 1000", "LOAD [1000], r1", "STORE r2, 1000"]) == (
+        ["STORE r2, 1000"], {'store-load': 1, 'store-store': 1})
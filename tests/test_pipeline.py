@@ -0,0 +1,93 @@
+import json
+import math
+
+import pytest
+
+from Parser import SyntaxError
+from import_time import FORBIDDEN_MODULES, HEADLESS_STATEMENT, check_imports, import_times
+from pipeline import Pipeline, Tracer
+
+SOURCE = "enum v-a = 2,\nenum v-b = v-a * 3,\n"
+PHASES = ['tokenize', 'parse', 'semantic', 'symbol table', 'codegen', 'optimize']
+
+
+def traced_compile(tmp_path, tracer):
+    Pipeline(2, tracer).compile(SOURCE)
+    path = tmp_path / 'trace.json'
+    tracer.write_chrome_trace(str(path))
+    with open(path) as file:
+        return json.load(file)['traceEvents']
+
+
+def contains(outer, inner):
+    return outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+
+def test_chrome_trace_nests_passes_inside_their_phase(tmp_path):
+    metadata, *events = traced_compile(tmp_path, Tracer())
+    assert (metadata['ph'], metadata['args']) == ('M', {'name': 'Enigma compiler'})
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+    phases = [event for event in events if event['cat'] == 'compile']
+    passes = [event for event in events if event['cat'] == 'optimize']
+    assert [event['name'] for event in phases] == PHASES
+    # Phases run one after another, and every pass inside optimize
+    assert all(first['ts'] + first['dur'] <= second['ts'] for first, second in zip(phases, phases[1:]))
+    assert passes and all(contains(phases[-1], event) for event in passes)
+    tokenize = phases[0]['args']
+    assert (tokenize['input_size'], tokenize['output_size']) == (len(SOURCE), 12)
+    # Memory is only measured when asked for
+    assert not any('allocated_bytes' in event['args'] for event in events)
+
+
+def test_chrome_trace_reports_tracemalloc_memory(tmp_path):
+    tracer = Tracer(memory=True)
+    started = tracer.started_tracemalloc
+    try:
+        events = traced_compile(tmp_path, tracer)[1:]
+    finally:
+        tracer.stop()
+    # Stopping only ends tracing the tracer itself started
+    assert tracer.tracemalloc.is_tracing() != started
+    assert all({'allocated_bytes', 'peak_bytes'} <= set(event['args']) for event in events)
+    assert all(event['args']['peak_bytes'] > 0 for event in events)
+    # A phase's peak covers the peaks of the passes run inside it
+    optimize = next(event for event in events if event['name'] == 'optimize')
+    assert optimize['args']['peak_bytes'] >= max(
+        event['args']['peak_bytes'] for event in events if event['cat'] == 'optimize')
+
+
+def test_failed_phases_are_marked_in_the_trace():
+    tracer = Tracer()
+    with pytest.raises(SyntaxError):
+        Pipeline(2, tracer).compile("enum v-a = 1\nenum v-b = 2,\n")
+    events = tracer.chrome_trace()['traceEvents'][1:]
+    assert [(event['name'], event['args'].get('error')) for event in events] == [
+        ('tokenize', None), ('parse', 'SyntaxError')]
+
+
+def test_summary_totals_every_phase_and_indents_passes():
+    tracer = Tracer()
+    Pipeline(2, tracer).compile(SOURCE)
+    summary = tracer.summary()
+    pass_names = list(summary)[len(PHASES):]
+    assert list(summary)[:len(PHASES)] == PHASES and pass_names
+    assert all(summary[name]['calls'] == sum(span.name == name for span in tracer.spans)
+               for name in summary)
+    lines = tracer.format_summary().splitlines()
+    assert lines[0].split() == ['Phase', 'Calls', 'ms', '%', 'In', 'Out', 'Blocks', 'KiB']
+    rows = lines[2:-1]
+    assert [row[:40].rstrip() for row in rows] == PHASES + [f"  {name}" for name in pass_names]
+    assert rows[0].split()[1:2] == ['1'] and lines[-1].split()[0] == 'total'
+    # The phases' shares of the total add up to all of it
+    assert math.isclose(sum(float(row[40:].split()[2]) for row in rows[:len(PHASES)]), 100,
+                        abs_tol=0.5)
+
+
+def test_headless_imports_stay_clear_of_the_gui_and_optimizer():
+    # Importing the library loads nothing of the compiler yet
+    assert check_imports(import_times('import enigma', runs=1), math.inf,
+                         FORBIDDEN_MODULES + ('optimizer',)) == []
+    # Reaching the compiler needs the optimizer, still never tkinter
+    modules = import_times(HEADLESS_STATEMENT, runs=1)
+    assert 'optimizer' in modules
+    assert check_imports(modules, math.inf) == []
@@ -0,0 +1,122 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+from server import (FRAME_HEADER, MAX_FRAME_SIZE, RUN_LIMITS, ArtifactCache, CompileClient,
+                    CompileServer, handle_request, ping, receive_message, run_limits)
+
+ENDLESS = "enum v-a = 0,\nwhilst (1) {\nv-a = v-a + 1,\n}\n"
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_runs_without_limits_get_the_server_ceilings():
+    assert run_limits(None) == RUN_LIMITS
+    ceilings = {'timeout': 0.2, 'max_instructions': 10_000, 'max_cells': 1 << 16}
+    answer = handle_request({'op': 'run', 'source': ENDLESS}, ArtifactCache(), ceilings)
+    assert answer['ok']
+    assert answer['result']['status'] != 'completed'
+
+
+def test_requested_limits_are_clamped():
+    limits = run_limits({'timeout': 1e9, 'max_instructions': 10})
+    assert limits['timeout'] == RUN_LIMITS['timeout']
+    assert limits['max_instructions'] == 10
+
+
+def test_malformed_requests_get_error_replies():
+    cache = ArtifactCache()
+    for request in [{'op': 'run'}, {'op': 'compile', 'source': 3},
+                    {'op': 'compile', 'source': 'enum v-a = 1,', 'level': 9},
+                    {'op': 'run', 'source': 'enum v-a = 1,', 'limits': {'timeout': -1}},
+                    {'op': 'run', 'source': 'enum v-a = 1,', 'limits': {'stack': 1}},
+                    ['not', 'an', 'object']]:
+        answer = handle_request(request, cache)
+        assert not answer['ok']
+        assert answer['error']['status'] == 'bad request'
+
+
+@pytest.fixture
+def server():
+    # Unix socket paths are short, so this stays out of pytest's tmp_path
+    directory = tempfile.mkdtemp()
+    compile_server = CompileServer(os.path.join(directory, 'server.sock'))
+    thread = threading.Thread(target=compile_server.serve_forever, daemon=True)
+    thread.start()
+    yield compile_server
+    compile_server.shutdown()
+    compile_server.server_close()
+    thread.join()
+    os.rmdir(directory)
+
+
+def send_raw(socket_path, data):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(10)
+        connection.connect(socket_path)
+        connection.sendall(data)
+        answer = receive_message(connection)
+        return answer, connection.recv(1)
+
+
+@pytest.mark.parametrize('frame', [
+    FRAME_HEADER.pack(5) + b'notjs',
+    FRAME_HEADER.pack(2) + b'\xff\xfe',
+    FRAME_HEADER.pack(MAX_FRAME_SIZE + 1),
+], ids=['not json', 'not utf-8', 'oversized'])
+def test_unreadable_frames_get_an_error_and_a_closed_connection(server, frame):
+    answer, after = send_raw(server.socket_path, frame)
+    assert not answer['ok']
+    assert answer['error']['status'] == 'bad request'
+    assert after == b''
+    # The server itself keeps answering
+    assert ping(server.socket_path)
+
+
+def start_server_process(socket_path):
+    process = subprocess.Popen([sys.executable, 'server.py', 'serve', '--socket', socket_path],
+                               cwd=HERE, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while not ping(socket_path):
+        assert process.poll() is None and time.monotonic() < deadline, "server did not start"
+        time.sleep(0.05)
+    return process
+
+
+def kill(process):
+    process.kill()
+    process.wait()
+
+
+def test_client_reconnects_once_then_compiles_in_process():
+    directory = tempfile.mkdtemp()
+    socket_path = os.path.join(directory, 'server.sock')
+    client = CompileClient(socket_path)
+    first = start_server_process(socket_path)
+    try:
+        assert client.compile('enum v-a = 1,')['ok'] and client.connection is not None
+        kill(first)
+        # A server restarted on the same socket picks up the next request
+        second = start_server_process(socket_path)
+        try:
+            assert client.compile('enum v-a = 2,')['ok']
+            assert client.connection is not None and client.local_cache is None
+        finally:
+            kill(second)
+        # With nothing listening any more the client compiles by itself
+        answer = client.compile('enum v-a = 3,')
+        assert answer['ok'] and 'STORE' in answer['optimized']
+        assert client.connection is None and client.local_cache is not None
+        with pytest.raises(OSError):
+            CompileClient(socket_path, fallback=False).compile('enum v-a = 3,')
+    finally:
+        client.close()
+        kill(first)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        os.rmdir(directory)
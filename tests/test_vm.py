@@ -0,0 +1,360 @@
+import json
+import pickle
+import threading
+import time
+
+import pytest
+
+from code_generator import CodeGenerator
+from jit import CompilingVirtualMachine
+from optimizer import Optimizer
+from pipeline import Pipeline
+from profiler import Profiler
+from program_generator import ProgramGenerator
+from tokenizer import tokenize
+from utils import create_enhanced_symbol_table
+from vm import (CANCELLED, COMPLETED, FAULT, INSTRUCTION_LIMIT, TIME_LIMIT, VirtualMachine,
+                VMState, decode, execute_assembly_code)
+
+# Every kind of instruction the code generator emits, and the leftovers
+# (comments, IF lines) that the Tk interpreter used to choke on
+EVERY_INSTRUCTION = "\n".join([
+    'CONST 0, "pooled"',
+    "; a comment",
+    "LOAD 6, r1",
+    "STORE r1, 1000",
+    "FLOAD 2.5, fr1",
+    "FSTORE fr1, 1004",
+    'STR "text", 1008',
+    "LDC 0, r2",
+    "STORE r2, 1012",
+    "IF v-a < 3 THEN",
+    "LOAD [1000], r1",
+    "MUL 7, r1, r1",
+    "SUB [1000], r1, r1",
+    "MOV r1, r3",
+    "STORE r3, 1016",
+    "LT 40, r3, r4",
+    "JZ r4, .L1",
+    "STR \"taken\", 1020",
+    ".L1:",
+    "PUSH [1000]",
+    "PUSH 4",
+    "CALL add, 2",
+    "STORE rv, 1024",
+    "HALT",
+    "add:",
+    "ENTER 4",
+    "LOAD [fp-8], r1",
+    "ADD [fp-4], r1, r1",
+    "STORE r1, fp+0",
+    "LOAD [fp+0], rv",
+    "RET",
+])
+
+COLLATZ = "\n".join([
+    "f-enum collatz(enum v-n) {",
+    "    enum v-steps = 0,",
+    "    whilst (v-n > 1) {",
+    "        iff (v-n / 2 * 2 == v-n) {",
+    "            v-n = v-n / 2,",
+    "        } orelse {",
+    "            v-n = 3 * v-n + 1,",
+    "        }",
+    "        v-steps = v-steps + 1,",
+    "    }",
+    "    ret v-steps,",
+    "}",
+    "enum v-x,",
+    "enum v-steps = collatz(v-x),",
+])
+
+# Runs until a limit stops it
+ENDLESS = "\n".join([
+    "enum v-a = 0,",
+    "enum v-b = 0,",
+    "whilst (1) {",
+    "    v-a = v-a + 1,",
+    "    v-b = v-a * 2,",
+    "}",
+])
+
+# Loop-heavy programs, with calls, branches, floats and strings in the loops
+LOOPS = [
+    "\n".join([
+        "enum v-total = 0,",
+        "iterate (enum v-i = 0, v-i < 50, v-i++,) {",
+        "    iterate (enum v-j = 0, v-j < 5, v-j++,) {",
+        "        v-total = v-total + v-j,",
+        "    }",
+        "}",
+    ]),
+    "\n".join([
+        "f-enum step(enum v-n) {",
+        "    iff (v-n > 10) {",
+        "        ret v-n - 7,",
+        "    }",
+        "    ret v-n + 3,",
+        "}",
+        "enum v-n = 0,",
+        "enum v-count = 0,",
+        "whilst (v-count < 40) {",
+        "    v-n = step(v-n),",
+        "    v-count = v-count + 1,",
+        "}",
+    ]),
+    "\n".join([
+        "efl v-x = 1.5,",
+        'estr v-label = "start",',
+        "iterate (enum v-i = 0, v-i < 20, v-i++,) {",
+        "    v-x = v-x * 1.5,",
+        '    v-label = "looped",',
+        "}",
+    ]),
+]
+
+
+def compile_at(source_code, level):
+    tokens, errors = tokenize(source_code)
+    assert not errors
+    code_generator = CodeGenerator()
+    code_generator.set_symbol_table(create_enhanced_symbol_table(tokens))
+    return Optimizer(level).optimize(code_generator.generate_code(tokens))
+
+
+def generated(seed):
+    return Pipeline(2).compile(ProgramGenerator(seed).generate(fragments=2))[1]
+
+
+def test_runs_every_instruction():
+    assert VirtualMachine(EVERY_INSTRUCTION).run().globals() == {
+        1000: 6, 1004: 2.5, 1008: 'text', 1012: 'pooled', 1016: 36, 1020: 'taken', 1024: 10}
+
+
+def test_decodes_once_and_reruns():
+    program = decode(EVERY_INSTRUCTION)
+    first = VirtualMachine(program).run().globals()
+    assert VirtualMachine(program).run().globals() == first
+
+
+def test_undefined_label_is_reported():
+    with pytest.raises(ValueError, match="'.L9'"):
+        decode("JMP .L9")
+
+
+@pytest.mark.parametrize('level', [0, 2])
+@pytest.mark.parametrize('source_code', LOOPS)
+def test_jit_matches_interpreter(source_code, level):
+    assembly_code = compile_at(source_code, level)
+    expected = VirtualMachine(assembly_code).run().globals()
+    # A threshold of one compiles every loop the first time round
+    vm = CompilingVirtualMachine(assembly_code, threshold=1)
+    assert vm.run().globals() == expected
+    assert vm.regions
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_jit_matches_interpreter_on_generated_programs(seed):
+    assembly_code = generated(seed)
+    expected = VirtualMachine(assembly_code).run().globals()
+    assert CompilingVirtualMachine(assembly_code, threshold=1).run().globals() == expected
+
+
+@pytest.mark.parametrize('source_code', LOOPS)
+def test_batch_matches_interpreter(source_code):
+    batch = pytest.importorskip('batch')
+    pytest.importorskip('numpy')
+    assembly_code = compile_at(source_code, 2)
+    expected = VirtualMachine(assembly_code).run().globals()
+    vm = batch.BatchVirtualMachine(assembly_code, size=3).run()
+    assert [vm.lane(index) for index in range(3)] == [expected] * 3
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_batch_matches_interpreter_on_generated_programs(seed):
+    batch = pytest.importorskip('batch')
+    pytest.importorskip('numpy')
+    assembly_code = generated(seed)
+    expected = VirtualMachine(assembly_code).run().globals()
+    vm = batch.BatchVirtualMachine(assembly_code, size=3).run()
+    assert [vm.lane(index) for index in range(3)] == [expected] * 3
+
+
+def test_batch_lanes_match_interpreter_runs_with_their_inputs():
+    batch = pytest.importorskip('batch')
+    pytest.importorskip('numpy')
+    inputs = [1, 6, 7, 27]
+    vm = batch.BatchVirtualMachine(compile_at(COLLATZ, 2), {1000: inputs}).run()
+    for index, value in enumerate(inputs):
+        # Each lane diverges in the loop; compare it with a scalar run of its record
+        scalar = compile_at(COLLATZ.replace("enum v-x,", f"enum v-x = {value},"), 2)
+        assert vm.lane(index) == VirtualMachine(scalar).run().globals()
+
+
+@pytest.mark.parametrize('level', [0, 1, 2, 3])
+@pytest.mark.parametrize('machine', [VirtualMachine, CompilingVirtualMachine])
+def test_stopped_endless_loop_reports_its_partial_state(machine, level):
+    result = machine(compile_at(ENDLESS, level), max_instructions=1000).run().result()
+    assert result.status == INSTRUCTION_LIMIT
+    assert set(result.globals) == {1000, 1004}
+    assert result.globals[1004] in (2 * result.globals[1000], 2 * (result.globals[1000] - 1))
+
+
+@pytest.mark.parametrize('machine', [VirtualMachine, CompilingVirtualMachine])
+def test_timeout_stops_an_endless_loop(machine):
+    result = machine(compile_at(ENDLESS, 2), timeout=0.1).run().result()
+    assert result.status == TIME_LIMIT
+
+
+def test_cancel_stops_an_unlimited_jit_run():
+    vm = CompilingVirtualMachine(compile_at(ENDLESS, 2), threshold=1)
+    thread = threading.Thread(target=vm.run, daemon=True)
+    thread.start()
+    time.sleep(0.2)  # Long enough for the loop to run compiled
+    vm.cancel()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert vm.regions
+    assert vm.status == CANCELLED
+
+
+@pytest.mark.parametrize('level', [0, 2])
+def test_division_by_zero_faults_with_partial_state(level):
+    source_code = "enum v-a = 0,\nenum v-b = 5 / v-a,"
+    vm = Pipeline(level).run(source_code)
+    result = vm.result()
+    assert result.status == FAULT
+    assert 'ZeroDivisionError' in result.message
+    assert result.source_line == 2
+    assert result.globals == {1000: 0}
+
+
+def test_fault_inside_a_compiled_loop_stops_where_the_interpreter_does():
+    assembly_code = compile_at("\n".join([
+        "enum v-a = 60,",
+        "enum v-b = 0,",
+        "whilst (1) {",
+        "    v-a = v-a - 1,",
+        "    v-b = 120 / v-a,",
+        "}",
+    ]), 2)
+    expected = VirtualMachine(assembly_code).run().result()
+    vm = CompilingVirtualMachine(assembly_code, threshold=1).run()
+    assert vm.regions
+    assert expected.status == vm.status == FAULT
+    assert (vm.pc, vm.result().globals) == (expected.pc, expected.globals)
+    assert expected.globals == {1000: 0, 1004: 120}
+
+
+def test_described_run_reports_a_fault_instead_of_raising():
+    # What the CLI and the Tk window print for a program that faults
+    output = execute_assembly_code(compile_at("enum v-a = 0,\nenum v-b = 5 / v-a,", 2),
+                                   timeout=5.0)
+    assert output.splitlines()[0] == "Memory[1000] = 0"
+    assert output.splitlines()[-1].startswith("Fault at line 2: ZeroDivisionError")
+
+
+def collatz_steps(value):
+    """The globals a run of COLLATZ on value ends with."""
+    return VirtualMachine(compile_at(COLLATZ.replace("enum v-x,", f"enum v-x = {value},"), 2)
+                          ).run().globals()
+
+
+def stopped_in_collatz(value=27):
+    """A machine stopped inside the collatz call, with its input already set."""
+    vm = VirtualMachine(compile_at(COLLATZ, 2), max_instructions=300)
+    vm.set_global(1000, value)
+    vm.run()
+    assert vm.status == INSTRUCTION_LIMIT and vm.call_stack
+    return vm
+
+
+def test_restored_snapshot_finishes_like_an_uninterrupted_run():
+    stopped = stopped_in_collatz()
+    state = stopped.snapshot()
+    resumed = VirtualMachine(stopped.program).restore(state).run()
+    assert resumed.status == COMPLETED
+    assert resumed.globals() == collatz_steps(27)
+    # Running on changes the machine, not the state it was restored from
+    assert VirtualMachine(stopped.program).restore(state).snapshot().as_dict() == state.as_dict()
+    stopped.restore(state)
+    stopped.max_instructions = None
+    assert stopped.run().globals() == resumed.globals()
+
+
+def test_snapshot_survives_json_and_pickle():
+    state = stopped_in_collatz().snapshot()
+    for copied in (VMState.from_dict(json.loads(json.dumps(state.as_dict()))),
+                   pickle.loads(pickle.dumps(state))):
+        assert copied.as_dict() == state.as_dict()
+        program = decode(compile_at(COLLATZ, 2))
+        assert VirtualMachine(program).restore(copied).run().globals() == collatz_steps(27)
+
+
+def test_forks_with_different_inputs_leave_each_other_and_the_base_alone():
+    base = VirtualMachine(compile_at(COLLATZ, 2))
+    state = base.snapshot()
+    first, second = base.fork(state), base.fork(state)
+    first.set_global(1000, 6)
+    second.set_global(1000, 27)
+    assert first.run().globals() == collatz_steps(6)
+    assert second.run().globals() == collatz_steps(27)
+    assert base.globals() == {} and base.snapshot().as_dict() == state.as_dict()
+    assert (first.get_global(1000), second.get_global(1000), state.read(0)) == (6, 27, 0)
+
+
+def test_snapshot_of_a_fork_carries_its_own_writes():
+    fork = VirtualMachine(compile_at(COLLATZ, 2)).fork(max_instructions=300)
+    fork.set_global(1000, 27)
+    fork.run()
+    assert fork.status == INSTRUCTION_LIMIT
+    state = fork.snapshot()
+    assert state.read(0) == 27
+    assert VirtualMachine(fork.program).restore(state).run().globals() == collatz_steps(27)
+    # ...and a fork of that snapshot finishes the same way
+    assert fork.fork(state).run().globals() == collatz_steps(27)
+
+
+# Counts up to 5; every line's share of the work is known
+COUNT_TO_FIVE = "\n".join([
+    "; line 1",
+    "LOAD 0, r1",
+    "STORE r1, 1000",
+    "; line 2",
+    ".L1:",
+    "LOAD [1000], r1",
+    "ADD 1, r1, r1",
+    "STORE r1, 1000",
+    "; line 3",
+    "LT 5, r1, r2",
+    "JNZ r2, .L1",
+    "HALT",
+])
+
+
+def test_profiler_counts_every_instruction_and_attributes_it_to_its_line():
+    profiler = Profiler(COUNT_TO_FIVE).run()
+    assert profiler.vm.status == COMPLETED
+    assert profiler.counts == [1, 1, 5, 5, 5, 5, 5, 1]
+    assert {line: executed for line, (executed, _) in
+            profiler.source_line_statistics().items()} == {1: 2, 2: 15, 3: 11}
+    assert [(start, executions) for start, _, executions, _ in
+            sorted(profiler.block_statistics())] == [(0, 1), (2, 5), (7, 1)]
+
+
+def test_collapsed_stacks_follow_calls():
+    profiler = Profiler(compile_at(COLLATZ.replace("enum v-x,", "enum v-x = 6,"), 2)).run()
+    stacks = dict(line.rsplit(' ', 1) for line in profiler.collapsed_stacks().splitlines())
+    assert sum(int(count) for count in stacks.values()) == sum(profiler.counts)
+    assert any(stack.startswith('main;collatz;line ') for stack in stacks)
+    assert any(stack.startswith('main;line ') for stack in stacks)
+    assert all(stack.count(';') <= 2 for stack in stacks)
+
+
+def test_profiled_run_faults_like_an_unprofiled_one():
+    assembly_code = compile_at("enum v-a = 0,\nenum v-b = 5 / v-a,", 2)
+    expected = VirtualMachine(assembly_code).run().result()
+    profiler = Profiler(assembly_code).run()
+    result = profiler.vm.result()
+    assert (result.status, result.pc, result.globals) == (FAULT, expected.pc, expected.globals)
+    assert profiler.counts[result.pc] == 1 and sum(profiler.counts) == result.pc + 1
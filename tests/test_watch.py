@@ -0,0 +1,39 @@
+from watch import Watcher
+
+FIRST = "enum v-a = 1,\n"
+SECOND = "enum v-b = 2,\nv-b = v-b * 3,\n"
+
+
+def test_only_changed_files_are_compiled_again(tmp_path):
+    first, second = tmp_path / 'first.enigma', tmp_path / 'second.enigma'
+    first.write_text(FIRST)
+    second.write_text(SECOND)
+    reports = []
+    watcher = Watcher([str(tmp_path)], report=reports.append)
+    assert watcher.poll() == [str(first), str(second)]
+    assert watcher.poll() == []
+
+    first.write_text(FIRST + "enum v-c = 3,\n")
+    assert watcher.poll() == [str(first)]
+    assert '(cached)' not in reports[-1]
+
+    # Undoing the edit finds the earlier artifacts by content
+    first.write_text(FIRST)
+    assert watcher.poll() == [str(first)]
+    assert '(cached)' in reports[-1]
+    assert watcher.cache.statistics()['hits'] == 1
+
+
+def test_failed_run_is_reported_and_watching_goes_on(tmp_path):
+    program = tmp_path / 'program.enigma'
+    program.write_text("enum v-a = 0,\nenum v-b = 5 / v-a,\n")
+    reports = []
+    watcher = Watcher([str(tmp_path)], run=True, report=reports.append)
+    assert watcher.poll() == [str(program)]
+    assert watcher.files[str(program)].status == 'runtime error'
+    assert 'ZeroDivisionError' in reports[-1] and str(program) in reports[-1]
+
+    program.write_text("enum v-a = 2,\nenum v-b = 5 / v-a,\n")
+    assert watcher.poll() == [str(program)]
+    assert watcher.files[str(program)].status == 'ok'
+    assert reports[-1] == "Memory[1000] = 2\nMemory[1004] = 2"
@@ -6,11 +6,13 @@ TOKEN_PATTERNS = [
     ('BOOLEAN_VAL', r'\b(yup|nah)\b'),
     ('FUNCTION_DEF',
      r'\bf-(none|enum|efl|estr|ebool)\s+[a-zA-Z][_a-zA-Z0-9]*\b'),
+    # import <module>, makes the globals and functions of another module visible
+    ('IMPORT', r'\bimport[ \t]+[a-zA-Z][_a-zA-Z0-9]*\b'),
     ('VARIABLE', r'\bv-[a-zA-Z][_a-zA-Z0-9]*\b'),
     ('NUMBER', r'\b\d+(\.\d+)?\b'),
     ('STRING', r'"[^"]*"'),
     ('COMMENT', r'//.*'),
-    ('ASSIGN', r'='),
+    ('ASSIGN', r'=(?!=)'),  # '==' is a comparison, not two assignments
     ('OPERATOR', r'[\+\-\*/<>=!]+'),
     ('INCREMENT', r'\+\+'),  # Pattern to match the increment operator
     ('DECREMENT', r'--'),    # Pattern to match the decrement operator
@@ -24,6 +26,10 @@ TOKEN_PATTERNS = [
     ('WHILST', r'\bwhilst\b'),
     ('BR', r'\bbr\b'),
     ('CONT', r'\bcont\b'),
+    ('RETURN', r'\bret\b'),
+    # A bare identifier directly followed by '(' is a call; keywords such as
+    # iff/whilst are matched by the patterns above first
+    ('FUNCTION_CALL', r'\b[a-zA-Z][_a-zA-Z0-9]*(?=\s*\()'),
     ('LPAREN', r'\('),
     ('RPAREN', r'\)'),
     ('LCURLY', r'\{'),
@@ -3,11 +3,41 @@ def create_enhanced_symbol_table(tokens):
     symbol_table = {}
     scope = "global"
     memory_location = 1000
+    frame_offset = 0
+    brace_depth = 0
+    function_depth = 0
 
     i = 0
     while i < len(tokens):
         token = tokens[i]
-        if token['type'] == 'DATATYPE':
+        if token['type'] == 'FUNCTION_DEF':
+            # Locals of a function live in its frame and are keyed by scope so
+            # they cannot collide with globals of the same name
+            scope = token['value'].split()[1]
+            function_depth = brace_depth
+            frame_offset = 0
+            parameters = []
+            i += 1
+            while i < len(tokens) and tokens[i]['type'] != 'RPAREN':
+                if tokens[i]['type'] == 'DATATYPE' and i + 1 < len(tokens):
+                    parameters.append((tokens[i]['value'], tokens[i + 1]['value']))
+                    i += 1
+                i += 1
+            for index, (data_type, variable_name) in enumerate(parameters):
+                symbol_table[f"{scope}::{variable_name}"] = {
+                    'Identifier': variable_name,
+                    'Data Type': data_type,
+                    'Value': None,
+                    'Scope': scope,
+                    'Memory Location': f"fp-{4 * (len(parameters) - index)}"
+                }
+        elif token['type'] == 'LCURLY':
+            brace_depth += 1
+        elif token['type'] == 'RCURLY':
+            brace_depth -= 1
+            if scope != "global" and brace_depth == function_depth:
+                scope = "global"
+        elif token['type'] == 'DATATYPE':
             if i + 1 < len(tokens) and tokens[i + 1]['type'] == 'VARIABLE':
                 data_type = token['value']
                 variable_name = tokens[i + 1]['value']
@@ -17,23 +47,32 @@ def create_enhanced_symbol_table(tokens):
                     i += 1
                     if i < len(tokens) and tokens[i]['type'] in ('NUMBER', 'STRING', 'BOOLEAN_VAL', 'VARIABLE'):
                         value = tokens[i]['value']
-                if variable_name not in symbol_table:
-                    symbol_table[variable_name] = {
+                key = variable_name if scope == "global" else f"{scope}::{variable_name}"
+                if key not in symbol_table:
+                    if scope == "global":
+                        location = memory_location
+                        memory_location += 4
+                    else:
+                        location = f"fp+{frame_offset}"
+                        frame_offset += 4
+                    symbol_table[key] = {
                         'Identifier': variable_name,
                         'Data Type': data_type,
                         'Value': value,
                         'Scope': scope,
-                        'Memory Location': memory_location
+                        'Memory Location': location
                     }
-                    memory_location += 4
         elif token['type'] == 'VARIABLE':
             # Handle variable assignments
             variable_name = token['value']
-            if variable_name in symbol_table and i + 1 < len(tokens) and tokens[i + 1]['type'] == 'ASSIGN':
+            key = f"{scope}::{variable_name}"
+            if key not in symbol_table:
+                key = variable_name
+            if key in symbol_table and i + 1 < len(tokens) and tokens[i + 1]['type'] == 'ASSIGN':
                 i += 2
                 if i < len(tokens) and tokens[i]['type'] in ('NUMBER', 'STRING', 'BOOLEAN_VAL', 'VARIABLE'):
                     value = tokens[i]['value']
-                    symbol_table[variable_name]['Value'] = value
+                    symbol_table[key]['Value'] = value
         i += 1
     return symbol_table
 
@@ -0,0 +1,737 @@
+import base64
+import re
+import time
+
+from assembly import (ALU_OPERATIONS, TERMINATOR_OPCODES, Instruction, is_register,
+                      parse_literal, split_operands)
+
+# Globals are laid out from here; the stack starts right after the last one
+GLOBAL_BASE = 1000
+# The instruction set steps addresses by 4. Every such slot is one 8-byte
+# cell of linear memory so it can hold a full enum or efl.
+ADDRESS_STEP = 4
+CELL_SIZE = 8
+INITIAL_STACK_CELLS = 1024
+# What a cell currently holds; estr cells hold a handle into the string table
+EMPTY, INT, FLOAT, STRING = range(4)
+# How a run ended: the program finished, or one of its limits stopped it
+COMPLETED = 'completed'
+INSTRUCTION_LIMIT = 'instruction limit'
+TIME_LIMIT = 'time limit'
+MEMORY_LIMIT = 'memory limit'
+CANCELLED = 'cancelled'
+# ... or an instruction failed on its operands, e.g. a division by zero
+FAULT = 'fault'
+# What a failing instruction can raise; anything else is a bug in the VM
+RUNTIME_ERRORS = (ArithmeticError, TypeError)
+# Comment the code generator puts ahead of the code for each Enigma line
+SOURCE_LINE_REGEX = re.compile(r'^; line (\d+)$')
+
+# Handler of every opcode, by the kind of operand it reads ('immediate',
+# 'register', 'memory' or 'frame'). Choosing the handler once at decode time
+# keeps operand inspection out of the execution loop.
+LOAD_HANDLERS = {
+    'immediate': '_load_immediate', 'register': '_load_register',
+    'memory': '_load_memory', 'frame': '_load_frame',
+}
+ALU_HANDLERS = {
+    'immediate': '_alu_immediate', 'register': '_alu_register',
+    'memory': '_alu_memory', 'frame': '_alu_frame',
+}
+PUSH_HANDLERS = {
+    'immediate': '_push_immediate', 'register': '_push_register',
+    'memory': '_push_memory', 'frame': '_push_frame',
+}
+# Stores are chosen by the kind of address they write
+STORE_HANDLERS = {'memory': '_store_memory', 'frame': '_store_frame'}
+STORE_LITERAL_HANDLERS = {'memory': '_store_literal_memory', 'frame': '_store_literal_frame'}
+
+
+def cell_of(address):
+    """Cell index of an absolute address, or of an fp offset when relative."""
+    if address % ADDRESS_STEP:
+        raise ValueError(f"Misaligned address {address}")
+    return address // ADDRESS_STEP
+
+
+def decode_address(address):
+    """('frame', cell offset) for fp+N / fp-N, ('memory', cell) otherwise."""
+    if address.startswith('fp'):
+        return 'frame', cell_of(int(address[2:]))
+    address = int(address)
+    if address < GLOBAL_BASE:
+        raise ValueError(f"Address {address} is below the data area")
+    return 'memory', cell_of(address - GLOBAL_BASE)
+
+
+class Program:
+    """Assembly decoded once for the VirtualMachine.
+
+    Every instruction becomes a (handler, operands) tuple with labels
+    resolved to instruction offsets, pool constants to their values,
+    registers to register file indices and addresses to memory cells.
+    For every instruction, lines holds its line in the assembly, texts the
+    assembly itself and source_lines the Enigma line it came from (None
+    when the code generator left no marker).
+    """
+
+    def __init__(self, instructions, lines, labels, registers, stack_cell,
+                 texts=None, source_lines=None):
+        self.instructions = instructions
+        self.lines = lines
+        self.texts = texts or []
+        self.source_lines = source_lines or [None] * len(instructions)
+        self.labels = labels
+        self.registers = registers  # Register names, by index; rv is 0
+        self.stack_cell = stack_cell
+
+    @property
+    def stack_base(self):
+        return GLOBAL_BASE + self.stack_cell * ADDRESS_STEP
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def block_leaders(self):
+        """Sorted offsets where basic blocks start: the entry, every label and
+        every instruction after a jump, branch, RET or HALT."""
+        leaders = {0} | set(self.labels.values())
+        for index, text in enumerate(self.texts):
+            instruction = Instruction(text)
+            if instruction.opcode in TERMINATOR_OPCODES or instruction.branch_target() is not None:
+                leaders.add(index + 1)
+        return sorted(leader for leader in leaders if leader < len(self))
+
+
+def decode(assembly_code):
+    parsed = []
+    labels = {}
+    constants = {}
+    source_line = None
+    for line_number, line in enumerate(assembly_code.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith(';'):
+            marker = SOURCE_LINE_REGEX.match(line)
+            if marker is not None:
+                source_line = int(marker.group(1))
+            continue
+        if line.endswith(':'):
+            labels[line[:-1]] = len(parsed)
+            continue
+        opcode, _, operand_text = line.partition(' ')
+        operands = split_operands(operand_text.strip())
+        if opcode == 'CONST':
+            constants[int(operands[0])] = parse_literal(operands[1])
+        elif opcode != 'IF':  # Left over from before conditions were lowered to jumps
+            parsed.append((opcode, operands, line_number, line, source_line))
+
+    def target(label):
+        if label not in labels:
+            raise ValueError(f"Undefined label '{label}'")
+        return labels[label]
+
+    registers = {'rv': 0}
+
+    def register(name):
+        return registers.setdefault(name, len(registers))
+
+    static_cells = [-1]
+
+    def destination(text):
+        kind, value = decode_address(text)
+        if kind == 'memory':
+            static_cells.append(value)
+        return kind, value
+
+    def source(text):
+        if is_register(text):
+            return 'register', register(text)
+        if text.startswith('['):
+            return destination(text[1:-1])
+        return 'immediate', parse_literal(text)
+
+    instructions = []
+    for opcode, operands, line_number, _, _ in parsed:
+        if opcode in ('LOAD', 'FLOAD', 'MOV'):
+            kind, value = source(operands[0])
+            name, arguments = LOAD_HANDLERS[kind], (value, register(operands[1]))
+        elif opcode == 'LDC':
+            # The pool is read-only, so a constant load is just an immediate
+            name, arguments = '_load_immediate', (
+                constants[int(operands[0])], register(operands[1]))
+        elif opcode in ('STORE', 'FSTORE'):
+            kind, value = destination(operands[1])
+            name, arguments = STORE_HANDLERS[kind], (register(operands[0]), value)
+        elif opcode == 'STR':
+            kind, value = destination(operands[1])
+            name, arguments = STORE_LITERAL_HANDLERS[kind], (parse_literal(operands[0]), value)
+        elif opcode in ALU_OPERATIONS:
+            kind, value = source(operands[0])
+            name = ALU_HANDLERS[kind]
+            arguments = (ALU_OPERATIONS[opcode], value,
+                         register(operands[1]), register(operands[2]))
+        elif opcode == 'PUSH':
+            kind, value = source(operands[0])
+            name, arguments = PUSH_HANDLERS[kind], (value,)
+        elif opcode == 'CALL':
+            argument_count = int(operands[1]) if len(operands) > 1 else 0
+            name, arguments = '_call', (target(operands[0]), argument_count)
+        elif opcode == 'ENTER':
+            name, arguments = '_enter', (int(operands[0]),)
+        elif opcode == 'RET':
+            name, arguments = '_return', ()
+        elif opcode == 'JMP':
+            name, arguments = '_jump', (target(operands[0]),)
+        elif opcode == 'JZ':
+            name, arguments = '_jump_if_zero', (register(operands[0]), target(operands[1]))
+        elif opcode == 'JNZ':
+            name, arguments = '_jump_if_not_zero', (register(operands[0]), target(operands[1]))
+        elif opcode == 'HALT':
+            name, arguments = '_halt', ()
+        else:
+            raise ValueError(f"Unknown instruction '{opcode}' on line {line_number}")
+        instructions.append((getattr(VirtualMachine, name), arguments))
+    return Program(instructions, [entry[2] for entry in parsed], labels,
+                   list(registers), max(static_cells) + 1,
+                   [entry[3] for entry in parsed], [entry[4] for entry in parsed])
+
+
+class ExecutionResult:
+    """How a run ended and the state it left behind.
+
+    status is COMPLETED, CANCELLED, FAULT or the limit that stopped the run;
+    pc and source_line say where it stopped, so a stopped run still reports
+    its partial globals. message says what went wrong in a faulted run.
+    """
+
+    def __init__(self, status, instructions, seconds, pc, source_line, globals,
+                 message=None):
+        self.status = status
+        self.instructions = instructions  # None unless the run was limited
+        self.seconds = seconds
+        self.pc = pc
+        self.source_line = source_line
+        self.globals = globals
+        self.message = message
+
+    @property
+    def completed(self):
+        return self.status == COMPLETED
+
+    def as_dict(self):
+        return {'status': self.status, 'instructions': self.instructions,
+                'seconds': self.seconds, 'pc': self.pc, 'source_line': self.source_line,
+                'globals': self.globals, 'message': self.message}
+
+    def describe(self):
+        if self.completed:
+            return "Completed"
+        where = f"line {self.source_line}" if self.source_line is not None else f"offset {self.pc}"
+        if self.status == FAULT:
+            return f"Fault at {where}: {self.message}"
+        cause = "Cancelled" if self.status == CANCELLED else f"Stopped by the {self.status}"
+        count = f"{self.instructions} instructions and " if self.instructions is not None else ""
+        return f"{cause} at {where} after {count}{self.seconds:.3f}s"
+
+
+class VMState:
+    """Everything a VirtualMachine needs to carry on from one point.
+
+    States are immutable: memory and tags are bytes and the register file
+    and call stack tuples, so one state can seed any number of machines
+    and survives pickling or as_dict()/from_dict() unchanged. A state does
+    not record its Program; restore it into a machine running the same one.
+    """
+
+    def __init__(self, pc, registers, fp, sp, call_stack, memory, tags, strings,
+                 executed=0):
+        self.pc = pc
+        self.registers = registers
+        self.fp = fp
+        self.sp = sp
+        self.call_stack = call_stack  # (return pc, fp, sp, registers) per frame
+        self.memory = memory
+        self.tags = tags
+        self.strings = strings
+        self.executed = executed
+        self.ints = memoryview(memory).cast('q')
+        self.floats = memoryview(memory).cast('d')
+
+    def __reduce__(self):
+        return VMState, (self.pc, self.registers, self.fp, self.sp, self.call_stack,
+                         self.memory, self.tags, self.strings, self.executed)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def read(self, cell):
+        """The value of a cell, as VirtualMachine._read would return it."""
+        if cell >= len(self.tags):
+            return 0
+        tag = self.tags[cell]
+        if tag == FLOAT:
+            return self.floats[cell]
+        value = self.ints[cell]
+        return self.strings[value] if tag == STRING else value
+
+    def as_dict(self):
+        return {'pc': self.pc, 'registers': list(self.registers), 'fp': self.fp, 'sp': self.sp,
+                'call_stack': [[pc, fp, sp, list(registers)]
+                               for pc, fp, sp, registers in self.call_stack],
+                'memory': base64.b64encode(self.memory).decode('ascii'),
+                'tags': base64.b64encode(self.tags).decode('ascii'),
+                'strings': list(self.strings), 'executed': self.executed}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['pc'], tuple(data['registers']), data['fp'], data['sp'],
+                   tuple((pc, fp, sp, tuple(registers))
+                         for pc, fp, sp, registers in data['call_stack']),
+                   base64.b64decode(data['memory']), base64.b64decode(data['tags']),
+                   tuple(data['strings']), data['executed'])
+
+
+class VirtualMachine:
+    """Runs a decoded Program.
+
+    Memory is one linear bytearray of 8-byte cells, read and written
+    through 'q' and 'd' memoryview casts, with a byte per cell recording
+    which view holds its value. Globals fill the first cells and the stack
+    grows after them. fp and sp are cell indices. Registers live in a list
+    indexed as the Program numbered them.
+
+    CALL pushes the return offset, fp, the caller's sp and a copy of the
+    register file onto the call stack; RET restores them but keeps rv.
+
+    max_instructions, timeout (in seconds) and max_cells bound a run. They
+    are only checked at backward jumps and calls, the only ways a program
+    can run for unbounded time, so a run may overshoot a limit by one
+    straight stretch of code. A run without limits uses a loop with no
+    checks at all.
+
+    An instruction that fails on its operands, such as a division by zero,
+    ends the run with status FAULT; pc is left on that instruction and the
+    registers and memory as it found them.
+    """
+
+    def __init__(self, program, max_instructions=None, timeout=None, max_cells=None):
+        if isinstance(program, str):
+            program = decode(program)
+        self.program = program
+        self.memory = bytearray()
+        self.tags = bytearray()
+        self.ints = self.floats = None
+        self._resize(program.stack_cell + INITIAL_STACK_CELLS)
+        self.strings = []  # String table; STRING cells hold an index into it
+        self.string_handles = {}
+        self.registers = [0] * len(program.registers)
+        self.call_stack = []
+        self.fp = self.sp = program.stack_cell
+        self.pc = 0
+        self.running = False
+        self.max_instructions = max_instructions
+        self.timeout = timeout
+        self.max_cells = max_cells
+        self.executed = 0  # Only counted when the run is limited
+        self.segment_start = 0  # Where straight-line execution last resumed
+        self.checked_instructions = None
+        self.deadline = None
+        self.seconds = 0.0
+        self.status = None
+        self.fault = None  # What stopped a FAULT run
+        self.cancelled = False
+
+    @property
+    def limited(self):
+        return (self.max_instructions is not None or self.timeout is not None
+                or self.max_cells is not None)
+
+    def run(self):
+        started = time.perf_counter()
+        self.status = self.fault = None
+        if self.limited:
+            self._start_clock()
+            self.segment_start = self.pc
+        # running is raised here rather than in _run so that a cancel() from
+        # another thread is never lost, whenever it arrives
+        self.running = not self.cancelled
+        try:
+            self._run(self._instruction_table())
+        except RUNTIME_ERRORS as e:
+            self.running = False
+            self.status = FAULT
+            self.fault = f"{type(e).__name__}: {e}"
+        if self.limited:
+            self.executed += self.pc - self.segment_start  # Ran off the end
+            self.segment_start = self.pc
+        if self.status == FAULT:
+            # pc had already moved past the instruction that failed
+            self.pc -= 1
+            self.segment_start = self.pc
+        self.seconds += time.perf_counter() - started
+        if self.cancelled and self.status != FAULT:
+            self.status = CANCELLED
+        elif self.status is None:
+            self.status = COMPLETED
+        return self
+
+    def cancel(self):
+        """Stop the run at the next instruction; safe to call from another thread.
+
+        The machine keeps its state, so a cancelled run can still be
+        inspected, snapshotted or restored.
+        """
+        self.cancelled = True
+        self.running = False
+
+    def _run(self, instructions):
+        end = len(instructions)
+        while self.running and self.pc < end:
+            handler, arguments = instructions[self.pc]
+            self.pc += 1
+            handler(self, *arguments)
+        self.running = False
+
+    def _instruction_table(self):
+        """The decoded instructions, with every control transfer routed
+        through _transfer when the run is limited."""
+        if not self.limited:
+            return self.program.instructions
+        if self.checked_instructions is None:
+            self.checked_instructions = [
+                (VirtualMachine._transfer, (index, handler, arguments))
+                if handler in TRANSFER_HANDLERS else (handler, arguments)
+                for index, (handler, arguments) in enumerate(self.program.instructions)]
+        return self.checked_instructions
+
+    def _transfer(self, index, handler, arguments):
+        # Code between two transfers runs straight through, so counting it
+        # here keeps the instruction count exact without a per-instruction
+        # counter. Only backward jumps and calls can repeat code, so the
+        # limits are only checked after those.
+        handler(self, *arguments)
+        self.executed += index + 1 - self.segment_start
+        self.segment_start = self.pc
+        if (self.pc <= index or handler is VirtualMachine._call) and self._limit_reached():
+            self.running = False
+
+    def _start_clock(self):
+        if self.timeout is not None:
+            self.deadline = time.monotonic() + self.timeout
+
+    def _limit_reached(self):
+        """Record the limit the run has reached, if any."""
+        if self.max_instructions is not None and self.executed >= self.max_instructions:
+            self.status = INSTRUCTION_LIMIT
+        elif self.max_cells is not None and self.sp > self.max_cells:
+            self.status = MEMORY_LIMIT
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.status = TIME_LIMIT
+        return self.status is not None
+
+    def snapshot(self):
+        """The machine's current state as a VMState; costs one copy of memory."""
+        return VMState(self.pc, tuple(self.registers), self.fp, self.sp,
+                       tuple((pc, fp, sp, tuple(registers))
+                             for pc, fp, sp, registers in self.call_stack),
+                       bytes(self.memory), bytes(self.tags), tuple(self.strings),
+                       self.executed)
+
+    def restore(self, state):
+        """Carry on from state, discarding everything since."""
+        self.ints.release()
+        self.floats.release()
+        self.memory = bytearray(state.memory)
+        self.tags = bytearray(state.tags)
+        self.ints = memoryview(self.memory).cast('q')
+        self.floats = memoryview(self.memory).cast('d')
+        self.strings = list(state.strings)
+        self.string_handles = {string: handle for handle, string in enumerate(self.strings)}
+        self.pc, self.fp, self.sp = state.pc, state.fp, state.sp
+        self.registers = list(state.registers)
+        self.call_stack = [(pc, fp, sp, list(registers))
+                           for pc, fp, sp, registers in state.call_stack]
+        self.executed = state.executed
+        self.segment_start = self.pc
+        self.status = self.fault = None
+        self.cancelled = False
+        return self
+
+    def fork(self, state=None, **limits):
+        """A ForkedVirtualMachine carrying on from state (by default, from now).
+
+        Take one snapshot and fork it as often as needed: every fork reads
+        the snapshot's memory and only keeps the cells it writes itself.
+        """
+        return ForkedVirtualMachine(self.program, state or self.snapshot(), **limits)
+
+    def get_global(self, address):
+        return self._read(cell_of(address - GLOBAL_BASE))
+
+    def set_global(self, address, value):
+        """Overwrite a global, e.g. to give a fork different inputs."""
+        self._write(cell_of(address - GLOBAL_BASE), value)
+
+    def result(self):
+        source_line = self.program.source_lines[self.pc] if self.pc < len(self.program) else None
+        return ExecutionResult(self.status, self.executed if self.limited else None,
+                               self.seconds, self.pc, source_line, self.globals(),
+                               self.fault)
+
+    def globals(self):
+        """The static data area: address -> value, in address order."""
+        return {GLOBAL_BASE + cell * ADDRESS_STEP: self._read(cell)
+                for cell in range(self.program.stack_cell) if self.tags[cell] != EMPTY}
+
+    def memory_dump(self):
+        return "\n".join(
+            f'Memory[{address}] = "{value}"' if isinstance(value, str) else f"Memory[{address}] = {value}"
+            for address, value in self.globals().items())
+
+    def _resize(self, cells):
+        # A bytearray cannot change size while views of it are alive
+        if self.ints is not None:
+            self.ints.release()
+            self.floats.release()
+        self.memory.extend(bytes((cells - len(self.tags)) * CELL_SIZE))
+        self.tags.extend(bytes(cells - len(self.tags)))
+        self.ints = memoryview(self.memory).cast('q')
+        self.floats = memoryview(self.memory).cast('d')
+
+    def _reserve(self, cells):
+        """Make sure the stack can grow by cells past sp."""
+        if self.sp + cells > len(self.tags):
+            self._resize(max(2 * len(self.tags), self.sp + cells))
+
+    def _read(self, cell):
+        tag = self.tags[cell]
+        if tag == FLOAT:
+            return self.floats[cell]
+        value = self.ints[cell]
+        return self.strings[value] if tag == STRING else value
+
+    def _write(self, cell, value):
+        kind = type(value)
+        if kind is float:
+            self.floats[cell] = value
+            self.tags[cell] = FLOAT
+        elif kind is str:
+            handle = self.string_handles.get(value)
+            if handle is None:
+                handle = self.string_handles[value] = len(self.strings)
+                self.strings.append(value)
+            self.ints[cell] = handle
+            self.tags[cell] = STRING
+        else:
+            try:
+                self.ints[cell] = value
+            except ValueError:
+                # enum cells are 64-bit and wrap around like machine words
+                self.ints[cell] = (value + (1 << 63)) % (1 << 64) - (1 << 63)
+            self.tags[cell] = INT
+
+    def _load_immediate(self, value, destination):
+        self.registers[destination] = value
+
+    def _load_register(self, source, destination):
+        self.registers[destination] = self.registers[source]
+
+    def _load_memory(self, cell, destination):
+        self.registers[destination] = self._read(cell)
+
+    def _load_frame(self, offset, destination):
+        self.registers[destination] = self._read(self.fp + offset)
+
+    def _store_memory(self, source, cell):
+        self._write(cell, self.registers[source])
+
+    def _store_frame(self, source, offset):
+        self._write(self.fp + offset, self.registers[source])
+
+    def _store_literal_memory(self, value, cell):
+        self._write(cell, value)
+
+    def _store_literal_frame(self, value, offset):
+        self._write(self.fp + offset, value)
+
+    def _alu_immediate(self, operation, value, left, destination):
+        registers = self.registers
+        registers[destination] = operation(registers[left], value)
+
+    def _alu_register(self, operation, source, left, destination):
+        registers = self.registers
+        registers[destination] = operation(registers[left], registers[source])
+
+    def _alu_memory(self, operation, cell, left, destination):
+        registers = self.registers
+        registers[destination] = operation(registers[left], self._read(cell))
+
+    def _alu_frame(self, operation, offset, left, destination):
+        registers = self.registers
+        registers[destination] = operation(registers[left], self._read(self.fp + offset))
+
+    def _push_immediate(self, value):
+        self._reserve(1)
+        self._write(self.sp, value)
+        self.sp += 1
+
+    def _push_register(self, source):
+        self._push_immediate(self.registers[source])
+
+    def _push_memory(self, cell):
+        self._push_immediate(self._read(cell))
+
+    def _push_frame(self, offset):
+        self._push_immediate(self._read(self.fp + offset))
+
+    def _call(self, target, argument_count):
+        # Arguments stay where the caller pushed them and become the
+        # callee's fp-relative parameters
+        self.call_stack.append(
+            (self.pc, self.fp, self.sp - argument_count, list(self.registers)))
+        self.pc = target
+
+    def _enter(self, size):
+        cells = size // ADDRESS_STEP
+        self._reserve(cells)
+        self.fp = self.sp
+        self.sp += cells
+
+    def _return(self):
+        if not self.call_stack:
+            self.running = False
+            return
+        result = self.registers[0]
+        self.pc, self.fp, self.sp, self.registers = self.call_stack.pop()
+        self.registers[0] = result
+
+    def _jump(self, target):
+        self.pc = target
+
+    def _jump_if_zero(self, register, target):
+        if not self.registers[register]:
+            self.pc = target
+
+    def _jump_if_not_zero(self, register, target):
+        if self.registers[register]:
+            self.pc = target
+
+    def _halt(self):
+        self.running = False
+
+
+class ForkedVirtualMachine(VirtualMachine):
+    """A VirtualMachine sharing the memory of the VMState it started from.
+
+    Reads fall through to the state's image unless the fork has written
+    the cell since; writes go to a dict of the fork's own cells. Forking
+    therefore copies nothing, and each fork costs memory in proportion to
+    the cells it changes rather than to the whole image.
+    """
+
+    def __init__(self, program, state, **limits):
+        super().__init__(program, **limits)
+        self.restore(state)
+
+    def restore(self, state):
+        self.base = state
+        self.written = {}  # Cell -> value, for every cell written since the fork
+        self.strings = list(state.strings)
+        self.pc, self.fp, self.sp = state.pc, state.fp, state.sp
+        self.registers = list(state.registers)
+        self.call_stack = [(pc, fp, sp, list(registers))
+                           for pc, fp, sp, registers in state.call_stack]
+        self.executed = state.executed
+        self.segment_start = self.pc
+        self.status = self.fault = None
+        self.cancelled = False
+        return self
+
+    def snapshot(self):
+        # Fold the fork's own cells into a full image of its own
+        machine = VirtualMachine(self.program).restore(self.base)
+        if self.written and max(self.written) >= len(machine.tags):
+            machine._resize(max(self.written) + 1)
+        for cell, value in self.written.items():
+            machine._write(cell, value)
+        machine.pc, machine.fp, machine.sp = self.pc, self.fp, self.sp
+        machine.registers = list(self.registers)
+        machine.call_stack = self.call_stack
+        machine.executed = self.executed
+        return machine.snapshot()
+
+    def globals(self):
+        cells = sorted({cell for cell in range(min(self.program.stack_cell, len(self.base)))
+                        if self.base.tags[cell] != EMPTY}
+                       | {cell for cell in self.written if cell < self.program.stack_cell})
+        return {GLOBAL_BASE + cell * ADDRESS_STEP: self._read(cell) for cell in cells}
+
+    def _resize(self, cells):
+        pass  # The fork's cells live in a dict, which grows by itself
+
+    def _read(self, cell):
+        if cell in self.written:
+            return self.written[cell]
+        return self.base.read(cell)
+
+    def _write(self, cell, value):
+        if type(value) is int and not -(1 << 63) <= value < (1 << 63):
+            value = (value + (1 << 63)) % (1 << 64) - (1 << 63)
+        self.written[cell] = value
+
+
+# Handlers that move control anywhere but the next instruction
+TRANSFER_HANDLERS = {VirtualMachine._call, VirtualMachine._return, VirtualMachine._jump,
+                     VirtualMachine._jump_if_zero, VirtualMachine._jump_if_not_zero,
+                     VirtualMachine._halt}
+
+
+def execute_assembly_code(assembly_code, **limits):
+    """Run generated assembly and describe the globals it leaves behind.
+
+    limits are passed on to the VirtualMachine; a run one of them stops,
+    or that faults, ends its description with where and why it stopped,
+    so callers that show the description need no error handling of their own.
+    """
+    vm = VirtualMachine(assembly_code, **limits).run()
+    if vm.status == COMPLETED:
+        return vm.memory_dump()
+    return "\n".join(filter(None, [vm.memory_dump(), vm.result().describe()]))
+
+
+def run_assembly_code(assembly_code, **limits):
+    """Run generated assembly and return its ExecutionResult."""
+    return VirtualMachine(assembly_code, **limits).run().result()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    argument_parser = argparse.ArgumentParser(
+        description="Run generated Enigma assembly and print the resulting globals.")
+    argument_parser.add_argument('assembly_file')
+    argument_parser.add_argument('--jit', action='store_true',
+                                 help="compile hot loops to Python functions")
+    argument_parser.add_argument('--max-instructions', type=int)
+    argument_parser.add_argument('--timeout', type=float, help="seconds")
+    argument_parser.add_argument('--max-cells', type=int, help="memory cells, globals included")
+    argument_parser.add_argument('--json', action='store_true',
+                                 help="print the execution result as JSON")
+    arguments = argument_parser.parse_args()
+
+    with open(arguments.assembly_file) as file:
+        assembly_code = file.read()
+    limits = {'max_instructions': arguments.max_instructions, 'timeout': arguments.timeout,
+              'max_cells': arguments.max_cells}
+    if arguments.jit:
+        from jit import CompilingVirtualMachine
+        vm = CompilingVirtualMachine(assembly_code, **limits).run()
+    else:
+        vm = VirtualMachine(assembly_code, **limits).run()
+    if arguments.json:
+        print(json.dumps(vm.result().as_dict()))
+    else:
+        print(vm.memory_dump())
+        if vm.status != COMPLETED:
+            print(vm.result().describe())
@@ -0,0 +1,170 @@
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from build import INTERNAL_ERROR, OK, RUNTIME_ERROR, error_status, expand_sources, output_paths
+from cache import ArtifactCache
+from pass_manager import count_instructions_in, parse_level
+from pipeline import Pipeline
+from vm import FAULT
+
+POLL_INTERVAL = 0.25
+
+
+class WatchedFile:
+    """What the watcher last saw of one source file and made of it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = None  # (mtime_ns, size) when last read
+        self.digest = None
+        self.status = None
+        self.message = None
+        self.artifacts = None  # (assembly, optimized assembly) once compiled
+
+
+class Watcher:
+    """Recompiles source files as they change.
+
+    Every poll stats the files; only those whose modification time or
+    size moved are read, and only those whose contents actually changed
+    are compiled again. Compiled artifacts are kept by content, so
+    undoing an edit or copying a file costs no compile at all. The
+    patterns are expanded again on every poll, so new files are picked
+    up and deleted ones dropped.
+
+    The cache holds whole-file results, not tokens or ASTs. A file that
+    did not change is never compiled, so nothing of it is redone, and
+    any edit changes its tokens and so everything after them; finer
+    reuse would save no phase of a compile that actually runs. Programs
+    split into modules get per-module reuse from modules.py instead.
+    """
+
+    def __init__(self, patterns, output_directory=None, level=2, run=False, timeout=5.0,
+                 report=print):
+        self.patterns = patterns
+        self.output_directory = output_directory
+        self.level = level
+        self.run = run
+        self.timeout = timeout
+        self.report = report
+        self.files = {}
+        self.cache = ArtifactCache()
+
+    def poll(self):
+        """Look at every file once; returns the paths compiled again."""
+        paths = expand_sources(self.patterns)
+        for path in set(self.files) - set(paths):
+            del self.files[path]
+            self.report(f"{_clock()} removed  {path}")
+        outputs = (dict(zip(paths, output_paths(paths, self.output_directory)))
+                   if self.output_directory else {})
+        changed = []
+        for path in paths:
+            watched = self.files.setdefault(path, WatchedFile(path))
+            try:
+                stat = os.stat(path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if signature == watched.signature:
+                    continue
+                with open(path, 'rb') as file:
+                    data = file.read()
+            except OSError:
+                continue  # Deleted between the listing and now
+            watched.signature = signature
+            digest = hashlib.sha256(data).hexdigest()
+            if digest == watched.digest:
+                continue  # Touched but not edited
+            watched.digest = digest
+            self.compile(watched, data.decode(errors='replace'), outputs.get(path))
+            changed.append(path)
+        return changed
+
+    def compile(self, watched, source_code, output_path):
+        started = time.perf_counter()
+        key = self.cache.key(source_code, self.level)
+        artifacts = self.cache.get(key)
+        cached = artifacts is not None
+        pipeline = Pipeline(self.level)
+        try:
+            if not cached:
+                artifacts = pipeline.compile(source_code)
+                self.cache.put(key, artifacts)
+            watched.status, watched.message, watched.artifacts = OK, None, artifacts
+        except Exception as e:
+            watched.status, watched.message = error_status(e)
+            watched.artifacts = None
+        milliseconds = (time.perf_counter() - started) * 1000
+        if watched.status != OK:
+            message = watched.message.splitlines()[0] if watched.message else ''
+            self.report(f"{_clock()} {watched.status}  {watched.path} "
+                        f"({milliseconds:.1f} ms): {message}")
+            return
+        assembly_code, optimized_code = artifacts
+        if output_path is not None:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            for suffix, code in (('.asm', assembly_code), ('.opt.asm', optimized_code)):
+                with open(output_path + suffix, 'w') as file:
+                    file.write(code + "\n")
+        self.report(f"{_clock()} compiled {watched.path} in {milliseconds:.1f} ms"
+                    f"{' (cached)' if cached else ''}: "
+                    f"{count_instructions_in(assembly_code.splitlines())} -> "
+                    f"{count_instructions_in(optimized_code.splitlines())} instructions")
+        if self.run:
+            self.execute(watched, pipeline, optimized_code)
+
+    def execute(self, watched, pipeline, optimized_code):
+        """Run a freshly compiled file; a failed run becomes its diagnostic."""
+        try:
+            vm = pipeline.execute(optimized_code, timeout=self.timeout)
+        except Exception as e:
+            watched.status, watched.message = INTERNAL_ERROR, f"{type(e).__name__}: {e}"
+        else:
+            result = vm.result()
+            if result.status != FAULT:
+                self.report("\n".join(filter(None, [vm.memory_dump(), None if result.completed
+                                                    else result.describe()])))
+                return
+            watched.status, watched.message = RUNTIME_ERROR, result.describe()
+        self.report(f"{_clock()} {watched.status}  {watched.path}: {watched.message}")
+
+    def watch(self, interval=POLL_INTERVAL):
+        """Poll until interrupted."""
+        self.poll()
+        failing = sum(1 for watched in self.files.values() if watched.status != OK)
+        self.report(f"{_clock()} watching {len(self.files)} file(s), {failing} failing; "
+                    f"Ctrl-C to stop")
+        while True:
+            time.sleep(interval)
+            self.poll()
+
+
+def _clock():
+    return time.strftime('%H:%M:%S')
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(
+        description="Recompile Enigma source files whenever they change.")
+    argument_parser.add_argument('sources', nargs='+',
+                                 help="files, directories or glob patterns ('src/**/*.enigma')")
+    argument_parser.add_argument('-o', '--output',
+                                 help="also write .asm and .opt.asm artifacts to this directory")
+    argument_parser.add_argument('-O', dest='level', default='2',
+                                 help="optimization level 0-3 (default 2)")
+    argument_parser.add_argument('--run', action='store_true',
+                                 help="run every program after it compiles")
+    argument_parser.add_argument('--timeout', type=float, default=5.0,
+                                 help="seconds before stopping a run (default 5)")
+    argument_parser.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                                 help=f"seconds between polls (default {POLL_INTERVAL})")
+    arguments = argument_parser.parse_args()
+
+    watcher = Watcher(arguments.sources, arguments.output, parse_level(arguments.level),
+                      arguments.run, arguments.timeout)
+    try:
+        watcher.watch(arguments.interval)
+    except KeyboardInterrupt:
+        sys.exit(0)